@@ -0,0 +1,144 @@
+'''Benchmark ``AddParentVectors`` on synthetic dense point sets, against
+rasterizing each point with a distance transform over the whole array. Also
+reports the increase of the peak RSS of the process for both.
+
+Usage:
+
+    python benchmarks/add_parent_vectors.py [--points 100 1000 10000]
+'''
+from gunpowder.morphology import enlarge_binary_map
+from linajea.gunpowder import AddParentVectors, TracksSource
+import argparse
+import gunpowder as gp
+import numpy as np
+import os
+import resource
+import tempfile
+import time
+
+
+def create_tracks_file(filename, num_points, shape, seed=42):
+    '''Random points in a box, each with a random parent in the previous
+    frame.'''
+    rng = np.random.RandomState(seed)
+    num_frames = shape[0]
+    locations = []
+    parents = []
+    with open(filename, 'w') as f:
+        for i in range(num_points):
+            t = i % num_frames
+            location = [t] + [
+                round(rng.uniform(0, s - 0.01), 3) for s in shape[1:]]
+            parent = -1
+            if t > 0:
+                parent = rng.choice(np.arange(t - 1, i, num_frames)) + 1
+            f.write("%d %f %f %f %d %d 0\n" % (
+                t, location[1], location[2], location[3], i + 1, parent))
+            locations.append(np.array(location, dtype=np.float32))
+            parents.append(parent)
+    return locations, parents
+
+
+def draw_whole_array(locations, parents, shape, radius):
+    '''Rasterize each point in frames 1 to ``shape[0] - 1`` with a distance
+    transform over the whole array.'''
+    shape = (shape[0] - 2,) + tuple(shape[1:])
+    mask = np.zeros(shape, dtype=np.bool)
+    parent_vectors = np.zeros((3,) + shape, dtype=np.float32)
+    coords = np.array(
+        np.meshgrid(*[np.arange(s) for s in shape], indexing='ij'),
+        dtype=np.float32)
+    for location, parent in zip(locations, parents):
+        t = int(location[0])
+        if t < 1 or t > shape[0]:
+            continue
+        point_mask = np.zeros(shape, dtype=np.bool)
+        point_mask[(t - 1,) + tuple(location[1:].astype(int))] = 1
+        enlarge_binary_map(point_mask, radius, (1,)*4, in_place=True)
+        mask |= point_mask
+        for c in range(3):
+            parent_vectors[c][point_mask] = (
+                locations[parent - 1][c + 1] - coords[c + 1][point_mask])
+    return parent_vectors, mask
+
+
+def get_peak_rss():
+    '''Peak resident set size of this process in MB.'''
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--points', type=int, nargs='+',
+        default=[100, 1000, 10000])
+    parser.add_argument(
+        '--shape', type=int, nargs=4,
+        default=[3, 40, 200, 200])
+    parser.add_argument(
+        '--radius', type=float, nargs=4,
+        default=[0.1, 8, 8, 8])
+    parser.add_argument(
+        '--whole-array-max-points', type=int, default=100,
+        help="Largest number of points to benchmark the whole array "
+             "rasterization for")
+    args = parser.parse_args()
+
+    shape = tuple(args.shape)
+    radius = np.array(args.radius, dtype=np.float32)
+    points = gp.PointsKey("POINTS")
+    parent_vectors = gp.ArrayKey("PARENT_VECTORS")
+    mask = gp.ArrayKey("MASK")
+    request = gp.BatchRequest()
+    request_roi = gp.Roi((1, 0, 0, 0), (shape[0] - 2,) + shape[1:])
+    request[parent_vectors] = gp.ArraySpec(roi=request_roi)
+    request[mask] = gp.ArraySpec(roi=request_roi)
+
+    # the peak RSS can not be reset within a process, so it is measured once
+    # for all sizes, for the stencil first
+    stencil_times = []
+    whole_array_times = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+
+        tracks = []
+        for num_points in args.points:
+            filename = os.path.join(tmpdir, 'tracks_%d.txt' % num_points)
+            tracks.append(
+                (filename,) + create_tracks_file(filename, num_points, shape))
+
+        rss_before = get_peak_rss()
+        for filename, _, _ in tracks:
+            pipeline = (
+                TracksSource(
+                    filename,
+                    points,
+                    points_spec=gp.PointsSpec(
+                        roi=gp.Roi((0, 0, 0, 0), shape))) +
+                AddParentVectors(
+                    points,
+                    parent_vectors,
+                    mask,
+                    radius))
+            with gp.build(pipeline):
+                start = time.time()
+                pipeline.request_batch(request)
+                stencil_times.append(time.time() - start)
+        stencil_rss = get_peak_rss() - rss_before
+
+        for num_points, (_, locations, parents) in zip(args.points, tracks):
+            if num_points > args.whole_array_max_points:
+                whole_array_times.append(float('nan'))
+                continue
+            start = time.time()
+            draw_whole_array(locations, parents, shape, radius)
+            whole_array_times.append(time.time() - start)
+        whole_array_rss = get_peak_rss() - rss_before
+
+    print("%10s %14s %18s" % ("points", "stencil [s]", "whole array [s]"))
+    for num_points, stencil_time, whole_array_time in zip(
+            args.points, stencil_times, whole_array_times):
+        print("%10d %14.3f %18.3f" % (
+            num_points, stencil_time, whole_array_time))
+    print("%10s %14.1f %18.1f" % (
+        "RSS [MB]", stencil_rss, whole_array_rss))
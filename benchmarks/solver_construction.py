@@ -0,0 +1,104 @@
+'''Benchmark ILP construction time of ``Solver`` and ``SparseSolver``
+against the number of candidate edges.
+
+Usage:
+
+    python benchmarks/solver_construction.py [--sizes 1000 10000 100000]
+'''
+from linajea.tracking import Solver, SparseSolver, TrackGraph
+from linajea.tracking import TrackingParameters
+from linajea.tracking.sparse_solver import (
+        track_graph_to_arrays, get_constraints, get_objective, get_pins)
+from scipy.spatial import cKDTree
+import argparse
+import daisy
+import networkx as nx
+import numpy as np
+import time
+
+
+def create_candidate_graph(num_edges, num_frames=10, edges_per_node=4,
+                           seed=42):
+    '''Random cells in a box, with edges to all cells within a radius in
+    the previous frame. The radius is chosen to get ``edges_per_node`` edges
+    per cell on average.'''
+    rng = np.random.RandomState(seed)
+    cells_per_frame = max(1, num_edges // (edges_per_node*(num_frames - 1)))
+    size = 1000.0
+    volume_per_cell = size**3/cells_per_frame
+    radius = (3*edges_per_node*volume_per_cell/(4*np.pi))**(1/3.)
+
+    graph = nx.DiGraph()
+    positions = []
+    for t in range(num_frames):
+        frame_positions = rng.uniform(0, size, size=(cells_per_frame, 3))
+        positions.append(frame_positions)
+        for i, (z, y, x) in enumerate(frame_positions):
+            graph.add_node(
+                t*cells_per_frame + i,
+                t=t, z=z, y=y, x=x, score=rng.uniform())
+    for t in range(1, num_frames):
+        pairs = cKDTree(positions[t]).sparse_distance_matrix(
+            cKDTree(positions[t - 1]), radius, output_type='ndarray')
+        graph.add_edges_from(
+            (t*cells_per_frame + i, (t - 1)*cells_per_frame + j,
+             {'prediction_distance': d})
+            for i, j, d in pairs)
+
+    roi = daisy.Roi((0, 0, 0, 0), (num_frames, size, size, size))
+    return TrackGraph(graph, frame_key='t', roi=roi)
+
+
+def time_function(function, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.time()
+        function()
+        times.append(time.time() - start)
+    return min(times)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--sizes', type=int, nargs='+',
+        default=[1000, 10000, 100000])
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    parameters = TrackingParameters(
+        block_size=[5, 100, 100, 100],
+        context=[2, 100, 100, 100],
+        track_cost=4.0,
+        max_cell_move=10.0,
+        selection_constant=-1.0,
+        weight_node_score=-0.1,
+        weight_edge_score=0.1)
+
+    print("%10s %10s %12s %12s %12s" % (
+        "edges", "nodes", "arrays [s]", "sparse [s]", "solver [s]"))
+    for size in args.sizes:
+        track_graph = create_candidate_graph(size)
+
+        def build_arrays():
+            node_ids, nodes, edges = track_graph_to_arrays(track_graph)
+            get_objective(
+                nodes, edges, parameters,
+                track_graph.begin, track_graph.end, track_graph.roi)
+            get_constraints(
+                nodes, edges, get_pins(track_graph, 'selected'), node_ids)
+
+        arrays_time = time_function(build_arrays, args.repeats)
+        sparse_time = time_function(
+            lambda: SparseSolver(track_graph, parameters, 'selected'),
+            args.repeats)
+        solver_time = time_function(
+            lambda: Solver(track_graph, parameters, 'selected'),
+            args.repeats)
+        print("%10d %10d %12.3f %12.3f %12.3f" % (
+            track_graph.number_of_edges(),
+            track_graph.number_of_nodes(),
+            arrays_time,
+            sparse_time,
+            solver_time))
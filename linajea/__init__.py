@@ -3,7 +3,10 @@ from __future__ import absolute_import
 from .candidate_database import CandidateDatabase
 from .print_time import print_time
 from .load_config import load_config, tracking_params_from_config
-from .parse_tracks_file import parse_tracks_file
+from .parse_tracks_file import (
+        parse_tracks_file, read_tracks_file, iter_tracks_file)
 from .construct_zarr_filename import construct_zarr_filename
 from .check_or_create_db import checkOrCreateDB
 from .datasets import get_source_roi
+from .dataset_statistics import (
+        compute_dataset_statistics, get_dataset_statistics)
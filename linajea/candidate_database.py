@@ -88,34 +88,283 @@ class CandidateDatabase(MongoDbGraphProvider):
         subgraph.remove_nodes_from(unattached_nodes)
         return subgraph
 
-    def reset_selection(self, roi=None, parameter_ids=None):
+    def read_node_arrays(
+            self,
+            roi,
+            node_attrs=None,
+            nodes_filter=None,
+            batch_size=100000):
+        '''Reads the nodes in roi into a struct-of-arrays table, without
+        creating a networkx graph.
+
+        Args:
+
+            roi (``daisy.Roi``):
+
+                The roi to read nodes from.
+
+            node_attrs (``list`` of ``string``, optional):
+
+                Node attributes to read in addition to the id and position.
+
+            nodes_filter (``dict``, optional):
+
+                Only read nodes whose attributes match these values.
+
+            batch_size (``int``, optional):
+
+                Number of documents to fetch per round trip to the database.
+
+        Returns:
+
+            A ``dict`` from attribute names to numpy arrays, sorted by node
+            id. ``id`` is an int64 array and the position attributes (``t``,
+            ``z``, ``y``, ``x``) are float64 arrays. See ``_to_column`` for
+            how other attributes are converted. ``present`` holds a ``dict``
+            from the attributes that are missing for some nodes to boolean
+            arrays of whether each node has the attribute.
+        '''
+        if node_attrs is None:
+            node_attrs = []
+        keys = ['id'] + list(self.position_attribute) + [
+            attr for attr in node_attrs
+            if attr not in self.position_attribute and attr != 'id']
+
+        query = self._pos_query(roi)
+        if nodes_filter:
+            query.update(nodes_filter)
+        projection = {'_id': False}
+        projection.update({key: True for key in keys})
+
+        columns = {key: [] for key in keys}
+        try:
+            self._MongoDbGraphProvider__connect()
+            self._MongoDbGraphProvider__open_db()
+            self._MongoDbGraphProvider__open_collections()
+            cursor = self.nodes.find(query, projection).batch_size(batch_size)
+            for node in cursor:
+                for key in keys:
+                    columns[key].append(node.get(key))
+        finally:
+            self._MongoDbGraphProvider__disconnect()
+
+        nodes = {
+            'id': np.array(columns.pop('id'), dtype=np.int64).reshape(-1)
+        }
+        for dim in self.position_attribute:
+            nodes[dim] = np.array(columns.pop(dim), dtype=np.float64)
+        present = {}
+        for key, values in columns.items():
+            nodes[key], present[key] = _to_column(values)
+        present = {
+            key: mask for key, mask in present.items() if mask is not None}
+
+        order = np.argsort(nodes['id'], kind='stable')
+        nodes = {key: values[order] for key, values in nodes.items()}
+        nodes['present'] = {
+            key: mask[order] for key, mask in present.items()}
+        return nodes
+
+    def read_edge_arrays(
+            self,
+            nodes,
+            edge_attrs=None,
+            edges_filter=None,
+            batch_size=100000):
+        '''Reads the edges starting at the given nodes into a struct-of-arrays
+        table, without creating a networkx graph.
+
+        Args:
+
+            nodes (``dict``):
+
+                Node table as returned by ``read_node_arrays``.
+
+            edge_attrs (``list`` of ``string``, optional):
+
+                Edge attributes to read in addition to the endpoints.
+
+            edges_filter (``dict``, optional):
+
+                Only read edges whose attributes match these values.
+
+            batch_size (``int``, optional):
+
+                Number of documents to fetch per round trip to the database.
+
+        Returns:
+
+            A ``dict`` from attribute names to numpy arrays. The endpoint
+            ids are stored as int64 arrays under the endpoint names (default
+            ``source`` and ``target``), and their positions in the node table
+            as ``source_index`` and ``target_index`` (-1 for targets that are
+            not in the node table). Edges are sorted by ``source_index``,
+            and ``indptr`` holds the CSR offsets, so that the edges of node
+            ``i`` are ``indptr[i]:indptr[i + 1]``. As for the nodes,
+            ``present`` holds a ``dict`` from the attributes that are missing
+            for some edges (e.g., the ``selected`` key of edges that were not
+            solved yet) to boolean arrays of whether each edge has it.
+        '''
+        if edge_attrs is None:
+            edge_attrs = []
+        u, v = self.endpoint_names
+        keys = [u, v] + [attr for attr in edge_attrs if attr not in (u, v)]
+
+        projection = {'_id': False}
+        projection.update({key: True for key in keys})
+        node_ids = [int(i) for i in nodes['id']]
+
+        columns = {key: [] for key in keys}
+        try:
+            self._MongoDbGraphProvider__connect()
+            self._MongoDbGraphProvider__open_db()
+            self._MongoDbGraphProvider__open_collections()
+            # limit query to 1M node IDs (otherwise we might exceed the 16MB
+            # BSON document size limit)
+            query_size = 1000000
+            for i in range(0, len(node_ids), query_size):
+                query = {u: {'$in': node_ids[i:i + query_size]}}
+                if edges_filter:
+                    query.update(edges_filter)
+                cursor = self.edges.find(query, projection).batch_size(
+                    batch_size)
+                for edge in cursor:
+                    for key in keys:
+                        columns[key].append(edge.get(key))
+        finally:
+            self._MongoDbGraphProvider__disconnect()
+
+        edges = {
+            u: np.array(columns.pop(u), dtype=np.int64).reshape(-1),
+            v: np.array(columns.pop(v), dtype=np.int64).reshape(-1),
+        }
+        present = {}
+        for key, values in columns.items():
+            edges[key], present[key] = _to_column(values)
+        present = {
+            key: mask for key, mask in present.items() if mask is not None}
+
+        source_index = _index_of(nodes['id'], edges[u])
+        order = np.argsort(source_index, kind='stable')
+        edges = {key: values[order] for key, values in edges.items()}
+        edges['present'] = {
+            key: mask[order] for key, mask in present.items()}
+        edges['source_index'] = source_index[order]
+        edges['target_index'] = _index_of(nodes['id'], edges[v])
+        edges['indptr'] = np.concatenate((
+            [0],
+            np.cumsum(np.bincount(
+                edges['source_index'],
+                minlength=len(nodes['id']))))).astype(np.int64)
+        return edges
+
+    def read_arrays(
+            self,
+            roi,
+            node_attrs=None,
+            edge_attrs=None,
+            nodes_filter=None,
+            edges_filter=None):
+        '''Reads the nodes in roi and the edges starting at them into
+        struct-of-arrays tables. This needs a fraction of the memory and time
+        of ``get_graph`` for large rois. See ``read_node_arrays`` and
+        ``read_edge_arrays`` for the arguments and the returned tables.
+
+        Returns:
+
+            A tuple ``(nodes, edges)`` of ``dict`` from attribute names to
+            numpy arrays.
+        '''
+        nodes = self.read_node_arrays(
+            roi,
+            node_attrs=node_attrs,
+            nodes_filter=nodes_filter)
+        edges = self.read_edge_arrays(
+            nodes,
+            edge_attrs=edge_attrs,
+            edges_filter=edges_filter)
+        return nodes, edges
+
+    def _pos_query(self, roi):
+        query = {}
+        for dim, begin, end in zip(
+                self.position_attribute,
+                roi.get_begin(),
+                roi.get_end()):
+            bounds = {}
+            if begin is not None:
+                bounds['$gte'] = begin
+            if end is not None:
+                bounds['$lt'] = end
+            if bounds:
+                query[dim] = bounds
+        return query
+
+    def reset_selection(self, roi=None, parameter_ids=None, batch_size=10000):
         ''' Removes all selections for self.parameters_id from mongodb
         edges collection
+
+        Args:
+
+            roi (``daisy.Roi``, optional):
+
+                If given, only reset the selection of edges whose source is
+                in roi. Otherwise, reset all edges and drop the daisy
+                collections of the solve steps.
+
+            parameter_ids (``list``, optional):
+
+                The ids of the parameters to reset the selection for, instead
+                of self.parameters_id. All ``selected_<id>`` fields are
+                removed in the same pass over the edges.
+
+            batch_size (``int``, optional):
+
+                If roi is given, the node ids in roi are read in chunks of
+                this size, and the edges of each chunk are updated with one
+                query on the indexed source field.
         '''
         if self.parameters_id is None and parameter_ids is None:
             logger.warn("No parameters id stored or provided:"
                         " cannot reset selection")
             return
 
-        if roi:
-            nodes = self.read_nodes(roi)
-            node_ids = list([int(np.int64(n['id'])) for n in nodes])
-            query = {self.endpoint_names[0]: {'$in': node_ids}}
-        else:
-            query = {}
-
         if not parameter_ids:
             parameter_ids = [self.parameters_id]
         logger.info("Resetting solution for parameter ids %s",
                     parameter_ids)
         start_time = time.time()
-        self._MongoDbGraphProvider__connect()
-        self._MongoDbGraphProvider__open_db()
-        edge_coll = self.database['edges']
         update = {}
         for _id in parameter_ids:
             update['selected_' + str(_id)] = ""
-        edge_coll.update_many(query, {'$unset': update})
+        self._MongoDbGraphProvider__connect()
+        self._MongoDbGraphProvider__open_db()
+        self._MongoDbGraphProvider__open_collections()
+        edge_coll = self.database['edges']
+        if roi:
+            cursor = self.nodes.find(
+                self._pos_query(roi),
+                {'_id': False, 'id': True}).batch_size(batch_size)
+            num_nodes = 0
+            num_edges = 0
+            chunk = []
+            for node in cursor:
+                chunk.append(node['id'])
+                if len(chunk) == batch_size:
+                    num_edges += self.__reset_selection_of_sources(
+                        edge_coll, chunk, update)
+                    num_nodes += len(chunk)
+                    chunk = []
+                    logger.info(
+                        "Reset %d edges of %d nodes so far", num_edges,
+                        num_nodes)
+            if chunk:
+                num_edges += self.__reset_selection_of_sources(
+                    edge_coll, chunk, update)
+                num_nodes += len(chunk)
+            logger.info("Reset %d edges of %d nodes", num_edges, num_nodes)
+        else:
+            edge_coll.update_many({}, {'$unset': update})
         if roi is None:
             for _id in parameter_ids:
                 daisy_coll_name = 'solve_' + str(_id) + '_daisy'
@@ -124,6 +373,16 @@ class CandidateDatabase(MongoDbGraphProvider):
                     " took %d seconds",
                     parameter_ids, roi, time.time() - start_time)
 
+    def __reset_selection_of_sources(self, edge_coll, node_ids, update):
+
+        # only edges that have one of the fields need to be written
+        query = {
+            self.endpoint_names[0]: {'$in': node_ids},
+            '$or': [{key: {'$exists': True}} for key in update],
+        }
+        result = edge_coll.update_many(query, {'$unset': update})
+        return result.modified_count
+
     def get_parameters_id(
             self,
             tracking_parameters,
@@ -307,23 +566,168 @@ class CandidateDatabase(MongoDbGraphProvider):
         finally:
             self._MongoDbGraphProvider__disconnect()
 
-    def get_nodes_roi(self):
-        start = []
-        end = []
+    def write_scores(self, reports, frames=None):
+        '''Writes the scores for several parameters_ids at once, like
+        ``write_score``, with one query for the parameters and one bulk
+        write for the scores.
+
+        Args:
+
+            reports (``dict``):
+
+                Dictionary from parameters_id to the ``Report`` to write.
+
+            frames (``list`` of ``int``, optional):
+
+                The frames the reports were computed for, see
+                ``write_score``.
+        '''
+        if len(reports) == 0:
+            return
+        self._MongoDbGraphProvider__connect()
+        self._MongoDbGraphProvider__open_db()
+        try:
+            params_collection = self.database['parameters']
+            parameters = {
+                params['_id']: params
+                for params in params_collection.find(
+                    {'_id': {'$in': list(reports.keys())}})
+            }
+
+            if frames is None:
+                score_collection = self.database['scores']
+            else:
+                score_collection = self.database[
+                    'scores'+"_".join(str(f) for f in frames)]
+
+            requests = []
+            for parameters_id, report in reports.items():
+                if frames is None:
+                    query = {'_id': parameters_id}
+                else:
+                    query = {'param_id': parameters_id,
+                             'frame_start': frames[0],
+                             'frame_end': frames[1]}
+                eval_dict = dict(query)
+                if parameters_id in parameters:
+                    params = parameters[parameters_id]
+                    del params['_id']
+                    eval_dict.update(params)
+                else:
+                    logger.warning("No parameters with id %d. Saving with "
+                                   "key only", parameters_id)
+                eval_dict.update(report.__dict__)
+                requests.append(pymongo.ReplaceOne(
+                    query, eval_dict, upsert=True))
+            score_collection.bulk_write(requests, ordered=False)
+            logger.info("Wrote %d scores for frames %s",
+                        len(requests), frames)
+        finally:
+            self._MongoDbGraphProvider__disconnect()
+
+    def get_nodes_roi(self, recompute=False):
+        '''Get the bounding roi of all nodes.
+
+        The bounds are computed with a single aggregation over the nodes
+        and stored in the metadata of the graph, where ``WriteCells`` keeps
+        them up to date. Later calls return the stored bounds. Set
+        ``recompute`` if nodes were added by other means since.
+
+        Returns ``None`` if there are no nodes.
+        '''
         try:
             self._MongoDbGraphProvider__connect()
             self._MongoDbGraphProvider__open_db()
             self._MongoDbGraphProvider__open_collections()
-            for dim in self.position_attribute:
-                smallest_entry = self.nodes.find().sort([(dim, 1)]).limit(1)[0]
-                start.append(smallest_entry[dim])
-                largest_entry = self.nodes.find().sort([(dim, -1)]).limit(1)[0]
-                end.append(largest_entry[dim] + 1)
-
-            offset = Coordinate(start)
-            end = Coordinate(end)
-            size = end - offset
-            nodes_roi = Roi(offset, size)
+            metadata = self.meta.find_one(
+                {},
+                {'nodes_roi_begin': True, 'nodes_roi_end': True})
+            if not recompute and metadata and\
+                    'nodes_roi_begin' in metadata and\
+                    'nodes_roi_end' in metadata:
+                begin = metadata['nodes_roi_begin']
+                end = metadata['nodes_roi_end']
+            else:
+                group = {'_id': None}
+                for dim in self.position_attribute:
+                    group['begin_' + dim] = {'$min': '$' + dim}
+                    group['end_' + dim] = {'$max': '$' + dim}
+                bounds = list(self.nodes.aggregate([{'$group': group}]))
+                if not bounds:
+                    return None
+                begin = {
+                    dim: bounds[0]['begin_' + dim]
+                    for dim in self.position_attribute}
+                end = {
+                    dim: bounds[0]['end_' + dim] + 1
+                    for dim in self.position_attribute}
+                self.meta.update_one(
+                    {},
+                    {'$set': {'nodes_roi_begin': begin,
+                              'nodes_roi_end': end}})
+
+            offset = Coordinate(
+                begin[dim] for dim in self.position_attribute)
+            end = Coordinate(end[dim] for dim in self.position_attribute)
+            nodes_roi = Roi(offset, end - offset)
         finally:
             self._MongoDbGraphProvider__disconnect()
         return nodes_roi
+
+
+def update_nodes_roi(meta, begin, end):
+    '''Grow the bounds of the nodes stored by
+    ``CandidateDatabase.get_nodes_roi`` in the metadata collection ``meta``
+    to include ``begin`` (inclusive) and ``end`` (exclusive), given as dicts
+    from position attribute to value. Does nothing if no bounds are stored
+    yet, since those would not include nodes written before.
+    '''
+    update = {
+        '$min': {'nodes_roi_begin.' + dim: value
+                 for dim, value in begin.items()},
+        '$max': {'nodes_roi_end.' + dim: value
+                 for dim, value in end.items()},
+    }
+    meta.update_one({'nodes_roi_begin': {'$exists': True}}, update)
+
+
+def _to_column(values):
+    '''Converts a list of attribute values (``None`` if missing) into a numpy
+    array. Lists (e.g., parent vectors) become 2D float arrays, booleans
+    become bool arrays (missing is ``False``), and numbers become float64
+    arrays (missing is NaN). Anything else is kept in an object array.
+
+    Returns a tuple of the array and a boolean array of which values are
+    present, or ``None`` if all of them are.'''
+    present = np.array([value is not None for value in values], dtype=bool)
+    if np.all(present):
+        present = None
+    present_values = [value for value in values if value is not None]
+    if len(present_values) == 0:
+        return np.full(len(values), np.nan), present
+    first = present_values[0]
+    if isinstance(first, bool):
+        column = np.array([bool(value) for value in values], dtype=bool)
+    elif isinstance(first, (list, tuple)):
+        width = len(first)
+        missing = [np.nan]*width
+        column = np.array(
+            [value if value is not None else missing for value in values],
+            dtype=np.float64).reshape(-1, width)
+    elif isinstance(first, (int, float, np.number)):
+        column = np.array(
+            [value if value is not None else np.nan for value in values],
+            dtype=np.float64)
+    else:
+        column = np.empty(len(values), dtype=object)
+        column[:] = values
+    return column, present
+
+
+def _index_of(sorted_ids, ids):
+    '''Returns the positions of ids in sorted_ids, -1 where not present.'''
+    index = np.searchsorted(sorted_ids, ids)
+    index[index == len(sorted_ids)] = 0
+    found = sorted_ids[index] == ids if len(sorted_ids) else \
+        np.zeros(len(ids), dtype=bool)
+    return np.where(found, index, -1).astype(np.int64)
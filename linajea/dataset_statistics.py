@@ -0,0 +1,175 @@
+import itertools
+import logging
+import time
+
+import numpy as np
+import zarr
+
+logger = logging.getLogger(__name__)
+
+
+def compute_dataset_statistics(
+        filename,
+        ds_name,
+        block_shape=None,
+        percentiles=(0.1, 1, 99, 99.9),
+        num_bins=2**16,
+        store=True):
+    '''Compute global statistics of a zarr dataset (e.g., the raw data), by
+    reading it block by block.
+
+    The ``min``, ``max``, ``mean``, and ``std`` are exact. The ``median``,
+    ``mad`` (median absolute deviation from the median), and ``percentiles``
+    are computed from a histogram, and are exact for integer data of up to
+    16 bits. For other types, they are approximated with ``num_bins`` bins
+    between min and max (which needs a second pass over the data).
+
+    Args:
+
+        filename (``string``):
+
+            The zarr container.
+
+        ds_name (``string``):
+
+            The dataset in the container.
+
+        block_shape (``tuple`` of ``int``, optional):
+
+            The shape of the blocks to read at once. Defaults to the chunk
+            shape of the dataset.
+
+        percentiles (``tuple`` of ``float``):
+
+            The percentiles (between 0 and 100) to compute.
+
+        num_bins (``int``):
+
+            The number of histogram bins for types that are not exact.
+
+        store (``bool``):
+
+            If set, the statistics are stored in the attribute
+            ``statistics`` of the dataset, see ``get_dataset_statistics``.
+
+    Returns:
+
+        A dict with ``min``, ``max``, ``mean``, ``std``, ``median``, ``mad``,
+        and ``percentiles``, a dict from percentile (as string) to value.
+    '''
+
+    start_time = time.time()
+    dataset = zarr.open(filename, mode='r+' if store else 'r')[ds_name]
+    dtype = np.dtype(dataset.dtype)
+    if block_shape is None:
+        block_shape = dataset.chunks
+    exact = np.issubdtype(dtype, np.integer) and dtype.itemsize <= 2
+
+    count = 0
+    mean = 0.0
+    m2 = 0.0
+    mn = None
+    mx = None
+    if exact:
+        # one bin per value
+        offset = np.iinfo(dtype).min
+        counts = np.zeros((2**(8*dtype.itemsize),), dtype=np.int64)
+
+    for block in get_blocks(dataset, block_shape):
+
+        if block.size == 0:
+            continue
+
+        block_mean = block.mean(dtype=np.float64)
+        block_m2 = np.square(block - block_mean, dtype=np.float64).sum()
+
+        # merge with the statistics of the blocks so far
+        total = count + block.size
+        delta = block_mean - mean
+        mean += delta*block.size/total
+        m2 += block_m2 + delta**2*count*block.size/total
+        count = total
+
+        block_mn = block.min()
+        block_mx = block.max()
+        mn = block_mn if mn is None else min(mn, block_mn)
+        mx = block_mx if mx is None else max(mx, block_mx)
+
+        if exact:
+            counts += np.bincount(
+                (block.ravel().astype(np.int64) - offset),
+                minlength=len(counts))
+
+    if count == 0:
+        raise RuntimeError("Dataset %s in %s is empty" % (ds_name, filename))
+
+    if exact:
+        values = np.arange(len(counts)) + offset
+    else:
+        counts = np.zeros((num_bins,), dtype=np.int64)
+        for block in get_blocks(dataset, block_shape):
+            counts += np.histogram(block, bins=num_bins, range=(mn, mx))[0]
+        edges = np.histogram_bin_edges([], bins=num_bins, range=(mn, mx))
+        values = (edges[:-1] + edges[1:])/2
+    values = values[counts > 0]
+    counts = counts[counts > 0]
+
+    median = get_histogram_percentile(values, counts, 50)
+    deviations = np.abs(values - median)
+    order = np.argsort(deviations, kind='stable')
+    mad = get_histogram_percentile(deviations[order], counts[order], 50)
+
+    statistics = {
+        'min': float(mn),
+        'max': float(mx),
+        'mean': float(mean),
+        'std': float(np.sqrt(m2/count)),
+        'median': float(median),
+        'mad': float(mad),
+        'percentiles': {
+            '%g' % q: float(get_histogram_percentile(values, counts, q))
+            for q in percentiles
+        },
+    }
+    logger.info(
+        "Computed statistics of %s in %s in %.3f seconds: %s",
+        ds_name, filename, time.time() - start_time, statistics)
+
+    if store:
+        dataset.attrs['statistics'] = statistics
+
+    return statistics
+
+
+def get_dataset_statistics(filename, ds_name):
+    '''Get the statistics stored by ``compute_dataset_statistics``, or
+    ``None`` if there are none.'''
+
+    dataset = zarr.open(filename, mode='r')[ds_name]
+    return dataset.attrs.get('statistics')
+
+
+def get_blocks(dataset, block_shape):
+    '''Read ``dataset`` in blocks of ``block_shape``.'''
+
+    for begin in itertools.product(*[
+            range(0, s, b)
+            for s, b in zip(dataset.shape, block_shape)]):
+        yield dataset[tuple(
+            slice(b, b + s)
+            for b, s in zip(begin, block_shape))]
+
+
+def get_histogram_percentile(values, counts, q):
+    '''Get the ``q``-th percentile (between 0 and 100) of data with the given
+    sorted ``values`` and their ``counts``, interpolated linearly as in
+    ``np.percentile``.'''
+
+    cumulative = np.cumsum(counts)
+    position = q/100*(cumulative[-1] - 1)
+    lower = np.floor(position)
+    lower_value = values[np.searchsorted(cumulative, lower, side='right')]
+    upper_value = values[
+        np.searchsorted(cumulative, np.ceil(position), side='right')]
+
+    return lower_value + (upper_value - lower_value)*(position - lower)
@@ -1,8 +1,8 @@
 # flake8: noqa
-from .evaluate import evaluate
+from .evaluate import evaluate, evaluate_in_windows, GroundTruthCache
 from .match import match_edges
 from .match_nodes import match_nodes
-from .evaluate_setup import evaluate_setup
+from .evaluate_setup import evaluate_setup, evaluate_setups
 from .report import Report
 from .validation_metric import validation_score
 from .analyze_results import (
@@ -1,6 +1,10 @@
 from .match import match_edges
 from .evaluator import Evaluator
+from .validation_metric import split_into_tracks
+from linajea.tracking import TrackGraph
+import daisy
 import logging
+import networkx as nx
 
 logger = logging.getLogger(__name__)
 
@@ -9,10 +13,16 @@ def evaluate(
         gt_track_graph,
         rec_track_graph,
         matching_threshold,
-        sparse):
+        sparse,
+        matching_backend='ilp',
+        gt_cache=None):
     ''' Performs both matching and evaluation on the given
     gt and reconstructed tracks, and returns a Report
     with the results.
+
+    If ``gt_cache`` (a ``GroundTruthCache`` of ``gt_track_graph``) is
+    given, the KD-trees and tracks of the gt stored in it are used instead
+    of computing them again.
     '''
     logger.info("Checking validity of reconstruction")
     Evaluator.check_track_validity(rec_track_graph)
@@ -21,10 +31,114 @@ def evaluate(
         match_edges(
             gt_track_graph,
             rec_track_graph,
-            matching_threshold)
+            matching_threshold,
+            matching_backend=matching_backend,
+            frame_cache_x=gt_cache.frames if gt_cache else None)
     logger.info("Done matching. Evaluating")
     edge_matches = [(gt_edges[gt_ind], rec_edges[rec_ind])
                     for gt_ind, rec_ind in edge_matches]
+    evaluator = Evaluator(
+            gt_track_graph,
+            rec_track_graph,
+            edge_matches,
+            unselected_potential_matches,
+            sparse=sparse,
+            gt_track_labels=gt_cache.track_labels if gt_cache else None,
+            gt_validation_tracks=(
+                gt_cache.validation_tracks if gt_cache else None))
+    return evaluator.evaluate()
+
+
+class GroundTruthCache(object):
+    ''' Everything ``evaluate`` computes from the gt track graph alone, to
+    evaluate several reconstructions against the same gt without computing
+    it again: the KD-trees of the gt nodes per frame (filled by the first
+    evaluation), the tracks of the gt, and the tracks split at divisions
+    for the validation score.
+
+    Args:
+        gt_track_graph (`linajea.TrackGraph`):
+            The ground truth track graph. It is not modified.
+    '''
+    def __init__(self, gt_track_graph):
+        self.frames = {}
+        self.track_labels = Evaluator.get_track_labels(gt_track_graph)
+        self.validation_tracks = split_into_tracks(
+            nx.DiGraph(gt_track_graph))
+
+
+def evaluate_in_windows(
+        gt_db,
+        rec_db,
+        roi,
+        window_size,
+        matching_threshold,
+        sparse,
+        matching_backend='ilp'):
+    ''' Same as ``evaluate``, but reads the gt and the selected
+    reconstruction from the given ``CandidateDatabase``s in windows of
+    ``window_size`` frames, and matches the edges in each window right
+    away. Consecutive windows overlap by one frame, so that each edge lies
+    in exactly one window. Since edges are matched per frame, the matches
+    are the same as for the whole ``roi``.
+
+    Only the ids, frames and positions of the nodes and the edges of each
+    window are kept for the track level statistics (tracks span windows),
+    so the candidate nodes without selected edges and all other node and
+    edge attributes never have to be in memory for more than one window.
+
+    Returns a Report with the results, or None if there are no selected
+    edges in ``roi``.
+    '''
+    assert window_size >= 2, "Windows need at least two frames"
+
+    gt_graph = nx.DiGraph()
+    rec_graph = nx.DiGraph()
+    edge_matches = []
+    unselected_potential_matches = 0
+
+    begin = roi.get_begin()[0]
+    end = roi.get_end()[0]
+    window_begin = begin
+    while True:
+        window_end = min(window_begin + window_size, end)
+        window_roi = roi.intersect(daisy.Roi(
+            (window_begin, None, None, None),
+            (window_end - window_begin, None, None, None)))
+        logger.info("Matching edges in %s", window_roi)
+
+        gt_window = TrackGraph(
+            gt_db[window_roi], frame_key='t', roi=window_roi)
+        rec_window = TrackGraph(
+            rec_db.get_selected_graph(window_roi),
+            frame_key='t',
+            roi=window_roi)
+        if gt_window.number_of_nodes() > 0 and\
+                rec_window.number_of_nodes() > 0:
+            gt_edges, rec_edges, window_matches, window_fps =\
+                match_edges(
+                    gt_window,
+                    rec_window,
+                    matching_threshold,
+                    matching_backend=matching_backend)
+            edge_matches += [(gt_edges[gt_ind], rec_edges[rec_ind])
+                             for gt_ind, rec_ind in window_matches]
+            unselected_potential_matches += window_fps
+        _add_to_skeleton(gt_graph, gt_window)
+        _add_to_skeleton(rec_graph, rec_window)
+
+        if window_end >= end:
+            break
+        window_begin = window_end - 1
+
+    if rec_graph.number_of_edges() == 0:
+        return None
+
+    gt_track_graph = TrackGraph(gt_graph, frame_key='t', roi=roi)
+    rec_track_graph = TrackGraph(rec_graph, frame_key='t', roi=roi)
+    logger.info("Checking validity of reconstruction")
+    Evaluator.check_track_validity(rec_track_graph)
+    logger.info("Done matching. Evaluating")
     evaluator = Evaluator(
             gt_track_graph,
             rec_track_graph,
@@ -32,3 +146,12 @@ def evaluate(
             unselected_potential_matches,
             sparse=sparse)
     return evaluator.evaluate()
+
+
+def _add_to_skeleton(graph, track_graph):
+    '''Add the nodes (with only frame and position) and edges of
+    ``track_graph`` to ``graph``.'''
+    graph.add_nodes_from(
+        (node, {key: data[key] for key in ['t', 'z', 'y', 'x']})
+        for node, data in track_graph.nodes(data=True))
+    graph.add_edges_from(track_graph.edges)
@@ -1,13 +1,19 @@
 import linajea.tracking
-from .evaluate import evaluate
+from .evaluate import evaluate, evaluate_in_windows, GroundTruthCache
 from ..datasets import get_source_roi
 import logging
+import multiprocessing
 import daisy
+import networkx as nx
+import numpy as np
 import time
 import sys
 
 logger = logging.getLogger(__name__)
 
+# state shared with forked worker processes, see evaluate_setups
+_worker_state = {}
+
 
 def evaluate_setup(
         sample,
@@ -20,7 +26,18 @@ def evaluate_setup(
         from_scratch=True,
         sparse=True,
         data_dir='../01_data',
+        matching_backend='ilp',
+        window_size=None,
         **kwargs):
+    ''' Evaluate the solution for the given tracking parameters against the
+    ground truth and store the results in the candidate database.
+
+    If ``window_size`` is given, read and match the graphs in windows of
+    that many frames (see ``evaluate_in_windows``) instead of reading them
+    for the whole ``source_roi`` at once. The report is the same.
+
+    All other keyword arguments are passed to ``TrackingParameters``.
+    '''
 
     parameters = linajea.tracking.TrackingParameters(**kwargs)
     if matching_threshold is None:
@@ -40,27 +57,59 @@ def evaluate_setup(
                         (parameters_id, frames))
             return old_score
 
-    voxel_size, source_roi = get_source_roi(data_dir, sample)
-
-    # limit to specific frames, if given
-    if frames:
-        begin, end = frames
-        crop_roi = daisy.Roi(
-            (begin, None, None, None),
-            (end - begin, None, None, None))
-        source_roi = source_roi.intersect(crop_roi)
-
-    # limit to roi, if given
-    if limit_to_roi:
-        source_roi.intersect(limit_to_roi)
-
+    source_roi = _get_roi(sample, data_dir, frames, limit_to_roi)
     logger.info("Evaluating in %s", source_roi)
 
     edges_db = linajea.CandidateDatabase(
             db_name, db_host, parameters_id=parameters_id)
+    gt_db = linajea.CandidateDatabase(gt_db_name, db_host)
+
+    if window_size is not None:
+        logger.info("Evaluating parameters with id %d in windows of %d "
+                    "frames" % (parameters_id, window_size))
+        start_time = time.time()
+        report = evaluate_in_windows(
+                gt_db,
+                edges_db,
+                source_roi,
+                window_size,
+                matching_threshold=matching_threshold,
+                sparse=sparse,
+                matching_backend=matching_backend)
+        if report is None:
+            logger.warn("No selected edges for parameters_id %d. Skipping"
+                        % parameters_id)
+            return
+        logger.info("Evaluated in windows in %s seconds"
+                    % (time.time() - start_time))
+    else:
+        report = _evaluate_whole_roi(
+                edges_db,
+                gt_db,
+                source_roi,
+                parameters_id,
+                matching_threshold,
+                sparse,
+                matching_backend)
+        if report is None:
+            return
+
+    logger.info("Done evaluating results for %d. Saving results to mongo."
+                % parameters_id)
+    results_db.write_score(parameters_id, report, frames=frames)
+
+
+def _evaluate_whole_roi(
+        edges_db,
+        gt_db,
+        source_roi,
+        parameters_id,
+        matching_threshold,
+        sparse,
+        matching_backend):
 
     logger.info("Reading cells and edges in db %s with parameter_id %d"
-                % (db_name, parameters_id))
+                % (edges_db.db_name, parameters_id))
     start_time = time.time()
     subgraph = edges_db.get_selected_graph(source_roi)
 
@@ -72,14 +121,12 @@ def evaluate_setup(
     if subgraph.number_of_edges() == 0:
         logger.warn("No selected edges for parameters_id %d. Skipping"
                     % parameters_id)
-        return
+        return None
     track_graph = linajea.tracking.TrackGraph(
         subgraph, frame_key='t', roi=subgraph.roi)
 
-    gt_db = linajea.CandidateDatabase(gt_db_name, db_host)
-
     logger.info("Reading ground truth cells and edges in db %s"
-                % gt_db_name)
+                % gt_db.db_name)
     start_time = time.time()
     gt_subgraph = gt_db[source_roi]
     logger.info("Read %d cells and %d edges in %s seconds"
@@ -90,12 +137,221 @@ def evaluate_setup(
         gt_subgraph, frame_key='t', roi=gt_subgraph.roi)
 
     logger.info("Matching edges for parameters with id %d" % parameters_id)
-    report = evaluate(
+    return evaluate(
             gt_track_graph,
             track_graph,
             matching_threshold=matching_threshold,
-            sparse=sparse)
+            sparse=sparse,
+            matching_backend=matching_backend)
 
-    logger.info("Done evaluating results for %d. Saving results to mongo."
-                % parameters_id)
-    results_db.write_score(parameters_id, report, frames=frames)
+
+def evaluate_setups(
+        sample,
+        db_host,
+        db_name,
+        gt_db_name,
+        parameters_list,
+        matching_threshold=None,
+        frames=None,
+        limit_to_roi=None,
+        from_scratch=True,
+        sparse=True,
+        data_dir='../01_data',
+        matching_backend='ilp',
+        num_workers=1):
+    ''' Evaluate the solutions for several sets of tracking parameters
+    against the ground truth and store the results in the candidate
+    database. Gives the same results as calling ``evaluate_setup`` for each
+    of them, but reads the ground truth and the candidate edges only once:
+
+        * the gt graph is read once, and its KD-trees and tracks are shared
+          by all evaluations (see ``GroundTruthCache``),
+
+        * the candidate nodes and the edges selected by any of the
+          parameter sets are read once into arrays, with the
+          ``selected_<id>`` attributes of all parameter sets,
+
+        * the scores are written with a single bulk write.
+
+    Args:
+
+        parameters_list (``list`` of ``dict``):
+
+            The keyword arguments for the ``TrackingParameters`` of each
+            parameter set to evaluate.
+
+        num_workers (``int``, optional):
+
+            If larger than one, evaluate the parameter sets in this many
+            forked processes.
+
+    All other arguments are the same as for ``evaluate_setup``.
+
+    Returns a dictionary from parameters id to the ``Report`` (or the
+    stored score, if not ``from_scratch``) of each parameter set, without
+    the parameter sets without selected edges.
+    '''
+    if matching_threshold is None:
+        logger.error("No matching threshold for evaluation")
+        sys.exit()
+
+    results_db = linajea.CandidateDatabase(db_name, db_host)
+    parameters_ids = [
+        results_db.get_parameters_id(
+            linajea.tracking.TrackingParameters(**kwargs))
+        for kwargs in parameters_list
+    ]
+
+    results = {}
+    if not from_scratch:
+        for parameters_id in parameters_ids:
+            old_score = results_db.get_score(parameters_id, frames=frames)
+            if old_score:
+                logger.info("Already evaluated %d (frames: %s). Skipping" %
+                            (parameters_id, frames))
+                results[parameters_id] = old_score
+    parameters_ids = [
+        parameters_id for parameters_id in parameters_ids
+        if parameters_id not in results
+    ]
+    if len(parameters_ids) == 0:
+        return results
+
+    source_roi = _get_roi(sample, data_dir, frames, limit_to_roi)
+    logger.info("Evaluating %d parameter sets in %s",
+                len(parameters_ids), source_roi)
+
+    gt_db = linajea.CandidateDatabase(gt_db_name, db_host)
+    logger.info("Reading ground truth cells and edges in db %s"
+                % gt_db.db_name)
+    start_time = time.time()
+    gt_subgraph = gt_db[source_roi]
+    logger.info("Read %d cells and %d edges in %s seconds"
+                % (gt_subgraph.number_of_nodes(),
+                   gt_subgraph.number_of_edges(),
+                   time.time() - start_time))
+    gt_track_graph = linajea.tracking.TrackGraph(
+        gt_subgraph, frame_key='t', roi=gt_subgraph.roi)
+    gt_cache = GroundTruthCache(gt_track_graph)
+
+    selected_keys = ['selected_' + str(i) for i in parameters_ids]
+    logger.info("Reading cells and edges selected by any of the parameter "
+                "sets in db %s" % db_name)
+    start_time = time.time()
+    nodes, edges = results_db.read_arrays(
+        source_roi,
+        edge_attrs=selected_keys,
+        edges_filter={'$or': [{key: True} for key in selected_keys]})
+    logger.info("Read %d cells and %d edges in %s seconds"
+                % (len(nodes['id']), len(edges['source']),
+                   time.time() - start_time))
+
+    _worker_state.update({
+        'gt_track_graph': gt_track_graph,
+        'gt_cache': gt_cache,
+        'nodes': nodes,
+        'edges': edges,
+        'roi': source_roi,
+        'matching_threshold': matching_threshold,
+        'sparse': sparse,
+        'matching_backend': matching_backend,
+    })
+    try:
+        if num_workers <= 1 or len(parameters_ids) <= 1:
+            reports = [_evaluate_selected(i) for i in parameters_ids]
+        else:
+            context = multiprocessing.get_context('fork')
+            with context.Pool(min(num_workers, len(parameters_ids))) as pool:
+                reports = pool.map(
+                    _evaluate_selected, parameters_ids, chunksize=1)
+    finally:
+        _worker_state.clear()
+
+    reports = {
+        parameters_id: report
+        for parameters_id, report in zip(parameters_ids, reports)
+        if report is not None
+    }
+    logger.info("Done evaluating results for %d parameter sets. Saving "
+                "results to mongo." % len(reports))
+    results_db.write_scores(reports, frames=frames)
+    results.update(reports)
+    return results
+
+
+def _get_roi(sample, data_dir, frames, limit_to_roi):
+
+    voxel_size, source_roi = get_source_roi(data_dir, sample)
+
+    # limit to specific frames, if given
+    if frames:
+        begin, end = frames
+        crop_roi = daisy.Roi(
+            (begin, None, None, None),
+            (end - begin, None, None, None))
+        source_roi = source_roi.intersect(crop_roi)
+
+    # limit to roi, if given
+    if limit_to_roi:
+        source_roi = source_roi.intersect(limit_to_roi)
+
+    return source_roi
+
+
+def _evaluate_selected(parameters_id):
+    '''Evaluate the edges selected for ``parameters_id`` in the candidate
+    arrays in ``_worker_state`` against the cached ground truth.'''
+
+    state = _worker_state
+    selected_key = 'selected_' + str(parameters_id)
+    subgraph = _get_selected_graph(
+        state['nodes'], state['edges'], selected_key)
+    logger.info("Parameters with id %d selected %d cells and %d edges"
+                % (parameters_id, subgraph.number_of_nodes(),
+                   subgraph.number_of_edges()))
+    if subgraph.number_of_edges() == 0:
+        logger.warn("No selected edges for parameters_id %d. Skipping"
+                    % parameters_id)
+        return None
+    track_graph = linajea.tracking.TrackGraph(
+        subgraph, frame_key='t', roi=state['roi'])
+
+    logger.info("Matching edges for parameters with id %d" % parameters_id)
+    return evaluate(
+            state['gt_track_graph'],
+            track_graph,
+            matching_threshold=state['matching_threshold'],
+            sparse=state['sparse'],
+            matching_backend=state['matching_backend'],
+            gt_cache=state['gt_cache'])
+
+
+def _get_selected_graph(nodes, edges, selected_key):
+    '''The same graph as ``CandidateDatabase.get_selected_graph``, with only
+    the frame and position of the nodes, from the arrays returned by
+    ``CandidateDatabase.read_arrays``. Edges to nodes outside of the arrays
+    are left out, as ``TrackGraph`` would remove them.'''
+
+    selected = edges.get(selected_key)
+    if selected is None or selected.dtype != bool:
+        # no edge has the attribute
+        selected = np.zeros(len(edges['source']), dtype=bool)
+    source_index = edges['source_index'][selected]
+    target_index = edges['target_index'][selected]
+    node_index = np.unique(np.concatenate(
+        (source_index, target_index[target_index >= 0])))
+
+    graph = nx.DiGraph()
+    graph.add_nodes_from(
+        (node, {'t': t, 'z': z, 'y': y, 'x': x})
+        for node, t, z, y, x in zip(
+            nodes['id'][node_index].tolist(),
+            nodes['t'][node_index].astype(np.int64).tolist(),
+            nodes['z'][node_index].tolist(),
+            nodes['y'][node_index].tolist(),
+            nodes['x'][node_index].tolist()))
+    in_roi = target_index >= 0
+    graph.add_edges_from(zip(
+        nodes['id'][source_index[in_roi]].tolist(),
+        nodes['id'][target_index[in_roi]].tolist()))
+    return graph
@@ -1,6 +1,9 @@
 import logging
 import math
-import networkx as nx
+import numpy as np
+import scipy.sparse
+import scipy.sparse.csgraph
+from linajea.tracking import CompactTrackGraph
 from .report import Report
 from .validation_metric import validation_score
 
@@ -33,6 +36,17 @@ class Evaluator:
             True if the ground truth data is sparse, false if it is
             dense. Changes how edge and division false positives
             are counted. Defaults to true.
+
+        gt_track_labels (tuple of (int, dict), optional):
+            The tracks of the ground truth, as returned by
+            ``Evaluator.get_track_labels(gt_track_graph)``, if already
+            computed
+
+        gt_validation_tracks (list of networkx.DiGraph, optional):
+            The tracks of the ground truth split at divisions, as returned
+            by ``split_into_tracks``, if already computed. Otherwise
+            ``gt_track_graph`` is split (and modified) to compute the
+            validation score
     '''
     def __init__(
             self,
@@ -40,7 +54,9 @@ class Evaluator:
             rec_track_graph,
             edge_matches,
             unselected_potential_matches,
-            sparse=True
+            sparse=True,
+            gt_track_labels=None,
+            gt_validation_tracks=None
             ):
         self.report = Report()
 
@@ -49,12 +65,16 @@ class Evaluator:
         self.edge_matches = edge_matches
         self.unselected_potential_matches = unselected_potential_matches
         self.sparse = sparse
+        self.gt_validation_tracks = gt_validation_tracks
 
         # get tracks
-        self.gt_tracks = gt_track_graph.get_tracks()
-        self.rec_tracks = rec_track_graph.get_tracks()
+        if gt_track_labels is None:
+            gt_track_labels = self.get_track_labels(gt_track_graph)
+        self.num_gt_tracks, self.edges_to_track_id_gt = gt_track_labels
+        self.num_rec_tracks, self.edges_to_track_id_rec =\
+            self.get_track_labels(rec_track_graph)
         logger.debug("Found %d gt tracks and %d rec tracks"
-                     % (len(self.gt_tracks), len(self.rec_tracks)))
+                     % (self.num_gt_tracks, self.num_rec_tracks))
         self.matched_track_ids = self.__get_track_matches()
 
         # get track statistics
@@ -62,8 +82,8 @@ class Evaluator:
         for y_matches in self.matched_track_ids.values():
             rec_matched_tracks.update(y_matches)
         self.report.set_track_stats(
-                len(self.gt_tracks),
-                len(self.rec_tracks),
+                self.num_gt_tracks,
+                self.num_rec_tracks,
                 len(self.matched_track_ids.keys()),
                 len(rec_matched_tracks))
 
@@ -326,33 +346,30 @@ class Evaluator:
         '''
         logger.info("Getting AEFTL and ERL")
 
-        rec_matched_edges = self.rec_edges_to_gt_edges.keys()
-        rec_matched_graph = self.rec_track_graph.edge_subgraph(
-                rec_matched_edges).copy()
-        max_node_id = max(list(rec_matched_graph.nodes) + [0])
-        # split at fp_divisions
-        for fp_div_node in self.report.fp_div_rec_nodes:
-            if fp_div_node in rec_matched_graph:
-                prev_edges = list(rec_matched_graph.prev_edges(fp_div_node))
-                next_edges = list(rec_matched_graph.next_edges(fp_div_node))
-            else:
-                continue
-            if len(prev_edges) == 0 or len(next_edges) == 0:
-                continue
-            for prev_edge in prev_edges:
-                rec_matched_graph.remove_edge(prev_edge[0], prev_edge[1])
-                new_node_id = max_node_id + 1
-                rec_matched_graph.add_node(new_node_id)
-                rec_matched_graph.add_edge(new_node_id, prev_edge[1])
-                max_node_id += 1
-        # split into connected components
-        segments = [rec_matched_graph.subgraph(node_set).copy() for node_set in
-                    nx.weakly_connected_components(rec_matched_graph)]
-        logger.debug("Segment node sets: %s"
-                     % list(nx.weakly_connected_components(
-                         rec_matched_graph)))
-        segment_lengths = [g.number_of_edges()
-                           for g in segments if g.number_of_edges() > 0]
+        # split the matched rec edges into segments at fp divisions, by
+        # detaching the prev edge of each fp division node
+        rec_matched_edges = list(self.rec_edges_to_gt_edges.keys())
+        sources = np.array(
+            [u for u, _ in rec_matched_edges], dtype=np.int64)
+        targets = np.array(
+            [v for _, v in rec_matched_edges], dtype=np.int64)
+        node_ids, node_index = np.unique(
+            np.concatenate((sources, targets)), return_inverse=True)
+        sources_index = node_index[:len(sources)]
+        targets_index = node_index[len(sources):]
+        detached = np.flatnonzero(np.isin(
+            sources,
+            np.array(self.report.fp_div_rec_nodes, dtype=np.int64)))
+        sources_index[detached] = len(node_ids) + np.arange(len(detached))
+        num_nodes = len(node_ids) + len(detached)
+        # the number of edges per segment
+        if len(rec_matched_edges) > 0:
+            _, segments = _connected_components(
+                num_nodes, sources_index, targets_index)
+            segment_lengths = np.bincount(segments[targets_index])
+            segment_lengths = segment_lengths[segment_lengths > 0].tolist()
+        else:
+            segment_lengths = []
 
         logger.debug("Found segment lengths %s" % segment_lengths)
         aeftl = 0 if not len(segment_lengths) else \
@@ -379,18 +396,43 @@ class Evaluator:
             "Track has node %d with %d > 2 children" %\
             (list(track_graph.nodes())[max_index], max(in_degrees))
 
+    @staticmethod
+    def get_track_labels(track_graph):
+        ''' Label the tracks (weakly connected components) of
+        ``track_graph`` in a single pass over its edges, without copying
+        each track into its own graph.
+
+        Returns:
+
+            A tuple ``(num_tracks, edge_labels)``, with ``edge_labels`` a
+            dict from each edge ``(u, v)`` to the index of its track.
+        '''
+        if isinstance(track_graph, CompactTrackGraph):
+            num_nodes = track_graph.number_of_nodes()
+            sources = track_graph.sources
+            targets = track_graph.targets
+            edges = zip(
+                track_graph.node_ids[sources].tolist(),
+                track_graph.node_ids[targets].tolist())
+        else:
+            node_index = {
+                node: index for index, node in enumerate(track_graph.nodes)}
+            num_nodes = len(node_index)
+            edges = list(track_graph.edges)
+            sources = np.array(
+                [node_index[u] for u, _ in edges], dtype=np.int64)
+            targets = np.array(
+                [node_index[v] for _, v in edges], dtype=np.int64)
+        if num_nodes == 0:
+            return 0, {}
+
+        num_tracks, labels = _connected_components(
+            num_nodes, sources, targets)
+        return num_tracks, dict(zip(edges, labels[sources].tolist()))
+
     def __get_track_matches(self):
-        self.edges_to_track_id_rec = {}
-        self.edges_to_track_id_gt = {}
         track_ids_gt_to_rec = {}
 
-        for index, track in enumerate(self.rec_tracks):
-            for edge in track.edges():
-                self.edges_to_track_id_rec[edge] = index
-        for index, track in enumerate(self.gt_tracks):
-            for edge in track.edges():
-                self.edges_to_track_id_gt[edge] = index
-
         for gt_edge, rec_edge in self.edge_matches:
             gt_track_id = self.edges_to_track_id_gt[gt_edge]
             rec_track_id = self.edges_to_track_id_rec[rec_edge]
@@ -399,7 +441,25 @@ class Evaluator:
         return track_ids_gt_to_rec
 
     def get_validation_score(self):
+        # the tracks for the validation score are split with networkx
+        gt_track_graph = self.gt_track_graph
+        if isinstance(gt_track_graph, CompactTrackGraph) and\
+                self.gt_validation_tracks is None:
+            gt_track_graph = gt_track_graph.to_track_graph()
+        rec_track_graph = self.rec_track_graph
+        if isinstance(rec_track_graph, CompactTrackGraph):
+            rec_track_graph = rec_track_graph.to_track_graph()
         vald_score = validation_score(
-                self.gt_track_graph,
-                self.rec_track_graph)
+                gt_track_graph,
+                rec_track_graph,
+                gt_tracks=self.gt_validation_tracks)
         self.report.set_validation_score(vald_score)
+
+
+def _connected_components(num_nodes, sources, targets):
+
+    adjacency = scipy.sparse.coo_matrix(
+        (np.ones(len(sources), dtype=np.int8), (sources, targets)),
+        shape=(num_nodes, num_nodes))
+    return scipy.sparse.csgraph.connected_components(
+        adjacency, directed=True, connection='weak')
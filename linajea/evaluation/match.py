@@ -4,13 +4,22 @@ import logging
 import time
 
 import numpy as np
+import scipy.optimize
 import scipy.sparse
+import scipy.sparse.csgraph
 import scipy.spatial
+from linajea.tracking import CompactTrackGraph
 
 logger = logging.getLogger(__name__)
 
 
-def match_edges(track_graph_x, track_graph_y, matching_threshold):
+def match_edges(
+        track_graph_x,
+        track_graph_y,
+        matching_threshold,
+        matching_backend='ilp',
+        timings=None,
+        frame_cache_x=None):
     '''
     Arguments:
 
@@ -21,10 +30,35 @@ def match_edges(track_graph_x, track_graph_y, matching_threshold):
             If the nodes on both ends of an edge are within matching_threshold
             real world units, then they are allowed to be matched
 
+        matching_backend (``string``, optional):
+            How to find the matching in each frame: "ilp" (default) solves
+            an ILP with ``match``, "linear_assignment" uses
+            ``match_linear_assignment``, which gives the same matches and
+            does not need an ILP solver
+
+        timings (``dict``, optional):
+            If given, the time in seconds spent building KD-trees
+            ("kd_tree"), finding candidate edge pairs ("pairing"), and
+            matching them ("assignment") is added to it
+
+        frame_cache_x (``dict``, optional):
+            If given, the nodes and KD-trees of x per frame are stored in
+            and reused from it. Use the same dictionary to match the same
+            ``track_graph_x`` against several ``track_graph_y``
+
     Returns a list of edges in x, a list of edges in y, a list of edge
     matches [(id_x, id_y), ...] referring to indexes in the returned lists,
     and the number of edge false positives
     '''
+    match_function = {
+        'ilp': match,
+        'linear_assignment': match_linear_assignment,
+    }[matching_backend]
+    if timings is None:
+        timings = {}
+    for phase in ['kd_tree', 'pairing', 'assignment']:
+        timings.setdefault(phase, 0)
+
     begin = min(track_graph_x.get_frames()[0], track_graph_x.get_frames()[0])
     end = max(track_graph_x.get_frames()[1], track_graph_x.get_frames()[1]) + 1
 
@@ -36,86 +70,214 @@ def match_edges(track_graph_x, track_graph_y, matching_threshold):
                 "Each edge should have a unique source node"
         edges_y_by_source[u] = (v, edge_id_y)
 
-    # a dictionary from frame ->
-    #       a dictionary of nodes in x ->
-    #           list of (neighboring node in y, distance)
-    node_pairs_xy_by_frame = {}
+    # index the edges in x by the frame of their source node
+    edges_x_by_frame = {}
+    frame_key = track_graph_x.frame_key
+    for edge_id_x, (u, v) in enumerate(edges_x):
+        t = track_graph_x.nodes[u][frame_key]
+        edges_x_by_frame.setdefault(t, []).append(edge_id_x)
+
     edge_matches = []
     edge_fps = 0
+    previous_frame = None
 
     for t in range(begin, end):
-        node_pairs_xy = {}
-        frame_nodes_x = []
-        frame_nodes_y = []
-        positions_x = []
-        positions_y = []
-
-        # get all nodes and their positions in x and y of the current frame
-
-        frame_nodes_x = track_graph_x.cells_by_frame(t)
-        positions_x += [
-            [track_graph_x.nodes[n]['z'],
-             track_graph_x.nodes[n]['y'],
-             track_graph_x.nodes[n]['x']]
-            for n in frame_nodes_x
-        ]
-
-        frame_nodes_y = track_graph_y.cells_by_frame(t)
-        positions_y += [
-            [track_graph_y.nodes[n]['z'],
-             track_graph_y.nodes[n]['y'],
-             track_graph_y.nodes[n]['x']]
-            for n in frame_nodes_y
-        ]
-
-        if len(frame_nodes_x) == 0 or len(frame_nodes_y) == 0:
-            continue
 
-        # get all matching edges and distances between x and y of the current
-        # frame
+        start = time.time()
+        frame = _MatchingFrame(
+            track_graph_x, track_graph_y, t, matching_threshold,
+            frame_cache_x)
+        timings['kd_tree'] += time.time() - start
 
-        kd_tree_x = scipy.spatial.cKDTree(positions_x)
-        kd_tree_y = scipy.spatial.cKDTree(positions_y)
+        if frame.empty:
+            previous_frame = None
+            continue
+        if previous_frame is None:
+            previous_frame = frame
+            continue
 
-        neighbors_xy = kd_tree_x.query_ball_tree(kd_tree_y, matching_threshold)
-        for i, js in enumerate(neighbors_xy):
-            node_x = frame_nodes_x[i]
-            node_x_neighbors = []
-            for j in js:
-                node_y = frame_nodes_y[j]
-                distance = np.linalg.norm(
-                    np.array(positions_x[i]) -
-                    np.array(positions_y[j]))
-                node_x_neighbors.append((node_y, distance))
-            node_pairs_xy[node_x] = node_x_neighbors
-        node_pairs_xy_by_frame[t] = node_pairs_xy
-
-        if t - 1 in node_pairs_xy_by_frame.keys():
-            logger.debug("finding matches in frame %d" % t)
-            node_pairs_two_frames = node_pairs_xy.copy()
-            node_pairs_two_frames.update(node_pairs_xy_by_frame[t-1])
-            edge_costs = get_edge_costs(
-                    edges_x, edges_y_by_source, node_pairs_two_frames)
-            if edge_costs == {}:
-                logger.info("No potential matches with source in frame %d" % t)
-                continue
-            logger.debug("costs: %s" % edge_costs)
-            y_edges_in_range = set(edge[1] for edge in edge_costs.keys())
-            logger.debug("Y edges in range: %s" % y_edges_in_range)
-            edge_matches_in_frame, _ = match(edge_costs,
-                                             2*matching_threshold + 1)
-            edge_matches.extend(edge_matches_in_frame)
-            edge_fps_in_frame = len(y_edges_in_range) -\
-                len(edge_matches_in_frame)
-            edge_fps += edge_fps_in_frame
-            logger.debug(
-                    "Done matching frame %d, found %d matches and %d edge fps",
-                    t, len(edge_matches_in_frame), edge_fps_in_frame)
+        logger.debug("finding matches in frame %d" % t)
+        start = time.time()
+        edge_costs = get_frame_edge_costs(
+            edges_x,
+            edges_x_by_frame.get(t, []),
+            edges_y_by_source,
+            frame,
+            previous_frame)
+        timings['pairing'] += time.time() - start
+        previous_frame = frame
+
+        if edge_costs == {}:
+            logger.info("No potential matches with source in frame %d" % t)
+            continue
+        logger.debug("costs: %s" % edge_costs)
+        y_edges_in_range = set(edge[1] for edge in edge_costs.keys())
+        logger.debug("Y edges in range: %s" % y_edges_in_range)
+
+        start = time.time()
+        edge_matches_in_frame, _ = match_function(
+                edge_costs, 2*matching_threshold + 1)
+        timings['assignment'] += time.time() - start
+
+        edge_matches.extend(edge_matches_in_frame)
+        edge_fps_in_frame = len(y_edges_in_range) -\
+            len(edge_matches_in_frame)
+        edge_fps += edge_fps_in_frame
+        logger.debug(
+                "Done matching frame %d, found %d matches and %d edge fps",
+                t, len(edge_matches_in_frame), edge_fps_in_frame)
     logger.info("Done matching, found %d matches and %d edge fps"
                 % (len(edge_matches), edge_fps))
+    logger.info("Building KD-trees took %.3fs, finding candidate pairs "
+                "%.3fs, matching %.3fs",
+                timings['kd_tree'], timings['pairing'], timings['assignment'])
     return edges_x, edges_y, edge_matches, edge_fps
 
 
+class _MatchingFrame(object):
+    '''The nodes of x and y in frame ``t``, and all pairs of them within
+    ``matching_threshold`` of each other, as arrays.'''
+
+    def __init__(
+            self,
+            track_graph_x,
+            track_graph_y,
+            t,
+            matching_threshold,
+            cache_x=None):
+
+        self.nodes_x = track_graph_x.cells_by_frame(t)
+        self.nodes_y = track_graph_y.cells_by_frame(t)
+        self.empty = len(self.nodes_x) == 0 or len(self.nodes_y) == 0
+        if self.empty:
+            return
+
+        if cache_x is not None and t in cache_x:
+            self.index_x, positions_x, kd_tree_x = cache_x[t]
+        else:
+            self.index_x = {n: i for i, n in enumerate(self.nodes_x)}
+            positions_x = _positions(track_graph_x, self.nodes_x)
+            kd_tree_x = scipy.spatial.cKDTree(positions_x)
+            if cache_x is not None:
+                cache_x[t] = (self.index_x, positions_x, kd_tree_x)
+        self.index_y = {n: i for i, n in enumerate(self.nodes_y)}
+        positions_y = _positions(track_graph_y, self.nodes_y)
+
+        kd_tree_y = scipy.spatial.cKDTree(positions_y)
+        pairs = kd_tree_x.sparse_distance_matrix(
+            kd_tree_y, matching_threshold, output_type='ndarray')
+
+        # pairs sorted by x, then y, as CSR with a row per node in x
+        order = np.lexsort((pairs['j'], pairs['i']))
+        self.pair_x = pairs['i'][order].astype(np.int64)
+        self.pair_y = pairs['j'][order].astype(np.int64)
+        self.pair_distance = np.linalg.norm(
+            positions_x[self.pair_x] - positions_y[self.pair_y], axis=1)
+        self.pair_indptr = np.zeros(len(self.nodes_x) + 1, dtype=np.int64)
+        self.pair_indptr[1:] = np.cumsum(
+            np.bincount(self.pair_x, minlength=len(self.nodes_x)))
+        self.pair_keys = self.pair_x*len(self.nodes_y) + self.pair_y
+
+
+def _positions(track_graph, nodes):
+    if isinstance(track_graph, CompactTrackGraph):
+        index = track_graph.index_of(nodes)
+        return np.stack(
+            [track_graph.node_attrs.values(dim)[index]
+             for dim in ['z', 'y', 'x']],
+            axis=1).astype(np.float64)
+    return np.array(
+        [
+            [track_graph.nodes[n]['z'],
+             track_graph.nodes[n]['y'],
+             track_graph.nodes[n]['x']]
+            for n in nodes
+        ],
+        dtype=np.float64)
+
+
+def get_frame_edge_costs(
+        edges_x,
+        frame_edge_ids_x,
+        edges_y_by_source,
+        frame,
+        previous_frame):
+    '''Same as ``get_edge_costs``, but only for the edges in x with a
+    source in the frame of ``frame`` and a target in the frame of
+    ``previous_frame`` (both ``_MatchingFrame``), using the node pairs
+    within the matching threshold stored in them.
+
+    Arguments:
+        edges_x (list of int):
+            list of edges in x, where each edge is just (u, v).
+            Edge ids in edge_costs will be the list index of each edge
+
+        frame_edge_ids_x (list of int):
+            Ids of the edges in x with a source in the current frame
+
+        edges_y_by_source (dict: int -> (int, int)):
+            Dictionary of y edges, where each entry is
+            u: (v, index from original edges_y list)
+    '''
+    # edges in x between the two frames, as indices into the frame nodes
+    edge_ids_x = []
+    sources_x = []
+    targets_x = []
+    for edge_id_x in frame_edge_ids_x:
+        ux, vx = edges_x[edge_id_x]
+        if vx not in previous_frame.index_x:
+            continue
+        edge_ids_x.append(edge_id_x)
+        sources_x.append(frame.index_x[ux])
+        targets_x.append(previous_frame.index_x[vx])
+    if len(edge_ids_x) == 0:
+        return {}
+    edge_ids_x = np.array(edge_ids_x, dtype=np.int64)
+    sources_x = np.array(sources_x, dtype=np.int64)
+    targets_x = np.array(targets_x, dtype=np.int64)
+
+    # edges in y between the two frames, by index of their source
+    targets_y = np.full(len(frame.nodes_y), -1, dtype=np.int64)
+    edge_ids_y = np.full(len(frame.nodes_y), -1, dtype=np.int64)
+    for i, uy in enumerate(frame.nodes_y):
+        if uy not in edges_y_by_source:
+            continue
+        vy, edge_id_y = edges_y_by_source[uy]
+        if vy not in previous_frame.index_y:
+            continue
+        targets_y[i] = previous_frame.index_y[vy]
+        edge_ids_y[i] = edge_id_y
+
+    # all pairs of a source in x with a source in y within the threshold
+    counts = (frame.pair_indptr[sources_x + 1] -
+              frame.pair_indptr[sources_x])
+    edges = np.repeat(np.arange(len(edge_ids_x)), counts)
+    pairs = (np.repeat(frame.pair_indptr[sources_x] - np.cumsum(counts) +
+                       counts, counts) +
+             np.arange(np.sum(counts)))
+    sources_y = frame.pair_y[pairs]
+    source_distances = frame.pair_distance[pairs]
+
+    # keep those where the source in y has an edge to the previous frame
+    # and the targets are within the threshold as well
+    has_edge = targets_y[sources_y] >= 0
+    edges = edges[has_edge]
+    sources_y = sources_y[has_edge]
+    source_distances = source_distances[has_edge]
+    keys = (targets_x[edges]*len(previous_frame.nodes_y) +
+            targets_y[sources_y])
+    target_pairs = np.searchsorted(previous_frame.pair_keys, keys)
+    target_pairs[target_pairs == len(previous_frame.pair_keys)] = 0
+    in_range = previous_frame.pair_keys[target_pairs] == keys
+
+    costs = (source_distances[in_range] +
+             previous_frame.pair_distance[target_pairs[in_range]])
+    return dict(zip(
+        zip(edge_ids_x[edges[in_range]].tolist(),
+            edge_ids_y[sources_y[in_range]].tolist()),
+        costs.tolist()))
+
+
 def get_edge_costs(edges_x, edges_y_by_source, node_pairs_xy):
     '''
     Arguments:
@@ -252,3 +414,71 @@ def match(costs, no_match_cost):
                 matches.append((id_x, id_y))
 
     return matches, sol_cost
+
+
+def match_linear_assignment(costs, no_match_cost):
+    '''Same as ``match``, but solved as a linear assignment problem with
+    ``scipy.optimize.linear_sum_assignment`` instead of an ILP.
+
+    Matching ``x`` with ``y`` instead of leaving both unmatched changes the
+    cost by ``costs[(x, y)] - 2*no_match_cost``, so the best matching is the
+    minimum linear assignment of those differences, where differences that
+    are not negative are replaced with zero (i.e., not matching). The
+    assignment is solved separately for each connected component of the
+    pairs in ``costs``.
+
+    Arguments:
+
+        costs (``dict`` from ``tuple`` of ids to ``float``):
+            A dictionary from a pair of edges to the cost of matching
+            those edges together. Assumes edges with no provided
+            cost cannot be matched together.
+
+        no_match_cost (``float``):
+            The cost of not matching an edge with anything.
+    '''
+
+    pairs = list(costs.keys())
+    edge_ids_x, index_x = np.unique(
+        np.array([id_x for id_x, _ in pairs]), return_inverse=True)
+    edge_ids_y, index_y = np.unique(
+        np.array([id_y for _, id_y in pairs]), return_inverse=True)
+    n = len(edge_ids_x)
+    m = len(edge_ids_y)
+    gains = np.array(
+        [costs[pair] for pair in pairs], dtype=np.float64) - 2*no_match_cost
+
+    # only pairs that are cheaper to match than to leave unmatched matter
+    candidates = gains < 0
+    index_x = index_x[candidates]
+    index_y = index_y[candidates]
+    gains = gains[candidates]
+
+    adjacency = scipy.sparse.coo_matrix(
+        (np.ones(len(gains)), (index_x, n + index_y)),
+        shape=(n + m, n + m))
+    _, labels = scipy.sparse.csgraph.connected_components(
+        adjacency, directed=False)
+    component = labels[index_x]
+
+    matches = []
+    sol_cost = no_match_cost*(n + m)
+    for label in np.unique(component):
+        in_component = component == label
+        rows, row_index = np.unique(
+            index_x[in_component], return_inverse=True)
+        cols, col_index = np.unique(
+            index_y[in_component], return_inverse=True)
+        component_gains = np.zeros((len(rows), len(cols)), dtype=np.float64)
+        component_gains[row_index, col_index] = gains[in_component]
+
+        assigned_rows, assigned_cols = scipy.optimize.linear_sum_assignment(
+            component_gains)
+        for i, j in zip(assigned_rows, assigned_cols):
+            if component_gains[i, j] < 0:
+                matches.append(
+                    (edge_ids_x[rows[i]].item(), edge_ids_y[cols[j]].item()))
+                sol_cost += component_gains[i, j]
+
+    logger.debug("solution cost: %s", sol_cost)
+    return matches, sol_cost
@@ -2,12 +2,19 @@ import math
 import numpy as np
 import networkx as nx
 import logging
+import scipy.sparse
+import scipy.spatial
 import time
 
 logger = logging.getLogger(__name__)
 
 
-def validation_score(gt_lineages, rec_lineages):
+def validation_score(
+        gt_lineages,
+        rec_lineages,
+        indexed=True,
+        gt_tracks=None,
+        inflect_point=50):
     ''' Args:
 
         gt_lineages (networkx.DiGraph)
@@ -16,6 +23,20 @@ def validation_score(gt_lineages, rec_lineages):
         rec_lineages (networkx.DiGraph)
             Reconstructed cell lineages
 
+        indexed (bool)
+            If True (default), only compare GT tracks to the reconstructed
+            tracks that can be the closest one, see
+            ``indexed_validation_score``. Otherwise, compare all pairs of
+            tracks. Both give the same score.
+
+        gt_tracks (list of networkx.DiGraph)
+            If given, the GT tracks as returned by ``split_into_tracks``,
+            to use instead of splitting ``gt_lineages`` (which modifies it)
+
+        inflect_point (float)
+            The inflection point of the distance normalization, see
+            ``norm_distance``.
+
     Returns:
         A float value that reflects the quality of a set of reconstructed
         lineages. A lower score indicates higher quality. The score suffers a
@@ -23,8 +44,13 @@ def validation_score(gt_lineages, rec_lineages):
         divisions) and a lower penalty for having a large matching distance
         between nodes in the GT and rec tracks.
     '''
-    gt_tracks = split_into_tracks(gt_lineages)
+    if gt_tracks is None:
+        gt_tracks = split_into_tracks(gt_lineages)
     rec_tracks = split_into_tracks(rec_lineages)
+    if indexed:
+        return indexed_validation_score(
+            gt_tracks, rec_tracks, inflect_point=inflect_point)
+
     rec_tracks_sorted_nodes = [sort_nodes(track)
                                for track in rec_tracks]
 
@@ -39,7 +65,8 @@ def validation_score(gt_lineages, rec_lineages):
         track_score = None
         for rec_nodes in rec_tracks_sorted_nodes:
             s = track_distance(gt_nodes, rec_nodes,
-                               current_min=track_score)
+                               current_min=track_score,
+                               inflect_point=inflect_point)
             if not s:  # returned None because greater than current min
                 continue
             if track_score is None or s < track_score:
@@ -54,6 +81,243 @@ def validation_score(gt_lineages, rec_lineages):
     return total_score
 
 
+def indexed_validation_score(gt_tracks, rec_tracks, inflect_point=50):
+    ''' Compute the validation score for GT and reconstructed tracks (as
+    returned by ``split_into_tracks``), without comparing every GT track to
+    every reconstructed track.
+
+    For tracks with one node in each frame between their first and last
+    frame, the distance between two tracks that overlap in time is the
+    number of frames in which only one of them has a node, plus the
+    normalized distance between their nodes in each of the overlapping
+    frames. The normalized distance of nodes further apart than
+    ``2*inflect_point`` is close to 1. For each GT track, a KD-tree query
+    per frame finds the nodes of reconstructed tracks closer than that,
+    which gives a lower bound on the distance to every reconstructed track
+    that overlaps in time. The exact distance is then computed (vectorized
+    over frames) for the candidates in the order of their lower bound, until
+    the lower bound exceeds the best distance found so far. Reconstructed
+    tracks that don't overlap in time have the distance of their added
+    lengths, so only the shortest of those has to be considered.
+
+    Tracks with gaps or several nodes in a frame are compared with
+    ``track_distance``, as in the naive approach.
+
+    Args:
+
+        gt_tracks, rec_tracks (list of networkx.DiGraph)
+            The GT and reconstructed tracks.
+
+        inflect_point (float)
+            The inflection point of the distance normalization, see
+            ``norm_distance``.
+
+    Returns:
+
+        The validation score, see ``validation_score``.
+    '''
+    start_time = time.time()
+    gt = _TrackArrays(gt_tracks)
+    rec = _TrackArrays(rec_tracks)
+    radius = 2*inflect_point
+    norm_radius = norm_distance(radius, inflect_point)
+
+    # per GT track, the reconstructed tracks with nodes within radius of a
+    # node of the GT track in the same frame, and how much lower their
+    # distance is than if all their nodes were at radius
+    near_gains = _get_near_gains(gt, rec, radius, inflect_point)
+
+    # reconstructed tracks by first frame
+    rec_by_start = np.argsort(rec.starts, kind='stable')
+    rec_starts_sorted = rec.starts[rec_by_start]
+    # shortest reconstructed track ending before or starting after a frame
+    rec_by_end = np.argsort(rec.ends, kind='stable')
+    rec_ends_sorted = rec.ends[rec_by_end]
+    shortest_ending = np.minimum.accumulate(
+        rec.lengths[rec_by_end]) if len(rec_tracks) else np.array([])
+    shortest_starting = np.minimum.accumulate(
+        rec.lengths[rec_by_start][::-1])[::-1]\
+        if len(rec_tracks) else np.array([])
+
+    total_score = 0
+    for g in range(len(gt_tracks)):
+        length = gt.lengths[g]
+
+        # tracks that don't overlap in time
+        track_score = np.inf
+        num_ending = np.searchsorted(rec_ends_sorted, gt.starts[g], 'left')
+        if num_ending > 0:
+            track_score = length + shortest_ending[num_ending - 1]
+        first_starting = np.searchsorted(
+            rec_starts_sorted, gt.ends[g], 'right')
+        if first_starting < len(rec_starts_sorted):
+            track_score = min(
+                track_score, length + shortest_starting[first_starting])
+
+        # tracks that overlap in time
+        overlapping = rec_by_start[:first_starting]
+        overlapping = overlapping[rec.ends[overlapping] >= gt.starts[g]]
+
+        if gt.contiguous[g]:
+            candidates = overlapping[rec.contiguous[overlapping]]
+            overlapping = overlapping[~rec.contiguous[overlapping]]
+            num_overlap = (
+                np.minimum(rec.ends[candidates], gt.ends[g]) -
+                np.maximum(rec.starts[candidates], gt.starts[g]) + 1)
+            lower_bounds = (
+                length + rec.lengths[candidates] - 2*num_overlap +
+                num_overlap*norm_radius)
+            gains = near_gains.get(g)
+            if gains is not None:
+                lower_bounds += gains.get_gains(candidates)
+            for i in np.argsort(lower_bounds, kind='stable'):
+                if lower_bounds[i] >= track_score:
+                    break
+                s = _contiguous_track_distance(
+                    gt, g, rec, candidates[i], inflect_point)
+                if s < track_score:
+                    track_score = s
+
+        # all other pairs of tracks are compared as in the naive approach
+        for r in overlapping:
+            s = track_distance(
+                gt.nodes[g], rec.nodes[r],
+                current_min=track_score if track_score < np.inf else None,
+                inflect_point=inflect_point)
+            if s and s < track_score:
+                track_score = s
+
+        if track_score == np.inf:
+            # no reconstructed tracks at all
+            track_score = length
+        total_score += track_score
+
+    logger.info("Calculating indexed validation score took %d seconds",
+                time.time() - start_time)
+    return total_score
+
+
+class _TrackArrays(object):
+    '''Columnar copy of a list of tracks: the sorted nodes, first and last
+    frame, number of nodes, and whether the track has exactly one node in
+    each frame between the first and last (``contiguous``). The positions of
+    all nodes are concatenated in ``positions``, starting at
+    ``offsets[track]`` for each track.'''
+
+    def __init__(self, tracks):
+
+        self.nodes = [sort_nodes(track) for track in tracks]
+        self.lengths = np.array(
+            [len(nodes) for nodes in self.nodes], dtype=np.int64)
+        self.starts = np.array(
+            [nodes[0]['t'] for nodes in self.nodes], dtype=np.int64)
+        self.ends = np.array(
+            [nodes[-1]['t'] for nodes in self.nodes], dtype=np.int64)
+        self.contiguous = np.array(
+            [
+                all(node['t'] == start + i for i, node in enumerate(nodes))
+                for start, nodes in zip(self.starts, self.nodes)
+            ],
+            dtype=bool)
+        self.offsets = np.zeros(len(tracks) + 1, dtype=np.int64)
+        self.offsets[1:] = np.cumsum(self.lengths)
+        self.positions = np.array(
+            [
+                [node['z'], node['y'], node['x']]
+                for nodes in self.nodes
+                for node in nodes
+            ],
+            dtype=np.float64).reshape(-1, 3)
+        self.frames = np.array(
+            [node['t'] for nodes in self.nodes for node in nodes],
+            dtype=np.int64)
+        self.track_ids = np.repeat(
+            np.arange(len(tracks), dtype=np.int64), self.lengths)
+
+    def get_positions(self, track, begin, end):
+        '''Positions of a contiguous track in frames [begin, end].'''
+        offset = self.offsets[track] - self.starts[track]
+        return self.positions[offset + begin:offset + end + 1]
+
+
+class _NearGains(object):
+
+    def __init__(self, tracks, gains):
+        self.tracks = tracks
+        self.gains = gains
+
+    def get_gains(self, tracks):
+        index = np.searchsorted(self.tracks, tracks)
+        index[index == len(self.tracks)] = 0
+        found = self.tracks[index] == tracks
+        return np.where(found, self.gains[index], 0)
+
+
+def _get_near_gains(gt, rec, radius, inflect_point):
+    '''Find pairs of nodes of contiguous GT and reconstructed tracks in the
+    same frame closer than ``radius``, and sum the differences between their
+    normalized distance and the normalized ``radius`` per pair of tracks.
+    Returns a dictionary from GT track to ``_NearGains``.'''
+
+    norm_radius = norm_distance(radius, inflect_point)
+    gt_nodes = np.flatnonzero(gt.contiguous[gt.track_ids])
+    rec_nodes = np.flatnonzero(rec.contiguous[rec.track_ids])
+    gt_nodes = gt_nodes[np.argsort(gt.frames[gt_nodes], kind='stable')]
+    rec_nodes = rec_nodes[np.argsort(rec.frames[rec_nodes], kind='stable')]
+    gt_frames = gt.frames[gt_nodes]
+    rec_frames = rec.frames[rec_nodes]
+
+    pairs_gt = []
+    pairs_rec = []
+    for t in np.intersect1d(gt_frames, rec_frames):
+        frame_gt = gt_nodes[
+            np.searchsorted(gt_frames, t, 'left'):
+            np.searchsorted(gt_frames, t, 'right')]
+        frame_rec = rec_nodes[
+            np.searchsorted(rec_frames, t, 'left'):
+            np.searchsorted(rec_frames, t, 'right')]
+        kd_tree_gt = scipy.spatial.cKDTree(gt.positions[frame_gt])
+        kd_tree_rec = scipy.spatial.cKDTree(rec.positions[frame_rec])
+        pairs = kd_tree_gt.sparse_distance_matrix(
+            kd_tree_rec, radius, output_type='ndarray')
+        pairs_gt.append(frame_gt[pairs['i']])
+        pairs_rec.append(frame_rec[pairs['j']])
+
+    if len(pairs_gt) == 0:
+        return {}
+    pairs_gt = np.concatenate(pairs_gt)
+    pairs_rec = np.concatenate(pairs_rec)
+    distances = np.linalg.norm(
+        gt.positions[pairs_gt] - rec.positions[pairs_rec], axis=1)
+    gains = _norm_distances(distances, inflect_point) - norm_radius
+
+    gains = scipy.sparse.coo_matrix(
+        (gains, (gt.track_ids[pairs_gt], rec.track_ids[pairs_rec])),
+        shape=(len(gt.lengths), len(rec.lengths))).tocsr()
+    gains.sum_duplicates()
+    return {
+        g: _NearGains(
+            gains.indices[gains.indptr[g]:gains.indptr[g + 1]],
+            gains.data[gains.indptr[g]:gains.indptr[g + 1]])
+        for g in np.flatnonzero(np.diff(gains.indptr))
+    }
+
+
+def _contiguous_track_distance(gt, g, rec, r, inflect_point):
+    '''Same as ``track_distance`` for contiguous tracks, vectorized over the
+    overlapping frames.'''
+
+    begin = max(gt.starts[g], rec.starts[r])
+    end = min(gt.ends[g], rec.ends[r])
+    distances = np.linalg.norm(
+        gt.get_positions(g, begin, end) - rec.get_positions(r, begin, end),
+        axis=1)
+    num_overlap = end - begin + 1
+    return (
+        gt.lengths[g] + rec.lengths[r] - 2*num_overlap +
+        np.sum(_norm_distances(distances, inflect_point)))
+
+
 def sort_nodes(track):
     # Sort nodes by frame (assumed 1 per frame)
     nodes = [d for n, d in track.nodes(data=True)]
@@ -61,7 +325,7 @@ def sort_nodes(track):
     return nodes
 
 
-def track_distance(track1, track2, current_min=None):
+def track_distance(track1, track2, current_min=None, inflect_point=50):
     if isinstance(track1, nx.DiGraph):
         nodes1 = sort_nodes(track1)
     else:
@@ -99,9 +363,9 @@ def track_distance(track1, track2, current_min=None):
             node_dist = np.linalg.norm(node_loc(nodes1[i1]) -
                                        node_loc(nodes2[i2]))
             logger.debug("Euclidean distance: %f", node_dist)
-            logger.debug("normalized distance: %f",
-                         norm_distance(node_dist))
-            dist += norm_distance(node_dist)
+            normalized_dist = norm_distance(node_dist, inflect_point)
+            logger.debug("normalized distance: %f", normalized_dist)
+            dist += normalized_dist
             i1 += 1
             i2 += 1
         else:
@@ -161,6 +425,13 @@ def norm_distance(dist, inflect_point=50):
     return 1. / (1 + math.pow(math.e, -1*slope*(dist - inflect_point)))
 
 
+def _norm_distances(dists, inflect_point=50):
+    '''Vectorized ``norm_distance``.'''
+    val_at_zero = 0.0001
+    slope = math.log(1/val_at_zero - 1) / inflect_point
+    return 1. / (1 + np.exp(-1*slope*(dists - inflect_point)))
+
+
 def split_into_tracks(lineages):
     ''' Splits a lineage forest into a list of tracks, splitting at divisions
     Args:
@@ -171,9 +442,10 @@ def split_into_tracks(lineages):
     degrees = lineages.in_degree()
     div_nodes = [node for node, degree in degrees if degree == 2]
     logger.debug("Division nodes: %s", str(div_nodes))
+    # continue the search for unused node ids where the last one ended
+    min_id = 0
     for node in div_nodes:
         in_edges = list(lineages.in_edges(node))
-        min_id = 0
         for edge in in_edges:
             min_id = replace_target(edge, lineages, i=min_id)
         if len(lineages.out_edges(edge[1])) == 0:
@@ -1,3 +1,4 @@
+from functools import lru_cache
 from gunpowder import BatchFilter
 from gunpowder.array import Array
 from gunpowder.array_spec import ArraySpec
@@ -138,31 +139,15 @@ class AddParentVectors(BatchFilter):
 
         # 4D: t, z, y, x
         shape = data_roi.get_shape()
-        l, d, h, w = shape
-
-        # 5D: t, c, z, y, x (c=[0, 1, 2])
-        coords = np.array(
-                [
-                    # 4D: c, z, y, x
-                    np.meshgrid(
-                        np.arange(0, d),
-                        np.arange(0, h),
-                        np.arange(0, w),
-                        indexing='ij')
-                ]*l,
-                dtype=np.float32)
-
-        # 5D: c, t, z, y, x
-        coords = coords.transpose((1, 0, 2, 3, 4))
-        coords[0, :] *= voxel_size[1]
-        coords[1, :] *= voxel_size[2]
-        coords[2, :] *= voxel_size[3]
-        coords[0, :] += offset[1]
-        coords[1, :] += offset[2]
-        coords[2, :] += offset[3]
-
-        parent_vectors = np.zeros_like(coords)
-        mask = np.zeros(shape, dtype=np.bool)
+
+        # 5D: c, t, z, y, x (c=[0, 1, 2])
+        parent_vectors = np.zeros((3,) + tuple(shape), dtype=np.float32)
+        mask = np.zeros(shape, dtype=np.float32)
+
+        stencil, extent = get_stencil(tuple(radius), tuple(voxel_size))
+        coordinates = [
+            get_coordinates(shape[d], voxel_size[d])
+            for d in range(1, 4)]
 
         logger.debug(
             "Adding parent vectors for %d points...",
@@ -204,32 +189,89 @@ class AddParentVectors(BatchFilter):
                 point.location,
                 point.location/voxel_size - data_roi.get_begin())
 
-            point_mask = np.zeros(shape, dtype=np.bool)
-            point_mask[v] = 1
-
-            enlarge_binary_map(
-                point_mask,
-                radius,
-                voxel_size,
-                in_place=True)
+            # the window of the stencil around the point, clipped to the
+            # output array
+            begin = np.maximum(np.array(v) - extent, 0)
+            end = np.minimum(np.array(v) + extent + 1, shape)
+            window = tuple(slice(b, e) for b, e in zip(begin, end))
+            point_mask = stencil[tuple(
+                slice(b, e)
+                for b, e in zip(begin - v + extent, end - v + extent))]
 
-            mask = np.logical_or(mask, point_mask)
+            mask[window][point_mask] = 1
             if point.parent_id not in points.data and self.dense:
                 continue
 
             cnt += 1
             parent = points.data[point.parent_id]
 
-            parent_vectors[0][point_mask] = (parent.location[1]
-                                             - coords[0][point_mask])
-            parent_vectors[1][point_mask] = (parent.location[2]
-                                             - coords[1][point_mask])
-            parent_vectors[2][point_mask] = (parent.location[3]
-                                             - coords[2][point_mask])
+            for c in range(3):
+                d = c + 1
+                # world coordinates of the window along dimension d
+                coords = (
+                    coordinates[c][begin[d]:end[d]] + np.float32(offset[d]))
+                coords = np.broadcast_to(
+                    coords.reshape([-1 if i == d else 1 for i in range(4)]),
+                    point_mask.shape)
+                parent_vectors[c][window][point_mask] = (
+                    parent.location[d] - coords[point_mask])
 
         if empty:
             logger.warning("No parent vectors written for points %s"
                            % points.data)
         logger.info("written {}/{}".format(cnt, total))
 
-        return parent_vectors, mask.astype(np.float32)
+        return parent_vectors, mask
+
+
+@lru_cache(maxsize=16)
+def get_stencil(radius, voxel_size):
+    '''Get the ellipsoid that is marked around each point, as a boolean
+    array of shape ``2*extent + 1`` centered on the point, together with its
+    ``extent`` in voxels.
+
+    This is the result of ``enlarge_binary_map`` for a single point, such
+    that drawing the stencil around each point is the same as enlarging each
+    point in the whole array.
+
+    Args:
+
+        radius (``tuple`` of ``float``):
+
+            The radius of the ellipsoid in world units, either one value or
+            one per dimension.
+
+        voxel_size (:class:`Coordinate`):
+
+            The voxel size of the array to draw into.
+    '''
+
+    voxel_size = np.array(voxel_size)
+    extent = np.ceil(np.array(radius)/voxel_size).astype(np.int64)
+
+    stencil = np.zeros(tuple(2*extent + 1), dtype=np.bool)
+    stencil[tuple(extent)] = 1
+    enlarge_binary_map(
+        stencil,
+        np.array(radius, dtype=np.float32),
+        voxel_size,
+        in_place=True)
+
+    stencil.setflags(write=False)
+    extent.setflags(write=False)
+    return stencil, extent
+
+
+@lru_cache(maxsize=8)
+def get_coordinates(size, voxel_size):
+    '''Get the world coordinates of ``size`` voxels of size ``voxel_size``
+    along one dimension, starting at 0, as a read-only ``float32`` array.
+
+    Batches of the same shape share these coordinates, the offset of a batch
+    is added only in the windows that are drawn into.
+    '''
+
+    coordinates = np.arange(size, dtype=np.float32)
+    coordinates *= voxel_size
+    coordinates.setflags(write=False)
+    return coordinates
@@ -2,7 +2,51 @@ import gunpowder as gp
 import numpy as np
 
 
+def normalize(data, shift, scale, mn=None, mx=None, dtype=np.float32):
+    '''Compute ``(clip(data, mn, mx) - shift)/scale`` as ``dtype``.
+
+    ``data`` is converted at most once into a new array, all other steps are
+    done in place on that array (or on ``data`` itself, if it already is of
+    ``dtype`` and writeable), without temporary copies of the data.
+
+    Args:
+
+        data (``ndarray``):
+
+            The data to normalize.
+
+        shift, scale (``float``):
+
+            The values to subtract and divide by.
+
+        mn, mx (``float``, optional):
+
+            Bounds to clip the data to before normalizing. ``None`` for no
+            bound.
+
+        dtype (``np.dtype``):
+
+            The type of the result.
+    '''
+
+    if data.dtype == dtype and data.flags.writeable:
+        normalized = data
+    else:
+        normalized = np.empty(data.shape, dtype=dtype)
+        np.copyto(normalized, data, casting='unsafe')
+
+    if mn is not None or mx is not None:
+        np.clip(normalized, mn, mx, out=normalized)
+    np.subtract(normalized, shift, out=normalized)
+    np.divide(normalized, scale, out=normalized)
+
+    return normalized
+
+
 class Clip(gp.BatchFilter):
+    '''Clip an array to ``[mn, mx]``, in place. A bound that is ``None`` is
+    not applied. Global bounds can be computed with
+    :func:`linajea.compute_dataset_statistics`.'''
 
     def __init__(self, array, mn=None, mx=None):
 
@@ -19,13 +63,9 @@ class Clip(gp.BatchFilter):
             return
 
         array = batch.arrays[self.array]
-
-        if self.mn is None:
-            self.mn = np.min(array.data)
-        if self.mx is None:
-            self.mx = np.max(array.data)
-
-        array.data = np.clip(array.data, self.mn, self.mx)
+        # clip in the type of the array (e.g., float bounds of integer data)
+        np.clip(
+            array.data, self.mn, self.mx, out=array.data, casting='unsafe')
 
 
 class NormalizeMinMax(gp.Normalize):
@@ -50,11 +90,13 @@ class NormalizeMinMax(gp.Normalize):
 
         array = batch.arrays[self.array]
         array.spec.dtype = self.dtype
-        array.data = array.data.astype(self.dtype)
         if self.clip:
-            array.data = np.clip(array.data, self.mn, self.mx)
-        array.data = (array.data - self.mn) / (self.mx - self.mn)
-        array.data = array.data.astype(self.dtype)
+            array.data = normalize(
+                array.data, self.mn, self.mx - self.mn,
+                mn=self.mn, mx=self.mx, dtype=self.dtype)
+        else:
+            array.data = normalize(
+                array.data, self.mn, self.mx - self.mn, dtype=self.dtype)
 
 
 class NormalizeMeanStd(gp.Normalize):
@@ -77,9 +119,8 @@ class NormalizeMeanStd(gp.Normalize):
 
         array = batch.arrays[self.array]
         array.spec.dtype = self.dtype
-        array.data = array.data.astype(self.dtype)
-        array.data = (array.data - self.mean) / self.std
-        array.data = array.data.astype(self.dtype)
+        array.data = normalize(
+            array.data, self.mean, self.std, dtype=self.dtype)
 
 
 class NormalizeMedianMad(gp.Normalize):
@@ -102,6 +143,5 @@ class NormalizeMedianMad(gp.Normalize):
 
         array = batch.arrays[self.array]
         array.spec.dtype = self.dtype
-        array.data = array.data.astype(self.dtype)
-        array.data = (array.data - self.median) / self.mad
-        array.data = array.data.astype(self.dtype)
+        array.data = normalize(
+            array.data, self.median, self.mad, dtype=self.dtype)
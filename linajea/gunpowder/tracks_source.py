@@ -1,13 +1,18 @@
 from gunpowder import (Point, Coordinate, Batch, BatchProvider,
                        Roi, PointsSpec, Points)
 from gunpowder.profiling import Timing
+import hashlib
 import numpy as np
 import logging
+import os
 
-from linajea import parse_tracks_file
+from linajea import read_tracks_file
 
 logger = logging.getLogger(__name__)
 
+# the arrays stored in the points cache, the index last
+CACHED_ARRAYS = ['locations', 'track_info', 'radii', 'file_index']
+
 
 class TrackPoint(Point):
 
@@ -37,7 +42,6 @@ class TracksSource(BatchProvider):
         track_id
     And these optional fields:
         radius
-        name
         div_state
 
     If there is no header, it is assumed that the points are represented
@@ -68,16 +72,38 @@ class TracksSource(BatchProvider):
             An optional scaling to apply to the coordinates of the points read
             from the CSV file. This is useful if the points refer to voxel
             positions to convert them to world units.
+
+        use_cache (``bool``, optional):
+
+            If set (the default), the parsed points are stored in ``.npy``
+            files next to the CSV file, which are memory-mapped instead of
+            parsing the CSV file again (e.g., by other workers). The cache is
+            specific to the size and modification time of the CSV file, the
+            ``scale``, and the roi of ``points_spec``.
+
+    Points are sorted by frame and z, such that a request only has to look at
+    the points in the requested frames and z range.
     '''
 
-    def __init__(self, filename, points, points_spec=None, scale=1.0):
+    def __init__(
+            self,
+            filename,
+            points,
+            points_spec=None,
+            scale=1.0,
+            use_cache=True):
 
         self.filename = filename
         self.points = points
         self.points_spec = points_spec
         self.scale = scale
+        self.use_cache = use_cache
         self.locations = None
         self.track_info = None
+        self.radii = None
+        self.file_index = None
+        self.frames = None
+        self.frame_offsets = None
 
     def setup(self):
 
@@ -108,14 +134,8 @@ class TracksSource(BatchProvider):
             "CSV points source got request for %s",
             request[self.points].roi)
 
-        point_filter = np.ones((self.locations.shape[0],), dtype=np.bool)
-        for d in range(self.locations.shape[1]):
-            point_filter = np.logical_and(point_filter,
-                                          self.locations[:, d] >= min_bb[d])
-            point_filter = np.logical_and(point_filter,
-                                          self.locations[:, d] < max_bb[d])
-
-        points_data = self._get_points(point_filter)
+        points_data = self._get_points(
+            self._get_point_indices(min_bb, max_bb))
         logger.debug("Points data: %s", points_data)
         logger.debug("Type of point: %s", type(list(points_data.values())[0]))
         points_spec = PointsSpec(roi=request[self.points].roi.copy())
@@ -128,10 +148,38 @@ class TracksSource(BatchProvider):
 
         return batch
 
-    def _get_points(self, point_filter):
-
-        filtered_locations = self.locations[point_filter]
-        filtered_track_info = self.track_info[point_filter]
+    def _get_point_indices(self, min_bb, max_bb):
+        '''Get the indices of the points in the box from ``min_bb``
+        (inclusive) to ``max_bb`` (exclusive), in the order of the tracks
+        file.'''
+
+        first_frame, last_frame = np.searchsorted(
+            self.frames, [min_bb[0], max_bb[0]])
+        min_yx = np.array(min_bb[2:])
+        max_yx = np.array(max_bb[2:])
+
+        indices = []
+        for frame in range(first_frame, last_frame):
+            begin, end = self.frame_offsets[frame:frame + 2]
+            # within a frame, points are sorted by z
+            begin, end = begin + np.searchsorted(
+                self.locations[begin:end, 1], [min_bb[1], max_bb[1]])
+            yx = self.locations[begin:end, 2:]
+            inside = np.logical_and(
+                np.all(yx >= min_yx, axis=1),
+                np.all(yx < max_yx, axis=1))
+            indices.append(begin + np.flatnonzero(inside))
+
+        if len(indices) == 0:
+            return np.zeros((0,), dtype=np.int64)
+        indices = np.concatenate(indices)
+        return indices[np.argsort(self.file_index[indices])]
+
+    def _get_points(self, indices):
+
+        filtered_locations = self.locations[indices]
+        filtered_track_info = self.track_info[indices]
+        filtered_radii = self.radii[indices]
 
         return {
             # point_id
@@ -142,14 +190,92 @@ class TracksSource(BatchProvider):
                 # track_id
                 track_info[2],
                 # radius
-                value=track_info[3] if len(track_info) > 3 else None)
-            for location, track_info in zip(filtered_locations,
-                                            filtered_track_info)
+                value=None if np.isnan(radius) else radius)
+            for location, track_info, radius in zip(filtered_locations,
+                                                    filtered_track_info,
+                                                    filtered_radii)
         }
 
     def _read_points(self):
+
         roi = self.points_spec.roi if self.points_spec is not None else None
-        self.locations, self.track_info = parse_tracks_file(
-            self.filename,
-            scale=self.scale,
-            limit_to_roi=roi)
+        cache_files = self._get_cache_files(roi) if self.use_cache else None
+
+        if cache_files is not None and \
+                all(os.path.exists(f) for f in cache_files.values()):
+
+            logger.debug("Reading cached points from %s", cache_files)
+            for name in CACHED_ARRAYS:
+                setattr(
+                    self,
+                    name,
+                    np.load(cache_files[name], mmap_mode='r'))
+
+        else:
+
+            tracks = read_tracks_file(
+                self.filename,
+                scale=self.scale,
+                limit_to_roi=roi)
+            locations = tracks['location']
+            track_info = np.stack(
+                [tracks['cell_id'], tracks['parent_id'], tracks['track_id']],
+                axis=1)
+            radii = tracks.get('radius')
+            if radii is None:
+                radii = np.full((len(locations),), np.nan, dtype=np.float32)
+
+            # sort points by frame, then z
+            if len(locations) > 0:
+                file_index = np.lexsort((locations[:, 1], locations[:, 0]))
+            else:
+                file_index = np.zeros((0,), dtype=np.int64)
+            self.locations = locations[file_index]
+            self.track_info = track_info[file_index]
+            self.radii = radii[file_index]
+            self.file_index = file_index
+
+            if cache_files is not None:
+                self._write_cache(cache_files)
+
+        if len(self.locations) > 0:
+            self.frames, self.frame_offsets = np.unique(
+                self.locations[:, 0], return_index=True)
+        else:
+            self.frames = np.zeros((0,), dtype=np.float32)
+            self.frame_offsets = np.zeros((0,), dtype=np.int64)
+        self.frame_offsets = np.append(
+            self.frame_offsets, len(self.locations))
+
+    def _get_cache_files(self, roi):
+
+        stat = os.stat(self.filename)
+        key = repr((
+            stat.st_size,
+            stat.st_mtime_ns,
+            np.asarray(self.scale).tolist(),
+            str(roi),
+            CACHED_ARRAYS))
+        digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+
+        return {
+            name: '%s.%s.%s.npy' % (self.filename, digest, name)
+            for name in CACHED_ARRAYS
+        }
+
+    def _write_cache(self, cache_files):
+
+        # write to temporary files first, such that other workers never see
+        # partially written files, and the index last, since readers check
+        # for all files
+        try:
+            for name in CACHED_ARRAYS:
+                filename = cache_files[name]
+                tmp_filename = '%s.%d.tmp' % (filename, os.getpid())
+                with open(tmp_filename, 'wb') as f:
+                    np.save(f, getattr(self, name))
+                os.replace(tmp_filename, filename)
+            logger.debug("Cached points in %s", cache_files)
+        except OSError as e:
+            logger.warning(
+                "Could not cache points of %s: %s", self.filename, e)
@@ -1,11 +1,188 @@
-from funlib import math
+from collections import deque
 import gunpowder as gp
 import numpy as np
+from linajea.candidate_database import update_nodes_roi
+import os
 import pymongo
+import queue
+import threading
+import time
 import logging
 
 logger = logging.getLogger(__name__)
 
+# one client per host and process, shared by all nodes (clients are pooled
+# and thread-safe, but must not be shared across forks)
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def _get_client(db_host):
+
+    key = (os.getpid(), db_host)
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = pymongo.MongoClient(host=db_host)
+        return _clients[key]
+
+
+class BulkWriter(threading.Thread):
+    '''A background thread that inserts documents into a Mongo collection.
+
+    Documents handed to ``put`` are queued and coalesced into unordered bulk
+    inserts of up to ``bulk_size`` documents. Documents that collide with
+    existing ones on a unique index (e.g., cells found again in overlapping
+    blocks) are skipped.
+
+    Args:
+
+        collection (``pymongo.collection.Collection``):
+
+            The collection to insert into.
+
+        max_queue_size (``int``):
+
+            How many ``put`` calls can be queued before ``put`` blocks.
+
+        bulk_size (``int``):
+
+            The maximal number of documents per bulk insert.
+
+        on_write (callable, optional):
+
+            Called with the documents of each bulk insert after inserting
+            them, in the writer thread.
+    '''
+
+    def __init__(
+            self,
+            collection,
+            max_queue_size=8,
+            bulk_size=10000,
+            on_write=None):
+
+        super().__init__(daemon=True)
+        self.collection = collection
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.bulk_size = bulk_size
+        self.on_write = on_write
+        self.timings = deque()
+        self.num_written = 0
+        self.num_duplicates = 0
+        self.write_time = 0
+        self.error = None
+        self.start()
+
+    def put(self, documents, timing=None):
+        '''Queue ``documents`` for insertion. Blocks while the queue is full.
+        If given, ``timing`` is started and stopped around the wait.'''
+
+        self._raise_error()
+        if timing is not None:
+            timing.start()
+        self.queue.put(documents)
+        if timing is not None:
+            timing.stop()
+
+    def get_timings(self):
+        '''Get (and forget) the ``Timing`` of each bulk insert since the last
+        call.'''
+
+        timings = []
+        while self.timings:
+            timings.append(self.timings.popleft())
+        return timings
+
+    def close(self):
+        '''Write all queued documents and stop the thread.'''
+
+        if self.is_alive():
+            self.queue.put(None)
+            self.join()
+        self._raise_error()
+        logger.info(
+            "Wrote %d documents (%d duplicates skipped) in %.3fs (%.1f/s)",
+            self.num_written, self.num_duplicates, self.write_time,
+            self.num_written / max(self.write_time, 1e-9))
+
+    def run(self):
+
+        done = False
+        while not done:
+            documents = self.queue.get()
+            if documents is None:
+                break
+            documents = list(documents)
+            # coalesce whatever else is queued already
+            while len(documents) < self.bulk_size:
+                try:
+                    more = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if more is None:
+                    done = True
+                    break
+                documents.extend(more)
+            if self.error is None:
+                try:
+                    self._write(documents)
+                except Exception as e:
+                    # raised in the calling thread by put or close
+                    self.error = e
+
+    def _write(self, documents):
+
+        timing = gp.profiling.Timing(self, 'bulk_write')
+        timing.start()
+        start = time.time()
+        try:
+            self.collection.insert_many(documents, ordered=False)
+            num_duplicates = 0
+        except pymongo.errors.BulkWriteError as e:
+            errors = e.details['writeErrors']
+            if any(error['code'] != 11000 for error in errors):
+                raise
+            num_duplicates = len(errors)
+        if self.on_write is not None:
+            self.on_write(documents)
+        duration = time.time() - start
+        timing.stop()
+        self.timings.append(timing)
+
+        self.num_written += len(documents) - num_duplicates
+        self.num_duplicates += num_duplicates
+        self.write_time += duration
+        logger.debug(
+            "Wrote %d documents (%d duplicates) in %.3fs (%.1f/s), "
+            "%d batches queued",
+            len(documents), num_duplicates, duration,
+            len(documents) / max(duration, 1e-9), self.queue.qsize())
+
+    def _raise_error(self):
+
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+
+def cantor_numbers(coordinates):
+    '''Same as ``funlib.math.cantor_number``, for an array of shape (n,
+    dims) of coordinates at once.'''
+
+    coordinates = np.asarray(coordinates, dtype=np.int64)
+    numbers = coordinates[:, 0].copy()
+    edge_lengths = coordinates[:, 0].copy()
+    for dims in range(2, coordinates.shape[1] + 1):
+        edge_lengths += coordinates[:, dims - 1]
+        # the volume of the pyramid, with the same floating point operations
+        # as funlib.math.pyramide_volume
+        volumes = np.ones(len(coordinates), dtype=np.float64)
+        for d in range(dims):
+            volumes *= edge_lengths + d
+            volumes /= d + 1
+        numbers += volumes.astype(np.int64)
+    return numbers
+
 
 class WriteCells(gp.BatchFilter):
 
@@ -18,11 +195,18 @@ class WriteCells(gp.BatchFilter):
             db_host,
             db_name,
             edge_length=1,
-            volume_shape=None):
+            volume_shape=None,
+            max_queue_size=8,
+            bulk_size=10000):
         '''Edge length indicates the length of the edge of the cube
         from which parent vectors will be read. The cube will be centered
         around the maxima, and predictions within the cube of voxels
         will be averaged to get the parent vector to store in the db
+
+        Cells are written by a ``BulkWriter`` in the background, so that
+        processing the next batch does not wait for the db. At most
+        ``max_queue_size`` batches are queued, and queued batches are
+        written in bulks of up to ``bulk_size`` cells.
         '''
 
         self.maxima = maxima
@@ -32,6 +216,9 @@ class WriteCells(gp.BatchFilter):
         self.db_host = db_host
         self.db_name = db_name
         self.client = None
+        self.writer = None
+        self.max_queue_size = max_queue_size
+        self.bulk_size = bulk_size
         assert edge_length % 2 == 1, "Edge length should be odd"
         self.edge_length = edge_length
         self.volume_shape = volume_shape
@@ -39,7 +226,7 @@ class WriteCells(gp.BatchFilter):
     def process(self, batch, request):
 
         if self.client is None:
-            self.client = pymongo.MongoClient(host=self.db_host)
+            self.client = _get_client(self.db_host)
             self.db = self.client[self.db_name]
             create_indices = 'nodes' not in self.db.list_collection_names()
             self.cells = self.db['nodes']
@@ -57,6 +244,15 @@ class WriteCells(gp.BatchFilter):
                     name='id',
                     unique=True)
 
+        # the writer is closed in teardown, and started again if the
+        # pipeline is built again
+        if self.writer is None:
+            self.writer = BulkWriter(
+                self.cells,
+                max_queue_size=self.max_queue_size,
+                bulk_size=self.bulk_size,
+                on_write=self._update_nodes_roi)
+
         roi = batch[self.maxima].spec.roi
         voxel_size = batch[self.maxima].spec.voxel_size
 
@@ -64,44 +260,130 @@ class WriteCells(gp.BatchFilter):
         cell_indicator = batch[self.cell_indicator].data
         parent_vectors = batch[self.parent_vectors].data
 
-        cells = []
-        for index in np.argwhere(maxima*cell_indicator > self.score_threshold):
-            index = gp.Coordinate(index)
-            logger.debug("Getting parent vector at index %s" % str(index))
-
-            score = cell_indicator[index]
-            if self.edge_length == 1:
-                parent_vector = tuple(
-                    float(x) for x in parent_vectors[(Ellipsis,) + index])
-            else:
-                parent_vector = WriteCells.get_avg_pv(
-                        parent_vectors, index, self.edge_length)
-            position = roi.get_begin() + voxel_size*index
-            if self.volume_shape is not None and \
-               np.any(np.greater_equal(
-                   position,
-                   gp.Coordinate(self.volume_shape) * voxel_size)):
-                continue
-
-            cell_id = int(math.cantor_number(
-                roi.get_begin()/voxel_size + index))
-
-            cells.append({
+        indices = np.argwhere(maxima*cell_indicator > self.score_threshold)
+        positions = (
+            np.array(roi.get_begin(), dtype=np.int64) +
+            np.array(voxel_size, dtype=np.int64)*indices)
+        if self.volume_shape is not None:
+            inside = np.all(
+                positions < (
+                    np.array(self.volume_shape, dtype=np.int64) *
+                    np.array(voxel_size, dtype=np.int64)),
+                axis=1)
+            indices = indices[inside]
+            positions = positions[inside]
+        logger.debug("Found %d cells", len(indices))
+
+        index = tuple(indices.T)
+        scores = cell_indicator[index]
+        if self.edge_length == 1:
+            parent_vectors = parent_vectors[(slice(None),) + index].T
+        else:
+            parent_vectors = WriteCells.get_avg_pvs(
+                parent_vectors, indices, self.edge_length)
+        cell_ids = cantor_numbers(
+            np.array(roi.get_begin()/voxel_size, dtype=np.int64) + indices)
+
+        cells = [
+            {
                 'id': cell_id,
-                'score': float(score),
+                'score': score,
                 't': position[0],
                 'z': position[1],
                 'y': position[2],
                 'x': position[3],
-                'parent_vector': parent_vector
-            })
-
-            logger.debug(
-                "ID=%d, score=%f, parent_vector=%s" % (
-                    cell_id, score, parent_vector))
+                'parent_vector': tuple(parent_vector)
+            }
+            for cell_id, score, position, parent_vector in zip(
+                cell_ids.tolist(),
+                scores.tolist(),
+                positions.tolist(),
+                parent_vectors.tolist())
+        ]
 
         if len(cells) > 0:
-            self.cells.insert_many(cells)
+            timing = gp.profiling.Timing(self, 'enqueue')
+            self.writer.put(cells, timing=timing)
+            batch.profiling_stats.add(timing)
+        for timing in self.writer.get_timings():
+            batch.profiling_stats.add(timing)
+        logger.debug(
+            "Queued %d cells, %d batches waiting to be written",
+            len(cells), self.writer.queue.qsize())
+
+    def _update_nodes_roi(self, cells):
+
+        # keep the bounds of the nodes in the db metadata up to date
+        update_nodes_roi(
+            self.db['meta'],
+            {dim: min(cell[dim] for cell in cells) for dim in 'tzyx'},
+            {dim: max(cell[dim] for cell in cells) + 1 for dim in 'tzyx'})
+
+    def teardown(self):
+
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def get_avg_pvs(parent_vectors, indices, edge_length):
+        ''' Same as ``get_avg_pv``, for several indices at once. The sums of
+        parent vectors over the cubes are computed with a summed-area table,
+        and the average relative position of the voxels in a (clipped) cube
+        is the center of the cube.
+
+        Args:
+
+            parent_vectors (``np.array``):
+
+                A numpy array of parent vectors with dimensions
+                (channels, time, z, y, x).
+
+            indices (``np.array``):
+
+                An array of shape (n, 4) of (t, z, y, x) indices to get the
+                average parent vectors for.
+
+            edge_length (``int``):
+
+                Length of each side of the cube within which the
+                parent vectors are averaged.
+
+        Returns:
+
+            An array of shape (n, channels) of average parent vectors.
+        '''
+        radius = (edge_length - 1) // 2
+        assert len(parent_vectors.shape) == 5
+        indices = np.asarray(indices, dtype=np.int64).reshape(-1, 4)
+        spatial_shape = np.array(parent_vectors.shape[2:])
+
+        # summed-area table over z, y, x, with a leading row of zeros per
+        # axis, only for the frames that contain indices
+        frames, frame_index = np.unique(indices[:, 0], return_inverse=True)
+        table = np.zeros(
+            (parent_vectors.shape[0], len(frames)) +
+            tuple(spatial_shape + 1),
+            dtype=np.float64)
+        table[:, :, 1:, 1:, 1:] = parent_vectors[:, frames]
+        for axis in [2, 3, 4]:
+            np.cumsum(table, axis=axis, out=table)
+
+        # the cubes, clipped to the volume: [begin, end) per axis
+        begin = np.maximum(indices[:, 1:] - radius, 0)
+        end = np.minimum(indices[:, 1:] + radius + 1, spatial_shape)
+
+        sums = np.zeros(
+            (parent_vectors.shape[0], len(indices)), dtype=np.float64)
+        for corner in np.ndindex(2, 2, 2):
+            sign = (-1)**(3 - sum(corner))
+            z, y, x = (
+                np.where(corner[d], end[:, d], begin[:, d])
+                for d in range(3))
+            sums += sign*table[:, frame_index, z, y, x]
+        counts = np.prod(end - begin, axis=1)
+        relative_positions = (begin + end - 1)/2 - indices[:, 1:]
+
+        return sums.T/counts[:, None] + relative_positions
 
     def get_avg_pv(parent_vectors, index, edge_length):
         ''' Computes the average parent vector offset from the parent vectors
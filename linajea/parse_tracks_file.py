@@ -2,11 +2,15 @@ import csv
 import logging
 
 import numpy as np
-
-from daisy import Coordinate
+import pandas
 
 logger = logging.getLogger(__name__)
 
+# the columns of files without header, in this order
+COLUMNS = ['t', 'z', 'y', 'x', 'cell_id', 'parent_id', 'track_id', 'radius']
+LOCATION_COLUMNS = ['t', 'z', 'y', 'x']
+ID_COLUMNS = ['cell_id', 'parent_id', 'track_id']
+
 
 def get_dialect_and_header(csv_file):
     with open(csv_file, 'r') as f:
@@ -21,53 +25,55 @@ def parse_tracks_file(
         filename,
         scale=1.0,
         limit_to_roi=None):
-    dialect, has_header = get_dialect_and_header(filename)
-    logger.debug("Tracks file has header: %s" % has_header)
-    if has_header:
-        locations, track_info = \
-            _parse_csv_fields(filename, scale, limit_to_roi)
-    else:
-        locations, track_info = \
-            _parse_csv_ndims(filename, scale, limit_to_roi)
-    return locations, track_info
-
+    '''Read the locations and ids of all points in a tracks file.
 
-def _parse_csv_ndims(filename, scale=1.0, limit_to_roi=None, read_dims=4):
-    '''Read one point per line. If ``read_dims`` is 0, all values
-    in one line are considered as the location of the point. If positive,
-    only the first ``ndims`` are used. If negative, all but the last
-    ``-ndims`` are used. Defaults to 4, so the first 4 values are considered
-    locations t z y x.
+    Returns a tuple of the ``float32`` locations (t, z, y, x) and an ``int64``
+    array with columns cell_id, parent_id, and track_id. See
+    ``read_tracks_file`` for the arguments and to get the optional columns.
     '''
-    with open(filename, 'r') as f:
-        tokens = [[t.strip(',') for t in line.split()]
-                  for line in f]
-    try:
-        _ = int(tokens[0][-1])
-        ldim = None
-    except ValueError:
-        ldim = -1
-
-    locations = []
-    track_info = []
-    for line in tokens:
-        loc = np.array([float(d) for d in line[:read_dims]]) * scale
-        if limit_to_roi is not None and \
-           not limit_to_roi.contains(Coordinate(loc)):
-            continue
-
-        locations.append(loc)
-        track_info.append(
-            np.array([int(i.split(".")[0])
-                      for i in line[read_dims:ldim]]))
-
-    return (np.array(locations, dtype=np.float32),
-            np.array(track_info, dtype=np.int32))
-
-
-def _parse_csv_fields(filename, scale=1.0, limit_to_roi=None):
-    '''Read one point per line. Assumes a header with the following required
-    fields:
+    tracks = read_tracks_file(
+        filename,
+        scale=scale,
+        limit_to_roi=limit_to_roi)
+    track_info = np.stack(
+        [tracks[column] for column in ID_COLUMNS],
+        axis=1)
+    return tracks['location'], track_info
+
+
+def read_tracks_file(
+        filename,
+        scale=1.0,
+        limit_to_roi=None,
+        chunk_size=1000000):
+    '''Read all points in a tracks file into a dict of typed columns, see
+    ``iter_tracks_file``.'''
+
+    chunks = list(iter_tracks_file(
+        filename,
+        scale=scale,
+        limit_to_roi=limit_to_roi,
+        chunk_size=chunk_size))
+    if len(chunks) == 0:
+        chunks = [dict(
+            location=np.zeros((0, 4), dtype=np.float32),
+            **{column: np.zeros((0,), dtype=np.int64)
+               for column in ID_COLUMNS})]
+
+    return {
+        column: np.concatenate([chunk[column] for chunk in chunks])
+        for column in chunks[0].keys()
+    }
+
+
+def iter_tracks_file(
+        filename,
+        scale=1.0,
+        limit_to_roi=None,
+        chunk_size=1000000):
+    '''Read a tracks file in chunks, with one point per line.
+
+    If the file has a header, it must have the following required fields:
         t
         z
         y
@@ -75,34 +81,110 @@ def _parse_csv_fields(filename, scale=1.0, limit_to_roi=None):
         cell_id
         parent_id
         track_id
-    And these optional fields:
+    And can have these optional fields:
         radius
-        name
         div_state
+    Other fields (e.g., name) are ignored.
+
+    If there is no header, the values of each line are assumed to be in the
+    following order:
+
+        t, z, y, x, cell_id, parent_id, track_id, <radius>, <other values>
+
+    Yields one dict per chunk, with the ``float32`` ``location`` (t, z, y, x)
+    of the points, the ``int64`` ``cell_id``, ``parent_id``, and
+    ``track_id``, and, if present, the ``float32`` ``radius`` and ``int64``
+    ``div_state``.
+
+    Args:
+
+        filename (``string``):
+
+            The file to read from.
+
+        scale (scalar or array-like):
+
+            An optional scaling to apply to the locations of the points.
+
+        limit_to_roi (``Roi``, optional):
+
+            If given, only points inside this roi (after scaling) are read.
+
+        chunk_size (``int``):
+
+            The number of lines to parse at once. Points outside of
+            ``limit_to_roi`` are dropped per chunk.
     '''
-    locations = []
-    track_info = []
     dialect, has_header = get_dialect_and_header(filename)
-    with open(filename, 'r') as f:
-        assert has_header, "No header found, but this function needs a header"
-        reader = csv.DictReader(f, fieldnames=None,
-                                dialect=dialect)
-        for row in reader:
-            loc = np.array((row['t'],
-                            row['z'],
-                            row['y'],
-                            row['x']),
-                           dtype=np.float32) * scale
-            if limit_to_roi is not None and \
-               not limit_to_roi.contains(Coordinate(loc)):
-                continue
-            locations.append(loc)
-            track_info.append([int(row['cell_id']),
-                               int(row['parent_id']),
-                               int(row['track_id']),
-                               [row.get("radius"),
-                                row.get("name")]])
-            if 'div_state' in row:
-                track_info[-1].append(int(row['div_state']))
-
-    return np.array(locations), np.array(track_info)
+    logger.debug("Tracks file has header: %s" % has_header)
+
+    if dialect.delimiter.isspace():
+        sep = r'\s+'
+    else:
+        sep = dialect.delimiter
+
+    if has_header:
+        columns = pandas.read_csv(filename, sep=sep, nrows=0).columns
+        columns = [column.strip() for column in columns]
+        header = 0
+    else:
+        num_columns = len(pandas.read_csv(
+            filename, sep=sep, header=None, nrows=1).columns)
+        columns = (COLUMNS + [
+            'column_%d' % i
+            for i in range(len(COLUMNS), num_columns)])[:num_columns]
+        header = None
+    missing = [
+        column for column in LOCATION_COLUMNS + ID_COLUMNS
+        if column not in columns]
+    assert not missing, "Columns %s missing in %s" % (missing, filename)
+
+    use_columns = LOCATION_COLUMNS + ID_COLUMNS + [
+        column for column in ['radius', 'div_state'] if column in columns]
+
+    reader = pandas.read_csv(
+        filename,
+        sep=sep,
+        header=header,
+        names=columns,
+        usecols=use_columns,
+        skipinitialspace=True,
+        chunksize=chunk_size)
+
+    for chunk in reader:
+
+        # scale in double precision, as the roi is tested before rounding
+        locations = chunk[LOCATION_COLUMNS].to_numpy(
+            dtype=np.float64)*scale
+        if limit_to_roi is not None:
+            inside = get_points_in_roi(locations, limit_to_roi)
+            chunk = chunk[inside]
+            locations = locations[inside]
+
+        tracks = {'location': locations.astype(np.float32)}
+        for column in ID_COLUMNS:
+            tracks[column] = chunk[column].to_numpy().astype(np.int64)
+        if 'radius' in chunk and \
+                pandas.api.types.is_numeric_dtype(chunk['radius']):
+            tracks['radius'] = chunk['radius'].to_numpy().astype(np.float32)
+        if 'div_state' in chunk:
+            tracks['div_state'] = \
+                chunk['div_state'].to_numpy().astype(np.int64)
+
+        yield tracks
+
+
+def get_points_in_roi(locations, roi):
+    '''Get a boolean mask of the ``locations`` (as an array of shape ``(n,
+    dims)``) that are in ``roi``. Locations are truncated to integers before,
+    as when testing ``roi.contains(Coordinate(location))``.'''
+
+    coordinates = np.trunc(locations)
+    inside = np.ones((len(locations),), dtype=np.bool)
+    for d, (begin, end) in enumerate(zip(roi.get_begin(), roi.get_end())):
+        if begin is not None:
+            inside &= coordinates[:, d] >= begin
+        if end is not None:
+            inside &= coordinates[:, d] < end
+
+    return inside
@@ -2,6 +2,8 @@
 from .predict_blockwise import predict_blockwise
 from .extract_edges_blockwise import extract_edges_blockwise
 from .solve_blockwise import solve_blockwise
+from .greedy_solve_blockwise import greedy_solve_blockwise
 from .daisy_check_functions import (
         write_done, check_function,
-        write_done_all_blocks, check_function_all_blocks)
+        write_done_all_blocks, check_function_all_blocks,
+        BlockCompletion, get_block_completion, get_check_functions)
@@ -1,30 +1,201 @@
+import logging
+import multiprocessing.util
+import os
 import pymongo
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# one client per host and process (clients are pooled, but must not be
+# shared across forks), and one BlockCompletion per step and process
+_clients = {}
+_completions = {}
+_lock = threading.Lock()
 
 
 def get_daisy_collection_name(step_name):
     return step_name + "_daisy"
 
 
-def check_function(block, step_name, db_name, db_host):
-    client = pymongo.MongoClient(db_host)
-    db = client[db_name]
-    daisy_coll = db[get_daisy_collection_name(step_name)]
-    result = daisy_coll.find_one({'_id': block.block_id})
-    if result is None:
+def _get_client(db_host):
+
+    key = (os.getpid(), db_host)
+    with _lock:
+        if key not in _clients:
+            _clients[key] = pymongo.MongoClient(db_host)
+        return _clients[key]
+
+
+class BlockCompletion:
+    ''' Keeps track of the blocks of a step that are done, with one pooled
+    client per process instead of one client per query.
+
+    All completed block ids of the step are read once, on the first
+    ``check``. The first check of a block is answered from this set, later
+    checks of the same block (e.g., daisy's post-check) ask the db again.
+
+    Blocks marked done with ``mark_done`` are written in batches, whenever
+    ``max_pending`` blocks are waiting, the oldest one waited for
+    ``max_delay`` seconds, or the process exits. A block whose
+    acknowledgement is lost (e.g., if the process is killed) is processed
+    again on the next run.
+
+    Use ``get_block_completion`` to get the instance of a step for the
+    current process.
+    '''
+    def __init__(
+            self,
+            step_name,
+            db_name,
+            db_host,
+            max_pending=100,
+            max_delay=10):
+
+        self.step_name = step_name
+        self.db_name = db_name
+        self.db_host = db_host
+        self.max_pending = max_pending
+        self.max_delay = max_delay
+
+        self.done = None
+        self.checked = set()
+        self.pending = []
+        self.pending_since = None
+        self.num_checked = 0
+        self.num_skipped = 0
+        self.num_written = 0
+
+        # flush when the process exits, also for multiprocessing workers
+        # (which do not run atexit handlers)
+        multiprocessing.util.Finalize(self, self.flush, exitpriority=10)
+
+    @property
+    def collection(self):
+        client = _get_client(self.db_host)
+        return client[self.db_name][
+            get_daisy_collection_name(self.step_name)]
+
+    def check(self, block):
+        '''Check whether ``block`` is done.'''
+
+        if self.done is None:
+            self.prefetch()
+        self.num_checked += 1
+
+        block_id = block.block_id
+        if block_id in self.done:
+            self.num_skipped += 1
+            return True
+        if block_id in self.checked:
+            if self.collection.find_one({'_id': block_id}) is not None:
+                self.done.add(block_id)
+                return True
+            return False
+        self.checked.add(block_id)
         return False
-    else:
-        return True
+
+    def mark_done(self, block):
+        '''Mark ``block`` as done. The acknowledgement is written in a
+        batch with others, see ``flush``.'''
+
+        if self.done is not None:
+            self.done.add(block.block_id)
+        if not self.pending:
+            self.pending_since = time.time()
+        self.pending.append(block.block_id)
+        if len(self.pending) >= self.max_pending or\
+                time.time() - self.pending_since >= self.max_delay:
+            self.flush()
+
+    def flush(self):
+        '''Write the acknowledgements of all blocks marked done so far.'''
+
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, []
+        try:
+            self.collection.insert_many(
+                [{'_id': block_id} for block_id in pending],
+                ordered=False)
+        except pymongo.errors.BulkWriteError as e:
+            # blocks that were processed again are already acknowledged
+            errors = e.details['writeErrors']
+            if any(error['code'] != 11000 for error in errors):
+                raise
+        self.num_written += len(pending)
+        logger.debug(
+            "Acknowledged %d blocks of step %s", len(pending), self.step_name)
+
+    def prefetch(self):
+        '''Read the ids of all completed blocks of the step.'''
+
+        start_time = time.time()
+        self.done = set(
+            entry['_id'] for entry in self.collection.find({}, {'_id': 1}))
+        self.checked = set()
+        logger.info(
+            "Found %d completed blocks of step %s in %.3f seconds",
+            len(self.done), self.step_name, time.time() - start_time)
+
+    def reset(self):
+        '''Forget the completed blocks read so far, to read them again on the
+        next ``check`` (e.g., at the start of a new run).'''
+
+        self.done = None
+        self.checked = set()
+        self.num_checked = 0
+        self.num_skipped = 0
+
+    def progress(self):
+        '''Get a dict with the number of ``checked`` blocks, the number of
+        those that were ``skipped`` (already done), the number of blocks
+        ``written`` (acknowledged) by this process, and the number of
+        acknowledgements still ``pending``.'''
+
+        return {
+            'checked': self.num_checked,
+            'skipped': self.num_skipped,
+            'written': self.num_written,
+            'pending': len(self.pending),
+        }
+
+
+def get_block_completion(step_name, db_name, db_host):
+    '''Get the ``BlockCompletion`` of a step for the current process.'''
+
+    key = (os.getpid(), step_name, db_name, db_host)
+    with _lock:
+        if key not in _completions:
+            _completions[key] = BlockCompletion(step_name, db_name, db_host)
+        return _completions[key]
+
+
+def get_check_functions(step_name, db_name, db_host):
+    '''Get a tuple of pre- and post-check functions for
+    ``daisy.run_blockwise``, for a step whose blocks are marked done with
+    ``write_done``.
+
+    The pre-check answers from the completed blocks of the step, read again
+    at the first check. Since acknowledgements are written in batches, the
+    post-check does not ask the db and relies on the return value of the
+    process function instead.
+    '''
+    completion = get_block_completion(step_name, db_name, db_host)
+    completion.reset()
+    return (completion.check, lambda b: True)
+
+
+def check_function(block, step_name, db_name, db_host):
+    return get_block_completion(step_name, db_name, db_host).check(block)
 
 
 def write_done(block, step_name, db_name, db_host):
-    client = pymongo.MongoClient(db_host)
-    db = client[db_name]
-    daisy_coll = db[get_daisy_collection_name(step_name)]
-    daisy_coll.insert_one({'_id': block.block_id})
+    get_block_completion(step_name, db_name, db_host).mark_done(block)
 
 
 def check_function_all_blocks(step_name, db_name, db_host):
-    client = pymongo.MongoClient(db_host)
+    client = _get_client(db_host)
     db = client[db_name]
     daisy_coll = db[get_daisy_collection_name(step_name)]
     result = daisy_coll.find_one({'_id': step_name})
@@ -35,7 +206,10 @@ def check_function_all_blocks(step_name, db_name, db_host):
 
 
 def write_done_all_blocks(step_name, db_name, db_host):
-    client = pymongo.MongoClient(db_host)
+    completion = get_block_completion(step_name, db_name, db_host)
+    completion.flush()
+    logger.info("Progress of step %s: %s", step_name, completion.progress())
+    client = _get_client(db_host)
     db = client[db_name]
     daisy_coll = db[get_daisy_collection_name(step_name)]
     daisy_coll.insert_one({'_id': step_name})
@@ -2,10 +2,11 @@ from __future__ import absolute_import
 from scipy.spatial import cKDTree
 import daisy
 import linajea
-from .daisy_check_functions import write_done, check_function
+from .daisy_check_functions import write_done, get_check_functions
 from ..datasets import get_source_roi
 import logging
 import numpy as np
+import pymongo
 import time
 
 logger = logging.getLogger(__name__)
@@ -22,7 +23,15 @@ def extract_edges_blockwise(
         frame_context=1,
         data_dir='../01_data',
         use_pv_distance=False,
+        columnar=False,
         **kwargs):
+    '''Extract candidate edges between cells in consecutive frames.
+
+    If ``columnar`` is set, blocks are processed with
+    ``extract_edges_in_block_columnar``, which works on arrays of node
+    positions and writes edges in bulk instead of going through a networkx
+    graph.
+    '''
 
     voxel_size, source_roi = get_source_roi(data_dir, sample)
 
@@ -56,19 +65,23 @@ def extract_edges_blockwise(
 
     print("Starting block-wise processing...")
 
+    if columnar:
+        extract_function = extract_edges_in_block_columnar
+    else:
+        extract_function = extract_edges_in_block
+
     # process block-wise
     daisy.run_blockwise(
         input_roi,
         block_read_roi,
         block_write_roi,
-        process_function=lambda b: extract_edges_in_block(
+        process_function=lambda b: extract_function(
             db_name,
             db_host,
             edge_move_threshold,
             b,
             use_pv_distance=use_pv_distance),
-        check_function=lambda b: check_function(
-            b,
+        check_function=get_check_functions(
             'extract_edges',
             db_name,
             db_host),
@@ -201,3 +214,160 @@ def extract_edges_in_block(
         time.time() - start)
     write_done(block, 'extract_edges', db_name, db_host)
     return 0
+
+
+def extract_edges_in_block_columnar(
+        db_name,
+        db_host,
+        edge_move_threshold,
+        block,
+        use_pv_distance=False):
+    '''Same as ``extract_edges_in_block``, but reads the cells of the block
+    into arrays, finds all candidate pairs between two frames with a single
+    KD tree query, computes the distances for all pairs at once and inserts
+    the edges in bulk, without building a networkx graph.'''
+
+    logger.info(
+        "Finding edges in %s, reading from %s",
+        block.write_roi, block.read_roi)
+
+    start = time.time()
+
+    graph_provider = linajea.CandidateDatabase(
+        db_name,
+        db_host,
+        mode='r+')
+    nodes = graph_provider.read_node_arrays(
+        block.read_roi,
+        node_attrs=['parent_vector'])
+
+    if len(nodes['id']) == 0:
+        logger.info("No cells in roi %s. Skipping", block.read_roi)
+        write_done(block, 'extract_edges', db_name, db_host)
+        return 0
+
+    ids = nodes['id']
+    positions = np.stack(
+        [nodes[d] for d in ['t', 'z', 'y', 'x']],
+        axis=1)
+    parent_vectors = nodes['parent_vector']
+    del nodes
+
+    logger.info(
+        "Read %d cells in %.3fs",
+        len(ids),
+        time.time() - start)
+
+    start = time.time()
+
+    t_begin = block.write_roi.get_begin()[0]
+    t_end = block.write_roi.get_end()[0]
+
+    # edges are only written for source ('next') cells in the write roi
+    write_begin = np.array(block.write_roi.get_begin())
+    write_end = np.array(block.write_roi.get_end())
+    in_write_roi = np.logical_and(
+        np.all(positions >= write_begin, axis=1),
+        np.all(positions < write_end, axis=1))
+
+    frames = positions[:, 0]
+    sources = []
+    targets = []
+    distances = []
+    prediction_distances = []
+
+    for t in range(t_begin, t_end):
+
+        pre = np.flatnonzero(frames == t - 1)
+        nex = np.flatnonzero(np.logical_and(frames == t, in_write_roi))
+
+        logger.debug(
+            "Finding edges between cells in frames %d and %d "
+            "(%d and %d cells)",
+            t - 1, t, len(pre), len(nex))
+
+        if len(pre) == 0 or len(nex) == 0:
+
+            logger.debug("There are no edges between these frames, skipping")
+            continue
+
+        pre_centers = positions[pre, 1:]
+        nex_centers = positions[nex, 1:]
+        nex_parent_centers = nex_centers + parent_vectors[nex]
+
+        if use_pv_distance:
+            query_points = nex_parent_centers
+        else:
+            query_points = nex_centers
+
+        # all (nex, pre) pairs within edge_move_threshold in one query
+        pairs = cKDTree(query_points).sparse_distance_matrix(
+            cKDTree(pre_centers),
+            edge_move_threshold,
+            output_type='ndarray')
+
+        if len(pairs) == 0:
+            continue
+
+        nex_index = pairs['i']
+        pre_index = pairs['j']
+
+        sources.append(ids[nex[nex_index]])
+        targets.append(ids[pre[pre_index]])
+        distances.append(np.linalg.norm(
+            pre_centers[pre_index] - nex_centers[nex_index],
+            axis=1))
+        prediction_distances.append(np.linalg.norm(
+            pre_centers[pre_index] - nex_parent_centers[nex_index],
+            axis=1))
+
+    num_edges = sum(len(s) for s in sources)
+    logger.info("Found %d edges", num_edges)
+
+    logger.info(
+        "Extracted edges in %.3fs",
+        time.time() - start)
+
+    if num_edges == 0:
+        write_done(block, 'extract_edges', db_name, db_host)
+        return 0
+
+    start = time.time()
+
+    u, v = graph_provider.endpoint_names
+    edges = [
+        {
+            u: int(source),
+            v: int(target),
+            'distance': float(distance),
+            'prediction_distance': float(prediction_distance)
+        }
+        for source, target, distance, prediction_distance in zip(
+            np.concatenate(sources),
+            np.concatenate(targets),
+            np.concatenate(distances),
+            np.concatenate(prediction_distances))
+    ]
+
+    try:
+        graph_provider._MongoDbGraphProvider__connect()
+        graph_provider._MongoDbGraphProvider__open_db()
+        graph_provider._MongoDbGraphProvider__open_collections()
+        graph_provider.edges.insert_many(edges, ordered=False)
+    except pymongo.errors.BulkWriteError as e:
+        # edges that already exist (e.g., from a previous, partially
+        # finished run of this block) are not an error
+        write_errors = e.details['writeErrors']
+        if any(error['code'] != 11000 for error in write_errors):
+            raise
+        logger.info(
+            "Skipped %d edges that were already in the database",
+            len(write_errors))
+    finally:
+        graph_provider._MongoDbGraphProvider__disconnect()
+
+    logger.info(
+        "Wrote edges in %.3fs",
+        time.time() - start)
+    write_done(block, 'extract_edges', db_name, db_host)
+    return 0
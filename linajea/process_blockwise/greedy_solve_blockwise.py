@@ -0,0 +1,169 @@
+import daisy
+from linajea import CandidateDatabase
+from .daisy_check_functions import (
+        get_check_functions, write_done,
+        check_function_all_blocks, write_done_all_blocks)
+from linajea.tracking import greedy_track
+from ..datasets import get_source_roi
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+selected_key = 'selected_greedy'
+step_name = 'solve_greedy'
+
+
+def greedy_solve_blockwise(
+        db_host,
+        db_name,
+        sample,
+        cell_indicator_threshold,
+        block_size,
+        context,
+        num_workers=8,
+        frames=None,
+        limit_to_roi=None,
+        from_scratch=False,
+        data_dir='../01_data',
+        metric='prediction_distance',
+        allow_new_tracks=True,
+        **kwargs):
+    ''' Track greedily (see ``linajea.tracking.greedy_track``) in blocks of
+    ``block_size`` with ``context``, and store the result in the edge
+    attribute ``selected_greedy``. Edges selected in neighboring blocks are
+    kept and constrain the selection in the context of a block.
+
+    This is much faster than solving the ILP and needs no parameter search,
+    which makes it a baseline and a fallback for large volumes.
+    '''
+    block_size = daisy.Coordinate(block_size)
+    context = daisy.Coordinate(context)
+    voxel_size, source_roi = get_source_roi(data_dir, sample)
+
+    if from_scratch:
+        graph_provider = CandidateDatabase(db_name, db_host, mode='r+')
+        graph_provider.reset_selection(parameter_ids=['greedy'])
+
+    # limit to specific frames, if given
+    if frames:
+        logger.info("Solving in frames %s" % frames)
+        begin, end = frames
+        crop_roi = daisy.Roi(
+            (begin, None, None, None),
+            (end - begin, None, None, None))
+        source_roi = source_roi.intersect(crop_roi)
+    # limit to roi, if given
+    if limit_to_roi:
+        logger.info("limiting to roi %s" % str(limit_to_roi))
+        source_roi = source_roi.intersect(limit_to_roi)
+
+    block_write_roi = daisy.Roi(
+        (0, 0, 0, 0),
+        block_size)
+    block_read_roi = block_write_roi.grow(
+        context,
+        context)
+    total_roi = source_roi.grow(
+        context,
+        context)
+
+    logger.info("Solving greedily in %s", total_roi)
+
+    if check_function_all_blocks(step_name, db_name, db_host):
+        logger.info("Greedy solution already completed. Exiting")
+        return True
+
+    success = daisy.run_blockwise(
+        total_roi,
+        block_read_roi,
+        block_write_roi,
+        process_function=lambda b: greedy_solve_in_block(
+            db_host,
+            db_name,
+            cell_indicator_threshold,
+            b,
+            solution_roi=source_roi,
+            metric=metric,
+            allow_new_tracks=allow_new_tracks),
+        check_function=get_check_functions(
+            step_name,
+            db_name,
+            db_host),
+        num_workers=num_workers,
+        fit='overhang')
+    if success:
+        write_done_all_blocks(
+            step_name,
+            db_name,
+            db_host)
+    logger.info("Finished solving greedily")
+    return success
+
+
+def greedy_solve_in_block(
+        db_host,
+        db_name,
+        cell_indicator_threshold,
+        block,
+        solution_roi=None,
+        metric='prediction_distance',
+        allow_new_tracks=True):
+
+    logger.debug("Solving greedily in block %s", block)
+
+    if solution_roi:
+        # Limit block to source_roi
+        read_roi = block.read_roi.intersect(solution_roi)
+        write_roi = block.write_roi.intersect(solution_roi)
+    else:
+        read_roi = block.read_roi
+        write_roi = block.write_roi
+
+    graph_provider = CandidateDatabase(
+        db_name,
+        db_host,
+        mode='r+')
+    start_time = time.time()
+    graph = graph_provider.get_graph(
+            read_roi,
+            edge_attrs=[selected_key, metric]
+            )
+
+    # remove dangling nodes and edges
+    dangling_nodes = [
+        n
+        for n, data in graph.nodes(data=True)
+        if 't' not in data
+    ]
+    graph.remove_nodes_from(dangling_nodes)
+
+    num_nodes = graph.number_of_nodes()
+    num_edges = graph.number_of_edges()
+    logger.info("Reading graph with %d nodes and %d edges took %s seconds"
+                % (num_nodes, num_edges, time.time() - start_time))
+
+    if num_edges == 0:
+        logger.info("No edges in roi %s. Skipping"
+                    % read_roi)
+        write_done(block, step_name, db_name, db_host)
+        return 0
+
+    greedy_track(
+        graph,
+        selected_key,
+        cell_indicator_threshold,
+        metric=metric,
+        allow_new_tracks=allow_new_tracks,
+        keep_selected=True)
+
+    start_time = time.time()
+    graph.update_edge_attrs(
+            write_roi,
+            attributes=[selected_key])
+    logger.info("Updating %s for %d edges took %s seconds"
+                % (selected_key,
+                   num_edges,
+                   time.time() - start_time))
+    write_done(block, step_name, db_name, db_host)
+    return 0
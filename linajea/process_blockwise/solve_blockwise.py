@@ -1,7 +1,7 @@
 import daisy
 from linajea import CandidateDatabase
 from .daisy_check_functions import (
-        check_function, write_done,
+        get_check_functions, write_done,
         check_function_all_blocks, write_done_all_blocks)
 from linajea.tracking import track, nm_track, NMTrackingParameters
 from ..datasets import get_source_roi
@@ -22,6 +22,13 @@ def solve_blockwise(
         from_scratch=False,
         data_dir='../01_data',
         cell_cycle_key=None,
+        use_sparse_solver=False,
+        order_by_similarity=False,
+        num_parameter_workers=1,
+        window_size=None,
+        window_overlap=2,
+        split_components=False,
+        compare_to_monolithic=False,
         **kwargs):
 
     block_size = daisy.Coordinate(parameters[0].block_size)
@@ -108,12 +115,18 @@ def solve_blockwise(
             b,
             parameters_id,
             solution_roi=source_roi,
-            cell_cycle_key=cell_cycle_key),
+            cell_cycle_key=cell_cycle_key,
+            use_sparse_solver=use_sparse_solver,
+            order_by_similarity=order_by_similarity,
+            num_parameter_workers=num_parameter_workers,
+            window_size=window_size,
+            window_overlap=window_overlap,
+            split_components=split_components,
+            compare_to_monolithic=compare_to_monolithic),
         # Note: in the case of a set of parameters,
         # we are assuming that none of the individual parameters are
         # half done and only checking the hash for each block
-        check_function=lambda b: check_function(
-            b,
+        check_function=get_check_functions(
             step_name,
             db_name,
             db_host),
@@ -142,7 +155,14 @@ def solve_in_block(
         block,
         parameters_id,
         solution_roi=None,
-        cell_cycle_key=None):
+        cell_cycle_key=None,
+        use_sparse_solver=False,
+        order_by_similarity=False,
+        num_parameter_workers=1,
+        window_size=None,
+        window_overlap=2,
+        split_components=False,
+        compare_to_monolithic=False):
     # Solution_roi is the total roi that you want a solution in
     # Limiting the block to the solution_roi allows you to solve
     # all the way to the edge, without worrying about reading
@@ -205,8 +225,22 @@ def solve_in_block(
     if isinstance(parameters[0], NMTrackingParameters):
         nm_track(graph, parameters, selected_keys, frames=frames)
     else:
-        track(graph, parameters, selected_keys, frames=frames,
-              cell_cycle_key=cell_cycle_key)
+        solve_stats = track(
+            graph, parameters, selected_keys, frames=frames,
+            cell_cycle_key=cell_cycle_key,
+            use_sparse_solver=use_sparse_solver,
+            order_by_similarity=order_by_similarity,
+            num_workers=num_parameter_workers,
+            window_size=window_size,
+            window_overlap=window_overlap,
+            split_components=split_components,
+            compare_to_monolithic=compare_to_monolithic)
+        for stats in solve_stats:
+            logger.debug("Solve stats: %s", stats)
+            if stats.get('objective_loss') is not None:
+                logger.info(
+                    "Windows lose %.2f%% of the objective for %s",
+                    100*stats['objective_loss'], stats['selected_key'])
     start_time = time.time()
     graph.update_edge_attrs(
             write_roi,
@@ -6,5 +6,9 @@ from .track import track
 from .greedy_track import greedy_track
 from .non_minimal_track import nm_track
 from .track_graph import TrackGraph
+from .compact_track_graph import CompactTrackGraph, TrackView
 from .solver import Solver
+from .sparse_solver import SparseSolver
+from .windowed_solver import WindowedSolver
+from .component_solver import ComponentSolver
 from .non_minimal_solver import NMSolver
@@ -0,0 +1,690 @@
+from .track_graph import TrackGraph
+import logging
+import numpy as np
+import scipy.sparse
+import scipy.sparse.csgraph
+
+logger = logging.getLogger(__name__)
+
+
+class CompactTrackGraph(object):
+    '''A track graph of cells and inter-frame edges between them, stored as
+    arrays instead of networkx dictionaries. Has the same ``cells_by_frame``,
+    ``prev_edges``, ``next_edges``, ``get_frames`` and ``get_tracks``
+    interface as ``TrackGraph``, and enough of the networkx interface
+    (``nodes``, ``edges``, ``in_degree``, ...) to be used with ``Solver``,
+    ``SparseSolver`` and the ``Evaluator``.
+
+    Nodes are sorted by frame (and id), so that the cells of a frame are a
+    slice of the node arrays. Edges are sorted by their source, and the
+    edges of a node are found through CSR offsets into the edge arrays.
+    Node and edge attributes are stored as one array per attribute.
+
+    Use ``from_graph`` to convert a networkx graph, or ``from_arrays`` to
+    create one from the arrays returned by ``CandidateDatabase.read_arrays``.
+
+    Args:
+
+        node_ids (``ndarray``):
+
+            The ids of the nodes.
+
+        frames (``ndarray``):
+
+            The frame of each node.
+
+        sources, targets (``ndarray``):
+
+            The ids of the source and target of each edge. Each edge has to
+            point backwards in time.
+
+        node_attrs, edge_attrs (``dict``, optional):
+
+            Dictionaries from attribute names to arrays with a value for
+            each node and edge.
+
+        node_present, edge_present (``dict``, optional):
+
+            Dictionaries from attribute names to boolean arrays of whether
+            each node and edge has the attribute. Attributes that are not in
+            these dictionaries are set for all nodes and edges.
+
+        frame_key (``string``, optional):
+
+            The name of the node attribute that corresponds to the frame of
+            the node. Defaults to "t".
+
+        roi (``daisy.Roi``, optional)
+
+            The region of interest that the graph covers. Used for solving.
+    '''
+
+    def __init__(
+            self,
+            node_ids,
+            frames,
+            sources,
+            targets,
+            node_attrs=None,
+            edge_attrs=None,
+            node_present=None,
+            edge_present=None,
+            frame_key='t',
+            roi=None):
+
+        self.frame_key = frame_key
+        self.roi = roi
+
+        node_ids = np.asarray(node_ids, dtype=np.int64)
+        frames = np.asarray(frames, dtype=np.int64)
+        node_order = np.lexsort((node_ids, frames))
+        self.node_ids = node_ids[node_order]
+        self.frames = frames[node_order]
+        num_nodes = len(self.node_ids)
+
+        # for lookups of node ids
+        self._id_order = np.argsort(self.node_ids, kind='stable')
+        self._sorted_ids = self.node_ids[self._id_order]
+
+        if num_nodes > 0:
+            self.begin = int(self.frames[0])
+            self.end = int(self.frames[-1]) + 1
+            self._frame_offsets = np.searchsorted(
+                self.frames, np.arange(self.begin, self.end + 1))
+        else:
+            self.begin = None
+            self.end = None
+            self._frame_offsets = np.zeros(1, dtype=np.int64)
+
+        source_index = self.index_of(sources)
+        target_index = self.index_of(targets)
+        if np.any(source_index < 0) or np.any(target_index < 0):
+            raise ValueError("Edges between nodes that are not in the graph")
+        backwards = self.frames[source_index] > self.frames[target_index]
+        if not np.all(backwards):
+            i = int(np.argmin(backwards))
+            raise RuntimeError(
+                "edge from %d to %d does not go backwards in time, but "
+                "from frame %d to %d" % (
+                    sources[i], targets[i],
+                    self.frames[source_index[i]],
+                    self.frames[target_index[i]]))
+
+        # edges sorted by source, with CSR offsets for prev edges and a
+        # permutation sorted by target with CSR offsets for next edges
+        edge_order = np.lexsort((target_index, source_index))
+        self.sources = source_index[edge_order]
+        self.targets = target_index[edge_order]
+        self._prev_offsets = _offsets(self.sources, num_nodes)
+        self._next_order = np.argsort(self.targets, kind='stable')
+        self._next_offsets = _offsets(
+            self.targets[self._next_order], num_nodes)
+
+        self.node_attrs = _Columns(num_nodes)
+        _set_ordered(self.node_attrs, node_attrs, node_present, node_order)
+        self.node_attrs.set(frame_key, self.frames)
+        self.edge_attrs = _Columns(len(self.sources))
+        _set_ordered(self.edge_attrs, edge_attrs, edge_present, edge_order)
+
+    @classmethod
+    def from_graph(cls, graph, frame_key='t', roi=None):
+        '''Create a ``CompactTrackGraph`` from a networkx graph. As for
+        ``TrackGraph``, nodes without ``frame_key`` are left out.'''
+
+        nodes = [
+            (node, data) for node, data in graph.nodes(data=True)
+            if frame_key in data
+        ]
+        node_set = set(node for node, _ in nodes)
+        edges = [
+            (u, v, data) for u, v, data in graph.edges(data=True)
+            if u in node_set and v in node_set
+        ]
+        node_attrs = _Columns.from_dicts([data for _, data in nodes])
+        node_attrs.pop(frame_key)
+        edge_attrs = _Columns.from_dicts([data for _, _, data in edges])
+
+        track_graph = cls(
+            [node for node, _ in nodes],
+            [data[frame_key] for _, data in nodes],
+            [u for u, _, _ in edges],
+            [v for _, v, _ in edges],
+            frame_key=frame_key,
+            roi=roi if roi is not None else getattr(graph, 'roi', None))
+        track_graph._set_columns(track_graph.node_attrs, node_attrs,
+                                 track_graph._node_order_of(
+                                     [node for node, _ in nodes]))
+        track_graph._set_columns(track_graph.edge_attrs, edge_attrs,
+                                 track_graph._edge_order_of(
+                                     [(u, v) for u, v, _ in edges]))
+        return track_graph
+
+    @classmethod
+    def from_arrays(
+            cls,
+            nodes,
+            edges,
+            frame_key='t',
+            roi=None,
+            endpoint_names=['source', 'target']):
+        '''Create a ``CompactTrackGraph`` from the node and edge tables
+        returned by ``CandidateDatabase.read_arrays``. Edges to nodes that
+        are not in the node table are left out. Attributes that are missing
+        for some nodes or edges in the tables (like the ``selected`` key of
+        edges that were not solved yet) are unset for those, so that the
+        solvers only pin edges that have a value.
+        '''
+        u, v = endpoint_names
+        in_graph = edges['target_index'] >= 0
+        node_attrs = {
+            key: values for key, values in nodes.items()
+            if key not in ['id', frame_key, 'present']
+        }
+        edge_attrs = {
+            key: values[in_graph] for key, values in edges.items()
+            if key not in [
+                u, v, 'source_index', 'target_index', 'indptr', 'present']
+        }
+        edge_present = {
+            key: present[in_graph]
+            for key, present in edges.get('present', {}).items()
+        }
+        return cls(
+            nodes['id'],
+            nodes[frame_key],
+            edges[u][in_graph],
+            edges[v][in_graph],
+            node_attrs=node_attrs,
+            edge_attrs=edge_attrs,
+            node_present=nodes.get('present'),
+            edge_present=edge_present,
+            frame_key=frame_key,
+            roi=roi)
+
+    def index_of(self, nodes):
+        '''Get the positions of node ids in the node arrays (-1 for ids that
+        are not in the graph).'''
+
+        nodes = np.asarray(nodes, dtype=np.int64)
+        if len(self._sorted_ids) == 0:
+            return np.full(nodes.shape, -1, dtype=np.int64)
+        positions = np.searchsorted(self._sorted_ids, nodes)
+        positions[positions == len(self._sorted_ids)] = 0
+        found = self._sorted_ids[positions] == nodes
+        return np.where(found, self._id_order[positions], -1)
+
+    def edge_index_of(self, edge):
+        '''Get the position of edge ``(u, v)`` in the edge arrays.'''
+
+        u, v = self._index(edge[0]), self._index(edge[1])
+        begin, end = self._prev_offsets[u], self._prev_offsets[u + 1]
+        for e in range(begin, end):
+            if self.targets[e] == v:
+                return e
+        raise KeyError("Edge %s not in graph" % (edge,))
+
+    def number_of_nodes(self):
+        return len(self.node_ids)
+
+    def number_of_edges(self):
+        return len(self.sources)
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    def __contains__(self, node):
+        return self.index_of([node])[0] >= 0
+
+    @property
+    def nodes(self):
+        return _NodeView(self)
+
+    @property
+    def edges(self):
+        return _EdgeView(self)
+
+    def prev_edges(self, node):
+        '''Get all edges that point backward from ``node``.'''
+
+        return self._edges_of(node, self._prev_offsets, None)
+
+    def next_edges(self, node):
+        '''Get all edges that point forward from ``node``.'''
+
+        return self._edges_of(node, self._next_offsets, self._next_order)
+
+    def out_degree(self, node=None):
+        '''Number of prev edges of ``node``, or a list of ``(node,
+        degree)`` for all nodes.'''
+
+        return self._degree(node, self._prev_offsets)
+
+    def in_degree(self, node=None):
+        '''Number of next edges of ``node``, or a list of ``(node,
+        degree)`` for all nodes.'''
+
+        return self._degree(node, self._next_offsets)
+
+    def get_frames(self):
+        '''Get a tuple ``(t_1, t_2)`` of the first and last frame this track
+        graph has nodes for.'''
+
+        return (self.begin, self.end - 1)
+
+    def cells_by_frame(self, t):
+        '''Get the ids of all cells in frame ``t``, as a view into the array
+        of node ids.'''
+
+        if self.begin is None or t < self.begin or t >= self.end:
+            return self.node_ids[:0]
+        t = int(t) - self.begin
+        return self.node_ids[
+            self._frame_offsets[t]:self._frame_offsets[t + 1]]
+
+    def get_tracks(self, require_selected=False, selected_key='selected'):
+        '''Get a list of ``TrackView``, one for each track (i.e., connected
+        component in the track graph). See ``TrackGraph.get_tracks``.'''
+
+        num_nodes = len(self.node_ids)
+        if num_nodes == 0:
+            return []
+
+        if require_selected:
+            edges = np.flatnonzero(self.edge_attrs.values_or(
+                selected_key, False).astype(bool))
+        else:
+            edges = np.arange(len(self.sources))
+        adjacency = scipy.sparse.coo_matrix(
+            (
+                np.ones(len(edges), dtype=np.int8),
+                (self.sources[edges], self.targets[edges])
+            ),
+            shape=(num_nodes, num_nodes))
+        num_tracks, node_labels = scipy.sparse.csgraph.connected_components(
+            adjacency, directed=True, connection='weak')
+        edge_labels = np.full(len(self.sources), -1, dtype=np.int64)
+        edge_labels[edges] = node_labels[self.sources[edges]]
+
+        node_order = np.argsort(node_labels, kind='stable')
+        node_offsets = _offsets(node_labels[node_order], num_tracks)
+        edge_order = edges[np.argsort(edge_labels[edges], kind='stable')]
+        edge_offsets = _offsets(edge_labels[edge_order], num_tracks)
+
+        return [
+            TrackView(
+                self,
+                node_order[node_offsets[i]:node_offsets[i + 1]],
+                edge_order[edge_offsets[i]:edge_offsets[i + 1]])
+            for i in range(num_tracks)
+        ]
+
+    def edge_subgraph(self, edges):
+        '''Get a ``TrackGraph`` with the given edges and their nodes, with
+        the frame and position of the nodes.'''
+
+        edge_index = [self.edge_index_of(e) for e in edges]
+        node_index = np.unique(np.concatenate((
+            self.sources[edge_index],
+            self.targets[edge_index]))).astype(np.int64)
+        return TrackGraph(
+            self._to_networkx(node_index, edge_index),
+            frame_key=self.frame_key,
+            roi=self.roi)
+
+    def to_track_graph(self):
+        '''Get a ``TrackGraph`` with all nodes and edges, with the frame and
+        position of the nodes.'''
+
+        return TrackGraph(
+            self._to_networkx(
+                np.arange(len(self.node_ids)),
+                np.arange(len(self.sources))),
+            frame_key=self.frame_key,
+            roi=self.roi)
+
+    def _to_networkx(self, node_index, edge_index):
+
+        import networkx as nx
+        graph = nx.DiGraph()
+        keys = [self.frame_key] + [
+            key for key in ['z', 'y', 'x'] if key in self.node_attrs]
+        columns = [self.node_attrs.values(key)[node_index].tolist()
+                   for key in keys]
+        graph.add_nodes_from(
+            (node, dict(zip(keys, values)))
+            for node, *values in zip(
+                self.node_ids[node_index].tolist(), *columns))
+        graph.add_edges_from(zip(
+            self.node_ids[self.sources[edge_index]].tolist(),
+            self.node_ids[self.targets[edge_index]].tolist()))
+        return graph
+
+    def _index(self, node):
+
+        index = self.index_of([node])[0]
+        if index < 0:
+            raise KeyError("Node %s not in graph" % (node,))
+        return index
+
+    def _edges_of(self, node, offsets, order):
+
+        if isinstance(node, tuple):
+            # several nodes, as for networkx' in_edges and out_edges
+            return [e for n in node for e in self._edges_of(n, offsets, order)]
+        i = self._index(node)
+        edges = np.arange(offsets[i], offsets[i + 1])
+        if order is not None:
+            edges = order[edges]
+        return list(zip(
+            self.node_ids[self.sources[edges]].tolist(),
+            self.node_ids[self.targets[edges]].tolist()))
+
+    def _degree(self, node, offsets):
+
+        degrees = np.diff(offsets)
+        if node is not None:
+            return int(degrees[self._index(node)])
+        return list(zip(self.node_ids.tolist(), degrees.tolist()))
+
+    def _node_order_of(self, nodes):
+
+        return np.argsort(self.index_of(nodes), kind='stable')
+
+    def _edge_order_of(self, edges):
+
+        if len(edges) == 0:
+            return np.zeros(0, dtype=np.int64)
+        sources = self.index_of([u for u, _ in edges])
+        targets = self.index_of([v for _, v in edges])
+        return np.lexsort((targets, sources))
+
+    def _set_columns(self, columns, new_columns, order):
+
+        for key in new_columns.keys():
+            values, present = new_columns.get(key)
+            columns.set(key, values[order], present[order])
+
+
+class TrackView(object):
+    '''A track (connected component) of a ``CompactTrackGraph``, given by
+    the positions of its nodes and edges in the arrays of the graph.'''
+
+    def __init__(self, graph, node_index, edge_index):
+        self.graph = graph
+        self.node_index = node_index
+        self.edge_index = edge_index
+
+    @property
+    def nodes(self):
+        return self.graph.node_ids[self.node_index]
+
+    def edges(self):
+        return list(zip(
+            self.graph.node_ids[self.graph.sources[self.edge_index]].tolist(),
+            self.graph.node_ids[self.graph.targets[self.edge_index]].tolist()))
+
+    def number_of_nodes(self):
+        return len(self.node_index)
+
+    def number_of_edges(self):
+        return len(self.edge_index)
+
+    def __len__(self):
+        return len(self.node_index)
+
+
+class _Columns(object):
+    '''Attribute arrays for ``size`` items. Each attribute has an array of
+    values and a boolean array of whether the attribute is set for an item
+    (``None`` if it is set for all).'''
+
+    def __init__(self, size):
+        self.size = size
+        self._columns = {}
+
+    @staticmethod
+    def from_dicts(dicts):
+
+        columns = _Columns(len(dicts))
+        keys = []
+        for data in dicts:
+            for key in data:
+                if key not in columns._columns:
+                    columns._columns[key] = None
+                    keys.append(key)
+        for key in keys:
+            values = [data.get(key) for data in dicts]
+            present = np.array([value is not None for value in values])
+            columns.set(key, _to_array(values, present), present)
+        return columns
+
+    def keys(self):
+        return self._columns.keys()
+
+    def __contains__(self, key):
+        return key in self._columns
+
+    def get(self, key):
+        values, present = self._columns[key]
+        if present is None:
+            present = np.ones(self.size, dtype=bool)
+        return values, present
+
+    def values(self, key):
+        return self._columns[key][0]
+
+    def values_or(self, key, default):
+        '''Get the values of ``key``, with ``default`` where unset.'''
+
+        if key not in self._columns:
+            return np.full(self.size, default)
+        values, present = self._columns[key]
+        if present is None:
+            return values
+        return np.where(present, values, default)
+
+    def set(self, key, values, present=None):
+        values = np.asarray(values)
+        assert len(values) == self.size, \
+            "Got %d values for %d items" % (len(values), self.size)
+        if present is not None and np.all(present):
+            present = None
+        self._columns[key] = (values, present)
+
+    def pop(self, key):
+        return self._columns.pop(key)
+
+    def has(self, key, i):
+        if key not in self._columns:
+            return False
+        present = self._columns[key][1]
+        return present is None or present[i]
+
+    def get_value(self, key, i):
+        if not self.has(key, i):
+            raise KeyError(key)
+        value = self._columns[key][0][i]
+        return value.item() if isinstance(value, np.generic) else value
+
+    def set_value(self, key, i, value):
+        if key not in self._columns:
+            values = np.empty(self.size, dtype=_dtype_of(value))
+            present = np.zeros(self.size, dtype=bool)
+            self._columns[key] = (values, present)
+        values, present = self._columns[key]
+        if values.dtype != object and\
+                np.dtype(_dtype_of(value)) != values.dtype and\
+                not np.can_cast(_dtype_of(value), values.dtype):
+            values = values.astype(object)
+        if present is None:
+            present = np.ones(self.size, dtype=bool)
+        values[i] = value
+        present[i] = True
+        self._columns[key] = (values, present)
+
+
+class _AttributeRow(object):
+    '''The attributes of one node or edge, like the data dictionary of
+    networkx.'''
+
+    def __init__(self, columns, index):
+        self._columns = columns
+        self._index = index
+
+    def __getitem__(self, key):
+        return self._columns.get_value(key, self._index)
+
+    def __setitem__(self, key, value):
+        self._columns.set_value(key, self._index, value)
+
+    def __contains__(self, key):
+        return self._columns.has(key, self._index)
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def keys(self):
+        return [key for key in self._columns.keys() if key in self]
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+
+class _NodeView(object):
+
+    def __init__(self, graph):
+        self._graph = graph
+
+    def __iter__(self):
+        return iter(self._graph.node_ids.tolist())
+
+    def __len__(self):
+        return len(self._graph.node_ids)
+
+    def __contains__(self, node):
+        return node in self._graph
+
+    def __getitem__(self, node):
+        return _AttributeRow(
+            self._graph.node_attrs, self._graph._index(node))
+
+    def __call__(self, data=False, default=None):
+        if data is False:
+            return self
+        nodes = self._graph.node_ids.tolist()
+        if data is True:
+            return [
+                (node, _AttributeRow(self._graph.node_attrs, i))
+                for i, node in enumerate(nodes)
+            ]
+        values = self._graph.node_attrs.values_or(data, default)
+        return list(zip(nodes, values.tolist()))
+
+
+class _EdgeView(object):
+
+    def __init__(self, graph):
+        self._graph = graph
+
+    def _ids(self):
+        graph = self._graph
+        return zip(
+            graph.node_ids[graph.sources].tolist(),
+            graph.node_ids[graph.targets].tolist())
+
+    def __iter__(self):
+        return iter(self._ids())
+
+    def __len__(self):
+        return len(self._graph.sources)
+
+    def __contains__(self, edge):
+        try:
+            self._graph.edge_index_of(edge)
+        except KeyError:
+            return False
+        return True
+
+    def __getitem__(self, edge):
+        return _AttributeRow(
+            self._graph.edge_attrs, self._graph.edge_index_of(edge))
+
+    def items(self):
+        return [
+            (edge, _AttributeRow(self._graph.edge_attrs, i))
+            for i, edge in enumerate(self._ids())
+        ]
+
+    def __call__(self, data=False, default=None):
+        if data is False:
+            return list(self._ids())
+        if data is True:
+            return [
+                (u, v, _AttributeRow(self._graph.edge_attrs, i))
+                for i, (u, v) in enumerate(self._ids())
+            ]
+        values = self._graph.edge_attrs.values_or(data, default)
+        return [
+            (u, v, value)
+            for (u, v), value in zip(self._ids(), values.tolist())
+        ]
+
+
+def _set_ordered(columns, attrs, present, order):
+    '''Set the ``attrs`` arrays (and where given, their ``present`` arrays)
+    in ``columns``, in the given order.'''
+
+    present = present or {}
+    for key, values in (attrs or {}).items():
+        mask = present.get(key)
+        columns.set(
+            key,
+            np.asarray(values)[order],
+            None if mask is None else np.asarray(mask, dtype=bool)[order])
+
+
+def _offsets(sorted_index, size):
+    '''CSR offsets for a sorted array of indices in ``[0, size)``.'''
+
+    offsets = np.zeros(size + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(sorted_index, minlength=size))
+    return offsets
+
+
+def _dtype_of(value):
+
+    if isinstance(value, (bool, np.bool_)):
+        return bool
+    if isinstance(value, (int, np.integer)):
+        return np.int64
+    if isinstance(value, (float, np.floating)):
+        return np.float64
+    return object
+
+
+def _to_array(values, present):
+
+    present_values = [value for value in values if value is not None]
+    if len(present_values) == 0:
+        return np.zeros(len(values))
+    first = present_values[0]
+    if isinstance(first, (list, tuple, np.ndarray)):
+        missing = [np.nan]*len(first)
+        return np.array(
+            [value if value is not None else missing for value in values],
+            dtype=np.float64)
+    dtypes = set(_dtype_of(value) for value in present_values)
+    if dtypes == {bool}:
+        dtype = bool
+    elif dtypes <= {np.int64}:
+        dtype = np.int64
+    elif dtypes <= {np.int64, np.float64}:
+        dtype = np.float64
+    else:
+        dtype = object
+    array = np.zeros(len(values), dtype=dtype)
+    for i in np.flatnonzero(present):
+        array[i] = values[i]
+    return array
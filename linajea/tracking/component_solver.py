@@ -0,0 +1,337 @@
+# -*- coding: UTF-8 -*-
+from .solver import Solver
+from .sparse_solver import track_graph_to_arrays, get_objective, get_pins
+from .track_graph import TrackGraph
+import logging
+import multiprocessing
+import networkx as nx
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class ComponentSolver(object):
+    '''
+    Class for solving the tracking ILP separately for each weakly connected
+    component of the track graph.
+
+    Components that are single nodes or chains (every node has at most one
+    previous and one next edge) and don't have pinned edges are solved in
+    closed form by dynamic programming over the per-node and per-edge costs
+    of the ILP objective. All other components are solved with an ILP
+    solver of type ``solver_type`` each, optionally in parallel.
+
+    Has the same interface as ``Solver``.
+
+    Args:
+
+        solver_type (``class``, optional):
+
+            The solver to use for components that are not chains, ``Solver``
+            or ``SparseSolver``.
+
+        num_workers (``int``, optional):
+
+            If larger than one, solve the components that are not chains in
+            this many forked processes. The processes are started on the
+            first call to ``solve`` and keep the solvers of their components
+            for later solves with other parameters, until ``close`` is
+            called.
+    '''
+    def __init__(self, track_graph, parameters, selected_key,
+                 vgg_key=None, frames=None, num_threads=1,
+                 solver_type=Solver, num_workers=1):
+
+        self.graph = track_graph
+        self.parameters = parameters
+        self.selected_key = selected_key
+        self.vgg_key = vgg_key
+        self.num_threads = num_threads
+        self.start_frame = frames[0] if frames else self.graph.begin
+        self.end_frame = frames[1] if frames else self.graph.end
+        self.solver_type = solver_type
+        self.num_workers = num_workers
+
+        self.node_ids, self.nodes, self.edges = track_graph_to_arrays(
+            track_graph, vgg_key=vgg_key)
+        self.edge_ids = list(track_graph.edges)
+
+        self.singletons = None  # indices of nodes without edges
+        self.chains = []  # list of (node indices, edge indices)
+        self.components = []  # list of lists of node ids
+        self.component_solvers = {}
+        self._workers = None  # list of (process, connection)
+        self._find_components()
+
+        self.selected_nodes = None
+        self.selected_edges = None
+        self.solution_cost = None
+
+    def update_objective(self, parameters, selected_key):
+        self.parameters = parameters
+        self.selected_key = selected_key
+
+    def close(self):
+        '''Stop the worker processes (and free their component solvers), if
+        any were started.'''
+
+        if self._workers is None:
+            return
+        for _, connection in self._workers:
+            connection.send(None)
+        for process, connection in self._workers:
+            process.join()
+            connection.close()
+        self._workers = None
+
+    def solve(self):
+
+        objective = get_objective(
+            self.nodes,
+            self.edges,
+            self.parameters,
+            self.start_frame,
+            self.end_frame,
+            self.graph.roi,
+            use_cell_cycle=self.vgg_key is not None)
+        num_nodes = len(self.node_ids)
+        node_costs = objective[:6*num_nodes].reshape(-1, 6)
+        edge_costs = objective[6*num_nodes:]
+        pins = get_pins(self.graph, self.selected_key)
+
+        self.selected_nodes = np.zeros(num_nodes, dtype=bool)
+        self.selected_edges = np.zeros(len(self.edge_ids), dtype=bool)
+        self.solution_cost = 0
+
+        # a single node is selected if appearing is cheaper than nothing
+        costs = node_costs[self.singletons]
+        singleton_costs = costs[:, 0] + costs[:, 1] +\
+            np.minimum(costs[:, 4], costs[:, 5])
+        self.selected_nodes[self.singletons] = singleton_costs < 0
+        self.solution_cost += np.sum(np.minimum(singleton_costs, 0))
+
+        components = list(range(len(self.components)))
+        num_solved = 0
+        for chain_nodes, chain_edges in self.chains:
+            if np.any(pins[chain_edges] >= 0):
+                components.append(
+                    [self.node_ids[i] for i in chain_nodes])
+                continue
+            self.solution_cost += self._solve_chain(
+                chain_nodes, chain_edges, node_costs, edge_costs)
+            num_solved += 1
+        logger.debug("Solved %d chains in closed form, %d components left",
+                     num_solved, len(components))
+
+        node_index = {n: i for i, n in enumerate(self.node_ids)}
+        edge_index = {e: i for i, e in enumerate(self.edge_ids)}
+        for nodes, edges, cost in self._solve_components(components):
+            for n, selected in nodes.items():
+                self.selected_nodes[node_index[n]] = selected
+            for e, selected in edges.items():
+                self.selected_edges[edge_index[e]] = selected
+            self.solution_cost += cost
+
+        for node, selected in zip(self.node_ids, self.selected_nodes):
+            self.graph.nodes[node][self.selected_key] = bool(selected)
+        for edge, selected in zip(self.edge_ids, self.selected_edges):
+            self.graph.edges[edge][self.selected_key] = bool(selected)
+
+    def _find_components(self):
+
+        node_index = {n: i for i, n in enumerate(self.node_ids)}
+        edge_index = {e: i for i, e in enumerate(self.edge_ids)}
+
+        singletons = []
+        for component in nx.weakly_connected_components(self.graph):
+            if len(component) == 1:
+                singletons.append(node_index[next(iter(component))])
+                continue
+            is_chain = all(
+                self.graph.in_degree(n) <= 1 and self.graph.out_degree(n) <= 1
+                for n in component)
+            if not is_chain:
+                self.components.append(list(component))
+                continue
+            # nodes of a chain, from the first to the last frame
+            nodes = sorted(
+                component,
+                key=lambda n: self.graph.nodes[n][self.graph.frame_key])
+            edges = [
+                edge_index[(nodes[i + 1], nodes[i])]
+                for i in range(len(nodes) - 1)
+            ]
+            self.chains.append((
+                np.array([node_index[n] for n in nodes], dtype=np.int64),
+                np.array(edges, dtype=np.int64)))
+
+        self.singletons = np.array(singletons, dtype=np.int64)
+
+        logger.info(
+            "Found %d single nodes, %d chains, and %d other components",
+            len(self.singletons), len(self.chains), len(self.components))
+
+    def _solve_chain(self, nodes, edges, node_costs, edge_costs):
+        '''Find the optimal selection of nodes and edges in a chain, store it
+        in ``selected_nodes`` and ``selected_edges``, and return its cost.
+
+        Along a chain no node can split, so a selected node either continues
+        the track of its selected previous edge (paying for the continuation
+        indicator), or it appears (paying the appear cost and the cheaper of
+        the child or continuation indicator).
+        '''
+        costs = node_costs[nodes]
+        continue_costs = costs[:, 0] + costs[:, 5]
+        appear_costs = costs[:, 0] + costs[:, 1] +\
+            np.minimum(costs[:, 4], costs[:, 5])
+
+        # best cost up to each node with the node not selected (0), selected
+        # and continuing the previous node (1), or selected and appearing (2)
+        best = np.empty((len(nodes), 3), dtype=np.float64)
+        previous = np.zeros((len(nodes), 3), dtype=np.int64)
+        best[0] = [0, np.inf, appear_costs[0]]
+        for i in range(1, len(nodes)):
+            any_state = np.argmin(best[i - 1])
+            selected_state = 1 + np.argmin(best[i - 1, 1:])
+            best[i, 0] = best[i - 1, any_state]
+            best[i, 1] = best[i - 1, selected_state] +\
+                edge_costs[edges[i - 1]] + continue_costs[i]
+            best[i, 2] = best[i - 1, any_state] + appear_costs[i]
+            previous[i] = [any_state, selected_state, any_state]
+
+        state = np.argmin(best[-1])
+        cost = best[-1, state]
+        for i in range(len(nodes) - 1, -1, -1):
+            self.selected_nodes[nodes[i]] = state > 0
+            if i > 0:
+                self.selected_edges[edges[i - 1]] = state == 1
+            state = previous[i, state]
+        return cost
+
+    def _solve_components(self, components):
+
+        # start with the largest components
+        components = sorted(
+            components,
+            key=lambda c: -len(c if isinstance(c, list)
+                               else self.components[c]))
+        # only the solvers of the components found in the constructor are
+        # kept, pinned chains change with the selected key
+        indices = [c for c in components if not isinstance(c, list)]
+        pinned_chains = [c for c in components if isinstance(c, list)]
+
+        if self.num_workers <= 1 or len(indices) <= 1:
+            return [self._solve_component(c) for c in components]
+
+        if self._workers is None:
+            self._start_workers(indices)
+        for _, connection in self._workers:
+            connection.send((self.parameters, self.selected_key))
+        results = [self._solve_component(c) for c in pinned_chains]
+        for _, connection in self._workers:
+            worker_results = connection.recv()
+            if isinstance(worker_results, Exception):
+                self.close()
+                raise worker_results
+            results.extend(worker_results)
+        return results
+
+    def _start_workers(self, components):
+        '''Fork one process per group of ``components``, balanced by the
+        number of nodes. Each process solves the same components for each
+        objective sent to it, keeping their solvers.'''
+
+        num_workers = min(self.num_workers, len(components))
+        groups = [[] for _ in range(num_workers)]
+        sizes = np.zeros(num_workers, dtype=np.int64)
+        for c in components:
+            w = np.argmin(sizes)
+            groups[w].append(c)
+            sizes[w] += len(self.components[c])
+
+        context = multiprocessing.get_context('fork')
+        self._workers = []
+        for group in groups:
+            connection, worker_connection = context.Pipe()
+            process = context.Process(
+                target=_run_worker,
+                args=(self, group, worker_connection, connection),
+                daemon=True)
+            process.start()
+            worker_connection.close()
+            self._workers.append((process, connection))
+        logger.debug(
+            "Started %d workers for %d components", num_workers,
+            len(components))
+
+    def _solve_component(self, component):
+        '''Solve a component with an ILP solver. ``component`` is either the
+        index of a component, whose solver is kept for later solves, or a
+        list of node ids. Returns the selection of nodes and edges as
+        dictionaries, and the cost of the solution.'''
+
+        if isinstance(component, list):
+            solver = self._create_component_solver(component)
+        elif component in self.component_solvers:
+            solver = self.component_solvers[component]
+            solver.update_objective(self.parameters, self.selected_key)
+        else:
+            solver = self._create_component_solver(
+                self.components[component])
+            self.component_solvers[component] = solver
+
+        solver.solve()
+        graph = solver.graph
+        return (
+            {
+                n: data[self.selected_key]
+                for n, data in graph.nodes(data=True)
+            },
+            {
+                e: data[self.selected_key]
+                for e, data in graph.edges.items()
+            },
+            solver.solution_cost)
+
+    def _create_component_solver(self, nodes):
+
+        component_graph = TrackGraph(
+            graph_data=self.graph.subgraph(nodes),
+            frame_key=self.graph.frame_key,
+            roi=self.graph.roi)
+        return self.solver_type(
+            component_graph,
+            self.parameters,
+            self.selected_key,
+            vgg_key=self.vgg_key,
+            frames=[self.start_frame, self.end_frame],
+            num_threads=self.num_threads)
+
+
+def _run_worker(solver, components, connection, parent_connection):
+    '''Solve ``components`` for each ``(parameters, selected_key)``
+    received on ``connection`` and send back the results, until ``None`` is
+    received or the connection is closed.'''
+
+    # close the ends of the pipes of the parent that were inherited by the
+    # fork, so that recv fails once the parent closes (or loses) its end
+    parent_connection.close()
+    for _, other_connection in solver._workers:
+        other_connection.close()
+    solver._workers = None
+
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            # the solver was discarded without calling close
+            break
+        if message is None:
+            break
+        solver.update_objective(*message)
+        try:
+            results = [solver._solve_component(c) for c in components]
+        except Exception as e:
+            results = e
+        connection.send(results)
+    connection.close()
@@ -1,6 +1,7 @@
-from .track_graph import TrackGraph
 import logging
 import networkx as nx
+import numpy as np
+import time
 
 logger = logging.getLogger(__name__)
 
@@ -11,88 +12,120 @@ def greedy_track(
         cell_indicator_threshold,
         metric='prediction_distance',
         frame_key='t',
-        allow_new_tracks=True):
+        allow_new_tracks=True,
+        keep_selected=False):
+    '''Greedily select edges of ``graph``, going backwards in time from the
+    last frame.
+
+    Tracks start at cells with a score above ``cell_indicator_threshold`` in
+    the last frame. In each frame, the shortest edges (by ``metric``) from
+    the cells selected so far are selected first, allowing divisions (at
+    most one previous edge per cell and two next edges per cell). If
+    ``allow_new_tracks``, the shortest edges of all other cells with a
+    score above the threshold are selected afterwards, without divisions.
+
+    Args:
+
+        graph (``networkx.DiGraph``):
+
+            The candidate graph. ``selected_key`` is set on all its edges.
+
+        keep_selected (``bool``, optional):
+
+            If ``True``, edges of ``graph`` that already have
+            ``selected_key`` set to ``True`` (e.g., by a neighboring block)
+            stay selected and count towards the constraints above.
+            Otherwise, all edges are unselected first.
+    '''
     if graph.number_of_nodes() == 0:
         logger.info("No nodes in graph - skipping solving step")
         return
-    nx.set_edge_attributes(graph, False, selected_key)
-    track_graph = TrackGraph(graph_data=graph,
-                             frame_key=frame_key,
-                             roi=graph.roi)
-    start_frame, end_frame = track_graph.get_frames()
 
-    selected_prev_nodes = []
-    for frame in range(end_frame, start_frame + 1, -1):
-        # find "seed" cells in frame
-        seed_candidates = track_graph.cells_by_frame(frame)
-        seeds = [node for node in seed_candidates
-                 if graph.nodes[node]['score'] > cell_indicator_threshold]
+    start_time = time.time()
+    nodes = [n for n, data in graph.nodes(data=True) if frame_key in data]
+    if len(nodes) == 0:
+        logger.info("No nodes with frames in graph - skipping solving step")
+        return
+    node_index = {n: i for i, n in enumerate(nodes)}
+    frames = np.array(
+        [graph.nodes[n][frame_key] for n in nodes], dtype=np.int64)
+    seeds = np.array(
+        [graph.nodes[n]['score'] for n in nodes]) > cell_indicator_threshold
+    start_frame, end_frame = frames.min(), frames.max()
 
-        # use only new (not previously selected) nodes to seed new tracks
-        seeds = [s for s in seeds if s not in selected_prev_nodes]
+    # edges between nodes with frames, sorted by the frame of their source
+    # and the metric (ties are broken by the order of edges in graph)
+    edges = [
+        (u, v) for u, v in graph.edges
+        if u in node_index and v in node_index
+    ]
+    sources = np.array([node_index[u] for u, _ in edges], dtype=np.int64)
+    targets = np.array([node_index[v] for _, v in edges], dtype=np.int64)
+    metrics = np.array(
+        [graph.edges[e][metric] for e in edges], dtype=np.float64)
+    edge_frames = frames[sources]
+    order = np.lexsort((metrics, edge_frames))
+    frame_begins = np.searchsorted(
+        edge_frames[order], np.arange(start_frame, end_frame + 2))
 
+    # per-node occupancy counters: number of selected previous edges and
+    # number of selected next edges
+    num_prev = [0]*len(nodes)
+    num_next = [0]*len(nodes)
+    selected = np.zeros(len(edges), dtype=bool)
+    if keep_selected:
+        for i, e in enumerate(edges):
+            if graph.edges[e].get(selected_key, False):
+                selected[i] = True
+                num_prev[sources[i]] += 1
+                num_next[targets[i]] += 1
+
+    sources = sources.tolist()
+    targets = targets.tolist()
+    seeds = seeds.tolist()
+    for frame in range(end_frame, start_frame, -1):
+
+        frame_edges = order[
+            frame_begins[frame - start_frame]:
+            frame_begins[frame - start_frame + 1]].tolist()
+
+        # cells are part of a track if they are seeds in the last frame, or
+        # were selected as the target of an edge in the frame after
         if frame == end_frame:
-            # in this special case, all seeds are treated as selected
-            selected_prev_nodes = seeds
-            seeds = []
-
-        candidate_edges = []
-        selected_next_nodes = []
-        # pick the shortest edges greedily for the set of previously selected
-        # nodes, with tree constraint (allow divisions)
-        for selected_prev in selected_prev_nodes:
-            candidate_edges.extend(graph.out_edges(selected_prev, data=True))
-
-        logger.debug("Sorting edges in frame %d", frame)
-        sorted_edges = sorted(candidate_edges,
-                              key=lambda e: e[2][metric])
-
-        logger.debug("Selecting shortest edges")
-        for u, v, data in sorted_edges:
-            # check if child already has selected out edge
-            already_selected = len([
-                    u
-                    for u, v, data in graph.out_edges(u, data=True)
-                    if data[selected_key]]) > 0
-            if already_selected:
+            in_track = [seeds[sources[e]] for e in frame_edges]
+        else:
+            in_track = [num_next[sources[e]] > 0 for e in frame_edges]
+
+        # pick the shortest edges greedily for the cells in tracks, with
+        # tree constraint (allow divisions)
+        for e, in_track_e in zip(frame_edges, in_track):
+            if not in_track_e:
                 continue
-            # check to make sure it's not overloading the parent
-            two_children = len([
-                    u
-                    for u, v, data in graph.in_edges(v, data=True)
-                    if data[selected_key]]) > 1
-            if two_children:
+            u = sources[e]
+            v = targets[e]
+            if num_prev[u] > 0 or num_next[v] > 1:
                 continue
+            selected[e] = True
+            num_prev[u] += 1
+            num_next[v] += 1
 
-            graph.edges[(u, v)][selected_key] = True
-            selected_next_nodes.append(v)
-
-        if allow_new_tracks:
+        if allow_new_tracks and frame != end_frame:
             # pick the shortest edges greedily for the set of new possible
             # tracks with one to one constraint (do not allow divisions)
-            candidate_edges = []
-            for seed in seeds:
-                candidate_edges.extend(graph.out_edges(seed, data=True))
-            sorted_edges = sorted(candidate_edges,
-                                  key=lambda e: e[2][metric])
-
-            for u, v, data in sorted_edges:
-                # check if child already has selected out edge
-                already_selected = len([
-                        u
-                        for u, v, data in graph.out_edges(u, data=True)
-                        if data[selected_key]]) > 0
-                if already_selected:
+            for e, in_track_e in zip(frame_edges, in_track):
+                u = sources[e]
+                if in_track_e or not seeds[u]:
                     continue
-                # check to make sure it's not overloading the parent
-                one_child = len([
-                        u
-                        for u, v, data in graph.in_edges(v, data=True)
-                        if data[selected_key]]) > 0
-                if one_child:
+                v = targets[e]
+                if num_prev[u] > 0 or num_next[v] > 0:
                     continue
+                selected[e] = True
+                num_prev[u] += 1
+                num_next[v] += 1
 
-                graph.edges[(u, v)][selected_key] = True
-                selected_next_nodes.append(v)
-
-        selected_prev_nodes = selected_next_nodes
+    nx.set_edge_attributes(graph, False, selected_key)
+    for e in np.flatnonzero(selected):
+        graph.edges[edges[e]][selected_key] = True
+    logger.info("Selected %d of %d edges greedily in %.3f seconds",
+                np.count_nonzero(selected), graph.number_of_edges(),
+                time.time() - start_time)
@@ -13,7 +13,7 @@ class Solver(object):
     number of hyperparamters
     '''
     def __init__(self, track_graph, parameters, selected_key,
-                 vgg_key=None, frames=None):
+                 vgg_key=None, frames=None, num_threads=1):
         # frames: [start_frame, end_frame] where start_frame is inclusive
         # and end_frame is exclusive. Defaults to track_graph.begin,
         # track_graph.end
@@ -22,6 +22,7 @@ class Solver(object):
         self.parameters = parameters
         self.selected_key = selected_key
         self.vgg_key = vgg_key
+        self.num_threads = num_threads
         self.start_frame = frames[0] if frames else self.graph.begin
         self.end_frame = frames[1] if frames else self.graph.end
 
@@ -39,6 +40,7 @@ class Solver(object):
         self.main_constraints = []  # list of LinearConstraint objects
         self.pin_constraints = []  # list of LinearConstraint objects
         self.solver = None
+        self.solution_cost = None
 
         self._create_indicators()
         self._set_objective()
@@ -70,13 +72,14 @@ class Solver(object):
         for c in self.main_constraints + self.pin_constraints:
             all_constraints.add(c)
         self.solver.set_constraints(all_constraints)
-        self.solver.set_num_threads(1)
+        self.solver.set_num_threads(self.num_threads)
         self.solver.set_timeout(120)
 
     def solve(self):
         solution, message = self.solver.solve()
         logger.info(message)
         logger.debug("costs of solution: %f", solution.get_value())
+        self.solution_cost = solution.get_value()
 
         for v in self.graph.nodes:
             self.graph.nodes[v][self.selected_key] = solution[
@@ -0,0 +1,471 @@
+# -*- coding: UTF-8 -*-
+from .compact_track_graph import CompactTrackGraph
+import logging
+import numpy as np
+import pylp
+import scipy.sparse
+
+logger = logging.getLogger(__name__)
+
+# relation codes used in the constraint arrays
+LESS_EQUAL = -1
+EQUAL = 0
+GREATER_EQUAL = 1
+
+# per-node indicators, in the same order as in Solver
+NODE_INDICATORS = [
+    'selected', 'appear', 'disappear', 'split', 'child', 'continuation']
+
+
+class SparseSolver(object):
+    '''
+    Class for initializing and solving the same ILP as ``Solver``, but
+    building the indicator layout, the objective vector and the constraint
+    matrix as numpy/scipy.sparse arrays from a columnar copy of the track
+    graph, instead of one ``pylp.LinearConstraint`` at a time. The variable
+    layout is identical to ``Solver``: six indicators per node (selected,
+    appear, disappear, split, child, continuation), followed by one
+    indicator per edge.
+    '''
+    def __init__(self, track_graph, parameters, selected_key,
+                 vgg_key=None, frames=None, num_threads=1):
+        # frames: [start_frame, end_frame] where start_frame is inclusive
+        # and end_frame is exclusive. Defaults to track_graph.begin,
+        # track_graph.end
+
+        self.graph = track_graph
+        self.parameters = parameters
+        self.selected_key = selected_key
+        self.vgg_key = vgg_key
+        self.num_threads = num_threads
+        self.start_frame = frames[0] if frames else self.graph.begin
+        self.end_frame = frames[1] if frames else self.graph.end
+
+        self.node_ids, self.nodes, self.edges = track_graph_to_arrays(
+            track_graph, vgg_key=vgg_key)
+
+        self.num_nodes = len(self.node_ids)
+        self.num_edges = len(self.edges['source_index'])
+        self.num_vars = None
+        self.objective = None
+        self.constraints = None
+        self.pins = None
+
+        self.main_constraints = []  # list of LinearConstraint objects
+        self.pin_constraints = []  # list of LinearConstraint objects
+        self.solver = None
+
+        self.selected_nodes = None
+        self.selected_edges = None
+        self.solution = None
+        self.solution_cost = None
+        self.previous_solution_cost = None
+
+        self._create_indicators()
+        self._set_objective()
+        self._add_constraints()
+        self._create_solver()
+
+    def update_objective(self, parameters, selected_key):
+        self.parameters = parameters
+        self.selected_key = selected_key
+
+        self._set_objective()
+        self.solver.set_objective(_to_pylp_objective(self.objective))
+
+        pins = get_pins(self.graph, self.selected_key)
+        if np.array_equal(pins, self.pins):
+            # the main constraints never change, so there is nothing to
+            # hand to the solver if the pinned edges didn't change either.
+            # This keeps the model intact, and the previous solution stays
+            # feasible, so that its cost is an upper bound for the new one
+            if self.solution is not None:
+                self.previous_solution_cost = float(
+                    np.dot(self.objective, self.solution))
+            return
+        self.pins = pins
+        self.previous_solution_cost = None
+        self.pin_constraints = _to_pylp_constraints(
+            *get_pin_constraints(self.pins, self.edge_offset))
+        self.solver.set_constraints(self._all_constraints())
+
+    def _create_solver(self):
+        self.solver = pylp.LinearSolver(
+                self.num_vars,
+                pylp.VariableType.Binary,
+                preference=pylp.Preference.Gurobi)
+        self.solver.set_objective(_to_pylp_objective(self.objective))
+        self.solver.set_constraints(self._all_constraints())
+        self.solver.set_num_threads(self.num_threads)
+        self.solver.set_timeout(120)
+
+    def _all_constraints(self):
+        all_constraints = pylp.LinearConstraints()
+        for c in self.main_constraints + self.pin_constraints:
+            all_constraints.add(c)
+        return all_constraints
+
+    def solve(self):
+        solution, message = self.solver.solve()
+        logger.info(message)
+        logger.debug("costs of solution: %f", solution.get_value())
+        self.solution_cost = solution.get_value()
+        self.solution = np.array(
+            [solution[i] for i in range(self.num_vars)], dtype=np.float64)
+
+        node_selected = self.node_offset + NODE_INDICATORS.index('selected')
+        self.selected_nodes = self.solution[node_selected] > 0.5
+        self.selected_edges = self.solution[self.edge_offset] > 0.5
+
+        if isinstance(self.graph, CompactTrackGraph):
+            self.graph.node_attrs.set(self.selected_key, self.selected_nodes)
+            self.graph.edge_attrs.set(self.selected_key, self.selected_edges)
+            return
+
+        for node, selected in zip(self.node_ids, self.selected_nodes):
+            self.graph.nodes[node][self.selected_key] = bool(selected)
+
+        for (u, v), selected in zip(self.edge_ids, self.selected_edges):
+            self.graph.edges[(u, v)][self.selected_key] = bool(selected)
+
+    def _create_indicators(self):
+
+        self.node_offset = 6*np.arange(self.num_nodes, dtype=np.int64)
+        self.edge_offset = 6*self.num_nodes + np.arange(
+            self.num_edges, dtype=np.int64)
+        self.num_vars = 6*self.num_nodes + self.num_edges
+
+        self.edge_ids = [
+            (self.node_ids[u], self.node_ids[v])
+            for u, v in zip(
+                self.edges['source_index'],
+                self.edges['target_index'])]
+
+    def _set_objective(self):
+
+        logger.debug("setting objective")
+
+        self.objective = get_objective(
+            self.nodes,
+            self.edges,
+            self.parameters,
+            self.start_frame,
+            self.end_frame,
+            self.graph.roi,
+            use_cell_cycle=self.vgg_key is not None)
+
+    def _add_constraints(self):
+
+        logger.debug("setting constraints")
+
+        self.pins = get_pins(self.graph, self.selected_key)
+        self.constraints = get_constraints(
+            self.nodes, self.edges, self.pins, self.node_ids)
+        self.main_constraints = _to_pylp_constraints(*self.constraints)
+        self.pin_constraints = _to_pylp_constraints(
+            *get_pin_constraints(self.pins, self.edge_offset))
+
+
+def track_graph_to_arrays(track_graph, vgg_key=None):
+    '''Copy the nodes and edges of a track graph into columnar tables.
+
+    Returns:
+
+        A tuple ``(node_ids, nodes, edges)``, where ``node_ids`` is the list
+        of node ids in the order of ``track_graph.nodes``, ``nodes`` is a
+        ``dict`` with ``t``, ``z``, ``y``, ``x``, ``score`` (and ``vgg``, if
+        ``vgg_key`` is given) arrays in that order, and ``edges`` is a
+        ``dict`` with ``source_index`` and ``target_index`` into the node
+        arrays and ``prediction_distance``, in the order of
+        ``track_graph.edges``.
+    '''
+    if isinstance(track_graph, CompactTrackGraph):
+        return _compact_track_graph_to_arrays(track_graph, vgg_key)
+
+    node_ids = list(track_graph.nodes)
+    index = {node: i for i, node in enumerate(node_ids)}
+    data = [track_graph.nodes[node] for node in node_ids]
+
+    nodes = {
+        key: np.array([d[key] for d in data], dtype=np.float64)
+        for key in [track_graph.frame_key, 'z', 'y', 'x', 'score']
+    }
+    nodes['t'] = nodes.pop(track_graph.frame_key)
+    if vgg_key is not None:
+        nodes['vgg'] = np.array(
+            [d[vgg_key] for d in data],
+            dtype=np.float64).reshape(-1, 3)
+
+    edge_list = list(track_graph.edges(data='prediction_distance'))
+    edges = {
+        'source_index': np.array(
+            [index[u] for u, _, _ in edge_list], dtype=np.int64),
+        'target_index': np.array(
+            [index[v] for _, v, _ in edge_list], dtype=np.int64),
+        'prediction_distance': np.array(
+            [d for _, _, d in edge_list], dtype=np.float64),
+    }
+    return node_ids, nodes, edges
+
+
+def get_pins(track_graph, selected_key):
+    '''Returns an int8 array over the edges of ``track_graph`` that is 1 or 0
+    for edges that already have a value for ``selected_key`` (and will be
+    pinned to it), and -1 for all other edges.'''
+    if isinstance(track_graph, CompactTrackGraph):
+        if selected_key not in track_graph.edge_attrs:
+            return np.full(track_graph.number_of_edges(), -1, dtype=np.int8)
+        values, present = track_graph.edge_attrs.get(selected_key)
+        return np.where(present, values.astype(bool), -1).astype(np.int8)
+    return np.array(
+        [
+            -1 if selected is None else int(bool(selected))
+            for _, _, selected in track_graph.edges(data=selected_key)
+        ],
+        dtype=np.int8)
+
+
+def _compact_track_graph_to_arrays(track_graph, vgg_key):
+
+    columns = track_graph.node_attrs
+    nodes = {
+        key: columns.values(key).astype(np.float64)
+        for key in ['z', 'y', 'x', 'score']
+    }
+    nodes['t'] = track_graph.frames.astype(np.float64)
+    if vgg_key is not None:
+        nodes['vgg'] = columns.values(vgg_key).astype(
+            np.float64).reshape(-1, 3)
+    edges = {
+        'source_index': track_graph.sources,
+        'target_index': track_graph.targets,
+        'prediction_distance': track_graph.edge_attrs.values(
+            'prediction_distance').astype(np.float64),
+    }
+    return track_graph.node_ids.tolist(), nodes, edges
+
+
+def get_objective(
+        nodes,
+        edges,
+        parameters,
+        start_frame,
+        end_frame,
+        roi,
+        use_cell_cycle=False):
+    '''Compute the objective vector of the tracking ILP for the columnar
+    graph ``nodes``, ``edges``. See ``Solver._set_objective``.'''
+
+    num_nodes = len(nodes['t'])
+    num_edges = len(edges['source_index'])
+    node_costs = np.zeros((num_nodes, 6), dtype=np.float64)
+
+    # node selection and cell cycle costs
+    node_costs[:, 0] = (nodes['score']*parameters.weight_node_score +
+                        parameters.selection_constant)
+    if use_cell_cycle:
+        node_costs[:, 3] = (nodes['vgg'][:, 0]*parameters.weight_division +
+                            parameters.division_constant)
+        node_costs[:, 4] = nodes['vgg'][:, 1]*parameters.weight_child
+        node_costs[:, 5] = nodes['vgg'][:, 2]*parameters.weight_continuation
+    else:
+        node_costs[:, 3] = 1
+
+    # node appear (skip first frame and nodes at the edge of the roi)
+    distance = parameters.max_cell_move
+    close_to_edge = np.zeros(num_nodes, dtype=bool)
+    for dim, begin, end in zip(
+            ['z', 'y', 'x'],
+            roi.get_begin()[1:],
+            roi.get_end()[1:]):
+        close_to_edge |= nodes[dim] + distance >= end
+        close_to_edge |= nodes[dim] - distance < begin
+    pays_appear = np.logical_and(
+        np.logical_and(
+            nodes['t'] > start_frame,
+            nodes['t'] < end_frame),
+        np.logical_not(close_to_edge))
+    node_costs[pays_appear, 1] = parameters.track_cost
+
+    # edge selection costs
+    edge_costs = (edges['prediction_distance'] *
+                  parameters.weight_edge_score)
+
+    objective = np.empty(6*num_nodes + num_edges, dtype=np.float64)
+    objective[:6*num_nodes] = node_costs.reshape(-1)
+    objective[6*num_nodes:] = edge_costs
+    return objective
+
+
+def get_constraints(nodes, edges, pins, node_ids=None):
+    '''Build the main constraints of the tracking ILP for the columnar graph
+    ``nodes``, ``edges``. See ``Solver._add_constraints``.
+
+    Returns:
+
+        A tuple ``(matrix, relations, values)`` of a ``scipy.sparse``
+        COO matrix with one row per constraint, an int8 array of relation
+        codes (``LESS_EQUAL``, ``EQUAL``, ``GREATER_EQUAL``) and the right
+        hand side of each constraint.
+    '''
+    num_nodes = len(nodes['t'])
+    num_edges = len(edges['source_index'])
+    num_vars = 6*num_nodes + num_edges
+
+    u = edges['source_index']
+    v = edges['target_index']
+    e = 6*num_nodes + np.arange(num_edges, dtype=np.int64)
+    n = np.arange(num_nodes, dtype=np.int64)
+    selected, appear, disappear, split, child, continuation = [
+        6*n + i for i in range(6)]
+
+    # a node can't have more than one prev edge pinned to selected
+    pinned_prev = np.bincount(u[pins == 1], minlength=num_nodes)
+    if np.any(pinned_prev > 1):
+        node = int(np.argmax(pinned_prev > 1))
+        if node_ids is not None:
+            node = node_ids[node]
+        raise RuntimeError(
+            "Node %s has %d prev edges pinned"
+            % (node, pinned_prev.max()))
+
+    blocks = _ConstraintBlocks()
+
+    # if e is selected, u and v have to be selected
+    #   2*e - u - v <= 0
+    rows = np.arange(num_edges)
+    blocks.add(
+        num_edges,
+        [(rows, e, 2), (rows, selected[u], -1), (rows, selected[v], -1)],
+        LESS_EQUAL, 0)
+
+    # cell cycle: if e=(u, v) is selected, child(u) and split(v) are linked
+    #   child(u) + e - split(v) <= 1
+    #   split(v) + e - child(u) <= 1
+    blocks.add(
+        num_edges,
+        [(rows, child[u], 1), (rows, e, 1), (rows, split[v], -1)],
+        LESS_EQUAL, 1)
+    blocks.add(
+        num_edges,
+        [(rows, split[v], 1), (rows, e, 1), (rows, child[u], -1)],
+        LESS_EQUAL, 1)
+
+    # every selected node is a split, child or continuation
+    #   split + child + continuation - selected = 0
+    blocks.add(
+        num_nodes,
+        [(n, split, 1), (n, child, 1), (n, continuation, 1),
+         (n, selected, -1)],
+        EQUAL, 0)
+
+    # inter-frame constraints, one per node:
+    #   sum(prev) + appear - selected = 0
+    blocks.add(
+        num_nodes,
+        [(u, e, 1), (n, appear, 1), (n, selected, -1)],
+        EQUAL, 0)
+    #   sum(next) + disappear - 2*selected <= 0
+    blocks.add(
+        num_nodes,
+        [(v, e, 1), (n, disappear, 1), (n, selected, -2)],
+        LESS_EQUAL, 0)
+    #  -sum(next) - disappear + selected <= 0
+    blocks.add(
+        num_nodes,
+        [(v, e, -1), (n, disappear, -1), (n, selected, 1)],
+        LESS_EQUAL, 0)
+
+    # split indicators, one per node:
+    #   sum(next) - split <= 1
+    #   sum(next) - 2*split >= 0
+    blocks.add(
+        num_nodes,
+        [(v, e, 1), (n, split, -1)],
+        LESS_EQUAL, 1)
+    blocks.add(
+        num_nodes,
+        [(v, e, 1), (n, split, -2)],
+        GREATER_EQUAL, 0)
+
+    return blocks.get(num_vars)
+
+
+def get_pin_constraints(pins, edge_indicators):
+    '''Constraints that fix the edges with ``pins`` >= 0 to that value.'''
+    pinned = np.flatnonzero(pins >= 0)
+    rows = np.arange(len(pinned))
+    num_vars = int(edge_indicators[-1]) + 1 if len(edge_indicators) else 0
+    blocks = _ConstraintBlocks()
+    blocks.add(len(pinned), [(rows, edge_indicators[pinned], 1)], EQUAL, 0)
+    matrix, relations, values = blocks.get(num_vars)
+    values[:] = pins[pinned]
+    return matrix, relations, values
+
+
+class _ConstraintBlocks(object):
+    '''Collects blocks of constraints with the same relation and value as
+    COO triplets.'''
+
+    def __init__(self):
+        self.rows = []
+        self.cols = []
+        self.data = []
+        self.relations = []
+        self.values = []
+        self.num_rows = 0
+
+    def add(self, num_rows, terms, relation, value):
+        '''Add ``num_rows`` constraints. ``terms`` is a list of ``(rows,
+        cols, coefficient)``, where ``rows`` are the constraints (relative to
+        this block) that variables ``cols`` appear in.'''
+        for rows, cols, coefficient in terms:
+            rows = np.asarray(rows, dtype=np.int64)
+            self.rows.append(rows + self.num_rows)
+            self.cols.append(np.asarray(cols, dtype=np.int64))
+            self.data.append(np.full(len(rows), coefficient,
+                                     dtype=np.float64))
+        self.relations.append(np.full(num_rows, relation, dtype=np.int8))
+        self.values.append(np.full(num_rows, value, dtype=np.float64))
+        self.num_rows += num_rows
+
+    def get(self, num_vars):
+        matrix = scipy.sparse.coo_matrix(
+            (
+                np.concatenate(self.data),
+                (np.concatenate(self.rows), np.concatenate(self.cols))
+            ),
+            shape=(self.num_rows, num_vars))
+        return (
+            matrix,
+            np.concatenate(self.relations),
+            np.concatenate(self.values))
+
+
+def _to_pylp_objective(objective):
+    pylp_objective = pylp.LinearObjective(len(objective))
+    for i in np.flatnonzero(objective):
+        pylp_objective.set_coefficient(int(i), float(objective[i]))
+    return pylp_objective
+
+
+def _to_pylp_constraints(matrix, relations, values):
+    '''Convert constraint arrays into a list of ``pylp.LinearConstraint``.'''
+    pylp_relations = {
+        LESS_EQUAL: pylp.Relation.LessEqual,
+        EQUAL: pylp.Relation.Equal,
+        GREATER_EQUAL: pylp.Relation.GreaterEqual,
+    }
+    matrix = matrix.tocsr()
+    indptr = matrix.indptr
+    indices = matrix.indices.tolist()
+    data = matrix.data.tolist()
+    constraints = []
+    for row in range(matrix.shape[0]):
+        constraint = pylp.LinearConstraint()
+        for i in range(indptr[row], indptr[row + 1]):
+            constraint.set_coefficient(indices[i], data[i])
+        constraint.set_relation(pylp_relations[relations[row]])
+        constraint.set_value(float(values[row]))
+        constraints.append(constraint)
+    return constraints
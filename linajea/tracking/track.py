@@ -1,14 +1,22 @@
 from __future__ import absolute_import
 from .solver import Solver
+from .sparse_solver import SparseSolver
+from .component_solver import ComponentSolver
+from .windowed_solver import WindowedSolver
 from .track_graph import TrackGraph
 import logging
+import multiprocessing
+import numpy as np
 import time
 
 logger = logging.getLogger(__name__)
 
 
 def track(graph, parameters, selected_key,
-          frame_key='t', frames=None, cell_cycle_key=None):
+          frame_key='t', frames=None, cell_cycle_key=None,
+          use_sparse_solver=False, order_by_similarity=False,
+          num_workers=1, num_threads=1, window_size=None, window_overlap=2,
+          split_components=False, compare_to_monolithic=False):
     ''' A wrapper function that takes a daisy subgraph and input parameters,
     creates and solves the ILP to create tracks, and updates the daisy subgraph
     to reflect the selected nodes and edges.
@@ -46,6 +54,75 @@ def track(graph, parameters, selected_key,
             The name of the node attribute that corresponds to a prediction
             about the cell cycle state. The prediction should be a list of
             three values [mother/division, daughter, continuation].
+
+        use_sparse_solver (``bool``, optional):
+
+            If ``True``, build the ILP with ``SparseSolver``, which constructs
+            the objective and constraints as arrays. Faster to set up for
+            large graphs, same solution as ``Solver``.
+
+        order_by_similarity (``bool``, optional):
+
+            If ``True``, solve the parameter sets in an order where each
+            parameter set is close to the previous one (see
+            ``get_similarity_order``). Together with ``use_sparse_solver``,
+            the model is kept and only its objective is replaced between
+            parameter sets (as long as the pinned edges don't change), and
+            the cost of the previous solution under the new objective is
+            reported (see below). Whether the solver backend makes use of
+            the previous solution depends on the backend.
+
+        num_workers (``int``, optional):
+
+            If larger than one, split the parameter sets into this many
+            chunks and solve them in parallel in forked processes, which
+            share the track graph with this process. Defaults to 1.
+
+        num_threads (``int``, optional):
+
+            The number of threads each solver is allowed to use. Defaults to
+            1.
+
+        window_size (``int``, optional):
+
+            If given, solve the ILP in overlapping windows of this many frames
+            with a ``WindowedSolver``, instead of over all frames at once. The
+            ``num_workers`` are then used to solve windows in parallel, and
+            the parameter sets are solved one after the other.
+
+        window_overlap (``int``, optional):
+
+            The number of frames neighboring windows overlap. Defaults to 2.
+
+        split_components (``bool``, optional):
+
+            If ``True``, solve each weakly connected component of the graph
+            separately with a ``ComponentSolver``, which solves single nodes
+            and chains in closed form. The ``num_workers`` are then used to
+            solve the remaining components in parallel, and the parameter
+            sets are solved one after the other. Can not be combined with
+            ``window_size``.
+
+        compare_to_monolithic (``bool``, optional):
+
+            If ``True``, also solve the ILP over all frames after solving in
+            windows, to report how much objective the windows lose (see
+            ``WindowedSolver``). As expensive as not using windows. Needs
+            ``window_size``.
+
+    Returns:
+
+        A list with one ``dict`` of solve statistics per parameter set (in
+        the order of ``parameters``), with the ``selected_key``, the
+        ``solve_time`` in seconds, the ``cost`` of the solution, and (for the
+        ``SparseSolver`` only) the ``previous_solution_cost``, the cost of
+        the solution of the previous parameter set under the current
+        objective, and the ``previous_solution_excess``, how much higher
+        that is than ``cost``, relative to ``cost``. These are not the MIP
+        gap of the solver, which pylp does not report. With
+        ``compare_to_monolithic``, the stats also have the
+        ``monolithic_cost`` of the optimal solution over all frames and the
+        relative ``objective_loss`` of the windowed solution.
     '''
     if cell_cycle_key is not None:
         # remove nodes that don't have a cell cycle key, with warning
@@ -63,7 +140,7 @@ def track(graph, parameters, selected_key,
     # assuming graph is a daisy subgraph
     if graph.number_of_nodes() == 0:
         logger.info("No nodes in graph - skipping solving step")
-        return
+        return []
 
     if not isinstance(parameters, list):
         parameters = [parameters]
@@ -78,25 +155,212 @@ def track(graph, parameters, selected_key,
                              frame_key=frame_key,
                              roi=graph.roi)
 
-    logger.debug("Creating solver...")
-    solver = None
-    total_solve_time = 0
-    for parameter, key in zip(parameters, selected_key):
-        if not solver:
-            solver = Solver(track_graph, parameter, key, frames=frames,
-                            vgg_key=cell_cycle_key)
-        else:
-            solver.update_objective(parameter, key)
-
-        logger.debug("Solving for key %s", str(key))
-        start_time = time.time()
-        solver.solve()
-        end_time = time.time()
-        total_solve_time += end_time - start_time
-        logger.info("Solving ILP took %s seconds", str(end_time - start_time))
+    order = list(range(len(parameters)))
+    if order_by_similarity:
+        order = get_similarity_order(parameters)
+        logger.debug("Solving parameter sets in order %s", order)
+
+    if compare_to_monolithic and window_size is None:
+        raise ValueError("compare_to_monolithic needs a window_size")
 
+    solver_type = SparseSolver if use_sparse_solver else Solver
+    solver_kwargs = {
+        'frames': frames,
+        'vgg_key': cell_cycle_key,
+        'num_threads': num_threads,
+    }
+    if window_size is not None:
+        solver_kwargs.update({
+            'window_size': window_size,
+            'window_overlap': window_overlap,
+            'solver_type': solver_type,
+            'num_workers': num_workers,
+            'compare_to_monolithic': compare_to_monolithic,
+        })
+        solver_type = WindowedSolver
+        num_workers = 1
+    if split_components:
+        if window_size is not None:
+            raise ValueError(
+                "split_components can not be combined with window_size")
+        solver_kwargs.update({
+            'solver_type': solver_type,
+            'num_workers': num_workers,
+        })
+        solver_type = ComponentSolver
+        num_workers = 1
+    if num_workers > 1 and len(parameters) > 1:
+        solve_stats = _solve_parallel(
+            track_graph, parameters, selected_key, order, num_workers,
+            solver_type, solver_kwargs)
+    else:
+        solve_stats = _solve(
+            track_graph, parameters, selected_key, order,
+            solver_type, solver_kwargs)
+
+    for key in selected_key:
         for u, v, data in graph.edges(data=True):
             if (u, v) in track_graph.edges:
                 data[key] = track_graph.edges[(u, v)][key]
     logger.info("Solving ILP for all parameters took %s seconds",
-                str(total_solve_time))
+                str(sum(s['solve_time'] for s in solve_stats if s)))
+    return solve_stats
+
+
+def _solve(
+        track_graph, parameters, selected_key, order,
+        solver_type, solver_kwargs):
+    '''Solve for the parameter sets with the given indices in order, reusing
+    one solver, and store the results in ``track_graph``.'''
+
+    logger.debug("Creating solver...")
+    solver = None
+    solve_stats = [None]*len(parameters)
+    try:
+        for index in order:
+            parameter = parameters[index]
+            key = selected_key[index]
+            if not solver:
+                solver = solver_type(
+                    track_graph, parameter, key, **solver_kwargs)
+            else:
+                solver.update_objective(parameter, key)
+
+            logger.debug("Solving for key %s", str(key))
+            start_time = time.time()
+            solver.solve()
+            end_time = time.time()
+            logger.info("Solving ILP took %s seconds",
+                        str(end_time - start_time))
+
+            previous_cost = getattr(solver, 'previous_solution_cost', None)
+            previous_excess = None
+            if previous_cost is not None:
+                previous_excess = (previous_cost - solver.solution_cost) /\
+                    max(abs(solver.solution_cost), 1e-10)
+                logger.info("Previous solution was within %.2f%% of optimum",
+                            100*previous_excess)
+            solve_stats[index] = {
+                'selected_key': key,
+                'solve_time': end_time - start_time,
+                'cost': solver.solution_cost,
+                'previous_solution_cost': previous_cost,
+                'previous_solution_excess': previous_excess,
+            }
+            if getattr(solver, 'compare_to_monolithic', False):
+                solve_stats[index].update({
+                    'monolithic_cost': solver.monolithic_cost,
+                    'objective_loss': solver.objective_loss,
+                })
+    finally:
+        # stop the worker processes of a ComponentSolver
+        if hasattr(solver, 'close'):
+            solver.close()
+    return solve_stats
+
+
+# state shared with forked worker processes, see _solve_parallel
+_worker_state = {}
+
+
+def _solve_parallel(
+        track_graph, parameters, selected_key, order, num_workers,
+        solver_type, solver_kwargs):
+    '''Split the parameter sets into ``num_workers`` chunks (consecutive in
+    ``order``) and solve each chunk in a forked worker process. The track
+    graph is inherited by the workers instead of being copied, and only the
+    selected flags of the edges are sent back and merged into
+    ``track_graph``.'''
+
+    chunks = [
+        list(chunk)
+        for chunk in np.array_split(order, min(num_workers, len(order)))
+    ]
+    logger.info("Solving %d parameter sets in %d processes",
+                len(parameters), len(chunks))
+
+    _worker_state.update({
+        'track_graph': track_graph,
+        'parameters': parameters,
+        'selected_key': selected_key,
+        'solver_type': solver_type,
+        'solver_kwargs': solver_kwargs,
+    })
+    try:
+        context = multiprocessing.get_context('fork')
+        with context.Pool(len(chunks)) as pool:
+            results = pool.map(_solve_chunk, chunks)
+    finally:
+        _worker_state.clear()
+
+    solve_stats = [None]*len(parameters)
+    edges = list(track_graph.edges)
+    for chunk, (selections, chunk_stats) in zip(chunks, results):
+        for index in chunk:
+            key = selected_key[index]
+            for edge, selected in zip(edges, selections[key]):
+                track_graph.edges[edge][key] = bool(selected)
+            solve_stats[index] = chunk_stats[index]
+    return solve_stats
+
+
+def _solve_chunk(chunk):
+
+    track_graph = _worker_state['track_graph']
+    selected_key = _worker_state['selected_key']
+    solve_stats = _solve(
+        track_graph,
+        _worker_state['parameters'],
+        selected_key,
+        chunk,
+        _worker_state['solver_type'],
+        _worker_state['solver_kwargs'])
+
+    selections = {
+        selected_key[index]: np.array(
+            [
+                selected
+                for _, _, selected in track_graph.edges(
+                    data=selected_key[index])
+            ],
+            dtype=bool)
+        for index in chunk
+    }
+    return selections, solve_stats
+
+
+def get_similarity_order(parameters):
+    '''Order a list of ``TrackingParameters`` such that consecutive parameter
+    sets are similar, by greedily chaining nearest neighbors starting from
+    the first parameter set. Distances are Euclidean over the numerical cost
+    parameters, each normalized by its range in ``parameters``.
+
+    Returns:
+
+        A list of indices into ``parameters``.
+    '''
+    if len(parameters) < 3:
+        return list(range(len(parameters)))
+
+    keys = sorted(
+        key for key, value in parameters[0].__dict__.items()
+        if isinstance(value, (int, float)) and not isinstance(value, bool)
+        and all(isinstance(getattr(p, key, None), (int, float))
+                for p in parameters))
+    values = np.array(
+        [[getattr(p, key) for key in keys] for p in parameters],
+        dtype=np.float64)
+    value_range = values.max(axis=0) - values.min(axis=0)
+    value_range[value_range == 0] = 1
+    values /= value_range
+
+    order = [0]
+    remaining = np.ones(len(parameters), dtype=bool)
+    remaining[0] = False
+    while remaining.any():
+        distances = np.linalg.norm(values - values[order[-1]], axis=1)
+        distances[~remaining] = np.inf
+        nearest = int(np.argmin(distances))
+        order.append(nearest)
+        remaining[nearest] = False
+    return order
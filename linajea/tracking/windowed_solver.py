@@ -0,0 +1,258 @@
+# -*- coding: UTF-8 -*-
+from .solver import Solver
+from .track_graph import TrackGraph
+import logging
+import multiprocessing
+
+logger = logging.getLogger(__name__)
+
+# state shared with forked worker processes, see WindowedSolver._solve_phase
+_worker_state = {}
+
+
+class WindowedSolver(object):
+    '''
+    Class for solving the tracking ILP in overlapping windows of
+    ``window_size`` frames instead of as one problem over all frames of the
+    track graph.
+
+    Windows start every ``window_size - window_overlap`` frames. The even
+    windows don't share any nodes and are solved independently first. The
+    odd windows are solved afterwards, with the edges they share with the
+    neighboring even windows pinned to the solution of those (using the
+    same ``selected_key`` pin constraints that are used to pin edges solved
+    in neighboring blocks). Nodes in the first and last frame of an odd
+    window take the selection of the even window that contains them, all
+    other nodes and edges of an odd window take the selection of the odd
+    window, which results in a consistent solution for the whole graph.
+
+    Has the same interface as ``Solver``.
+
+    Args:
+
+        window_size (``int``):
+
+            The number of frames per window.
+
+        window_overlap (``int``, optional):
+
+            The number of frames neighboring windows share. Has to be at
+            least 2 and at most half of ``window_size``. Defaults to 2.
+
+        solver_type (``class``, optional):
+
+            The solver to use for each window, ``Solver`` or
+            ``SparseSolver``.
+
+        num_workers (``int``, optional):
+
+            If larger than one, solve the windows of each phase in this many
+            forked processes.
+
+        compare_to_monolithic (``bool``, optional):
+
+            If ``True``, also solve the ILP over all frames after each
+            ``solve()`` and store the cost of the optimal solution in
+            ``monolithic_cost``, the cost of the windowed solution in
+            ``solution_cost`` and the relative difference in
+            ``objective_loss``. This is as expensive as not using windows
+            at all, and is meant to find good window sizes.
+    '''
+    def __init__(self, track_graph, parameters, selected_key,
+                 vgg_key=None, frames=None, num_threads=1,
+                 window_size=None, window_overlap=2, solver_type=Solver,
+                 num_workers=1, compare_to_monolithic=False):
+
+        assert window_size is not None, "window_size has to be given"
+        assert window_overlap >= 2, \
+            "windows have to overlap by at least 2 frames"
+        assert window_size >= 2*window_overlap, \
+            "window_size %d has to be at least twice the overlap %d" %\
+            (window_size, window_overlap)
+
+        self.graph = track_graph
+        self.parameters = parameters
+        self.selected_key = selected_key
+        self.vgg_key = vgg_key
+        self.num_threads = num_threads
+        self.start_frame = frames[0] if frames else self.graph.begin
+        self.end_frame = frames[1] if frames else self.graph.end
+        self.window_size = window_size
+        self.window_overlap = window_overlap
+        self.solver_type = solver_type
+        self.num_workers = num_workers
+        self.compare_to_monolithic = compare_to_monolithic
+
+        self.windows = self._get_windows()
+        self.solution_cost = None
+        self.monolithic_cost = None
+        self.objective_loss = None
+
+    def update_objective(self, parameters, selected_key):
+        self.parameters = parameters
+        self.selected_key = selected_key
+
+    def solve(self):
+
+        logger.info("Solving %d windows of %d frames",
+                    len(self.windows), self.window_size)
+
+        # pins from neighboring blocks, to restore before comparing
+        block_pins = {
+            e: data[self.selected_key]
+            for e, data in self.graph.edges.items()
+            if self.selected_key in data
+        }
+
+        even = list(range(0, len(self.windows), 2))
+        odd = list(range(1, len(self.windows), 2))
+
+        even_results = self._solve_phase(even, {})
+        overlap_pins = {}
+        for _, edges, _ in even_results:
+            overlap_pins.update(edges)
+        odd_results = self._solve_phase(odd, overlap_pins)
+
+        for nodes, edges, _ in even_results:
+            self._write_selection(nodes, edges)
+        for index, (nodes, edges, _) in zip(odd, odd_results):
+            begin, end = self.windows[index]
+            if index + 1 < len(self.windows):
+                last_owned = end - 1
+            else:
+                last_owned = end
+            nodes = {
+                n: selected for n, selected in nodes.items()
+                if begin < self.graph.nodes[n][self.graph.frame_key] <
+                last_owned
+            }
+            self._write_selection(nodes, edges)
+
+        if self.compare_to_monolithic:
+            self._compare_to_monolithic(block_pins)
+        else:
+            self.solution_cost = None
+
+    def _get_windows(self):
+
+        begin = self.graph.begin
+        end = self.graph.end
+        stride = self.window_size - self.window_overlap
+
+        windows = [(begin, min(begin + self.window_size, end))]
+        while windows[-1][1] < end:
+            window_begin = windows[-1][0] + stride
+            windows.append(
+                (window_begin, min(window_begin + self.window_size, end)))
+        return windows
+
+    def _solve_phase(self, windows, pins):
+
+        if self.num_workers <= 1 or len(windows) <= 1:
+            return [self._solve_window(w, pins) for w in windows]
+
+        _worker_state.update({'solver': self, 'pins': pins})
+        try:
+            context = multiprocessing.get_context('fork')
+            with context.Pool(min(self.num_workers, len(windows))) as pool:
+                return pool.map(_solve_window_in_worker, windows)
+        finally:
+            _worker_state.clear()
+
+    def _solve_window(self, window, pins):
+        '''Solve a single window, with the given edges pinned. Returns the
+        selection of nodes and edges in the window as dictionaries, and the
+        cost of the window solution.'''
+
+        begin, end = self.windows[window]
+        logger.debug("Solving window %d in frames [%d, %d)",
+                     window, begin, end)
+
+        nodes = [
+            n
+            for t in range(begin, end)
+            for n in self.graph.cells_by_frame(t)
+        ]
+        if len(nodes) == 0:
+            return {}, {}, 0
+        window_graph = TrackGraph(
+            graph_data=self.graph.subgraph(nodes),
+            frame_key=self.graph.frame_key,
+            roi=self.graph.roi)
+        for e in window_graph.edges:
+            if e in pins:
+                window_graph.edges[e][self.selected_key] = pins[e]
+
+        solver = self.solver_type(
+            window_graph,
+            self.parameters,
+            self.selected_key,
+            vgg_key=self.vgg_key,
+            frames=[max(begin, self.start_frame), min(end, self.end_frame)],
+            num_threads=self.num_threads)
+        solver.solve()
+
+        return (
+            {
+                n: data[self.selected_key]
+                for n, data in window_graph.nodes(data=True)
+            },
+            {
+                e: data[self.selected_key]
+                for e, data in window_graph.edges.items()
+            },
+            solver.solution_cost)
+
+    def _write_selection(self, nodes, edges):
+
+        for n, selected in nodes.items():
+            self.graph.nodes[n][self.selected_key] = selected
+        for e, selected in edges.items():
+            self.graph.edges[e][self.selected_key] = selected
+
+    def _compare_to_monolithic(self, block_pins):
+
+        key = self.selected_key
+        compare_key = key + '_monolithic'
+        windowed = {
+            e: data[key] for e, data in self.graph.edges.items()
+        }
+
+        for e, selected in block_pins.items():
+            self.graph.edges[e][compare_key] = selected
+        solver = self.solver_type(
+            self.graph,
+            self.parameters,
+            compare_key,
+            vgg_key=self.vgg_key,
+            frames=[self.start_frame, self.end_frame],
+            num_threads=self.num_threads)
+        solver.solve()
+        self.monolithic_cost = solver.solution_cost
+
+        # the cost of the windowed solution is the cost of the best
+        # solution with the same edges selected
+        for e, selected in windowed.items():
+            self.graph.edges[e][compare_key] = selected
+        solver.update_objective(self.parameters, compare_key)
+        solver.solve()
+        self.solution_cost = solver.solution_cost
+
+        for _, data in self.graph.nodes(data=True):
+            data.pop(compare_key, None)
+        for _, _, data in self.graph.edges(data=True):
+            data.pop(compare_key, None)
+
+        self.objective_loss = (self.solution_cost - self.monolithic_cost) /\
+            max(abs(self.monolithic_cost), 1e-10)
+        logger.info(
+            "Windowed solution costs %f, monolithic solution %f "
+            "(%.2f%% loss)",
+            self.solution_cost, self.monolithic_cost,
+            100*self.objective_loss)
+
+
+def _solve_window_in_worker(window):
+
+    return _worker_state['solver']._solve_window(
+        window, _worker_state['pins'])
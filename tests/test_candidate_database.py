@@ -1,4 +1,5 @@
 from linajea import CandidateDatabase
+from linajea.candidate_database import update_nodes_roi
 import linajea.tracking
 from linajea.evaluation import Report
 from daisy import Roi
@@ -107,6 +108,43 @@ class DatabaseTestCase(TestCase):
         self.assertEqual(unselected_graph.number_of_nodes(), 0)
         self.assertEqual(unselected_graph.number_of_edges(), 0)
 
+    def test_reset_selection_in_roi(self):
+        db_name = 'test_linajea_database'
+        db_host = 'localhost'
+        total_roi = Roi((0, 0, 0, 0), (5, 10, 10, 10))
+
+        write_db = CandidateDatabase(
+                db_name,
+                db_host,
+                mode='w',
+                total_roi=total_roi)
+
+        sub_graph = write_db[total_roi]
+        points = [(i, {'t': i, 'z': 1, 'y': 2, 'x': 3}) for i in range(5)]
+        edges = [
+                (i + 1, i, {'selected_1': True, 'selected_2': True,
+                            'selected_3': True})
+                for i in range(4)
+                ]
+        sub_graph.add_nodes_from(points)
+        sub_graph.add_edges_from(edges)
+        sub_graph.write_nodes()
+        sub_graph.write_edges()
+
+        db = CandidateDatabase(db_name, db_host, mode='r+')
+        # sources 1, 2 and 3, in chunks of two nodes
+        db.reset_selection(
+                roi=Roi((1, 0, 0, 0), (3, 10, 10, 10)),
+                parameter_ids=[1, 2],
+                batch_size=2)
+        graph = db[total_roi]
+        for u, v, data in graph.edges(data=True):
+            reset = u in [1, 2, 3]
+            self.assertEqual('selected_1' in data, not reset)
+            self.assertEqual('selected_2' in data, not reset)
+            self.assertTrue(data['selected_3'])
+        self.delete_db(db_name, db_host)
+
     def test_get_node_roi(self):
         db_name = 'test_linajea_db_node_roi'
         db_host = 'localhost'
@@ -130,6 +168,82 @@ class DatabaseTestCase(TestCase):
         expected_roi = Roi((0, 1, 1, 0), (4, 5, 9, 9))
         self.assertEqual(nodes_roi, expected_roi)
 
+        # the bounds are stored, and only grow through update_nodes_roi
+        sub_graph = db[Roi((0, 0, 0, 0), (10, 10, 10, 10))]
+        sub_graph.add_node(7, t=8, z=1, y=1, x=1)
+        sub_graph.write_nodes()
+        self.assertEqual(db.get_nodes_roi(), expected_roi)
+        client = pymongo.MongoClient(db_host)
+        update_nodes_roi(
+            client[db_name]['meta'],
+            {'t': 5, 'z': 1, 'y': 1, 'x': 1},
+            {'t': 6, 'z': 2, 'y': 2, 'x': 2})
+        self.assertEqual(
+            db.get_nodes_roi(), Roi((0, 1, 1, 0), (6, 5, 9, 9)))
+        self.assertEqual(
+            db.get_nodes_roi(recompute=True),
+            Roi((0, 1, 1, 0), (9, 5, 9, 9)))
+        self.delete_db(db_name, db_host)
+
+    def test_read_arrays(self):
+        db_name = 'test_linajea_db_read_arrays'
+        db_host = 'localhost'
+        roi = Roi((0, 0, 0, 0), (5, 10, 10, 10))
+        db = linajea.CandidateDatabase(
+                db_name,
+                db_host,
+                mode='w')
+        sub_graph = db[roi]
+        points = [
+                (4, {'t': 2, 'z': 1, 'y': 3, 'x': 8, 'score': 0.5}),
+                (1, {'t': 0, 'z': 1, 'y': 3, 'x': 2, 'score': 1.0}),
+                (2, {'t': 1, 'z': 1, 'y': 1, 'x': 0, 'score': 2.0}),
+                (3, {'t': 1, 'z': 5, 'y': 9, 'x': 3, 'score': 3.0}),
+                (5, {'t': 4, 'z': 5, 'y': 2, 'x': 3, 'score': 4.0}),
+                ]
+        edges = [
+                (2, 1, {'distance': 1.0, 'selected_1': True}),
+                (3, 1, {'distance': 2.0}),
+                (4, 2, {'distance': 3.0, 'selected_1': False}),
+                (4, 3, {'distance': 4.0, 'selected_1': True}),
+                ]
+        sub_graph.add_nodes_from(points)
+        sub_graph.add_edges_from(edges)
+        sub_graph.write_nodes()
+        sub_graph.write_edges()
+
+        read_roi = Roi((0, 0, 0, 0), (3, 10, 10, 10))
+        nodes, edges = db.read_arrays(
+                read_roi,
+                node_attrs=['score'],
+                edge_attrs=['distance', 'selected_1'])
+        self.assertListEqual(list(nodes['id']), [1, 2, 3, 4])
+        self.assertListEqual(list(nodes['t']), [0, 1, 1, 2])
+        self.assertListEqual(list(nodes['score']), [1.0, 2.0, 3.0, 0.5])
+        self.assertListEqual(list(edges['indptr']), [0, 0, 1, 2, 4])
+        self.assertListEqual(list(edges['source_index']), [1, 2, 3, 3])
+        self.assertListEqual(list(edges['source']), [2, 3, 4, 4])
+        self.assertCountEqual(
+                zip(edges['target'][2:], edges['target_index'][2:],
+                    edges['distance'][2:], edges['selected_1'][2:]),
+                [(2, 1, 3.0, False), (3, 2, 4.0, True)])
+        self.assertListEqual(list(edges['selected_1'][:2]), [True, False])
+        # the edge without selected_1 is marked as missing
+        self.assertListEqual(list(edges['present']), ['selected_1'])
+        self.assertListEqual(
+                list(edges['present']['selected_1'][:2]), [True, False])
+        self.assertCountEqual(
+                zip(edges['target'][2:], edges['present']['selected_1'][2:]),
+                [(2, True), (3, True)])
+        self.assertDictEqual(nodes['present'], {})
+
+        # edges leaving the roi get target index -1
+        nodes, edges = db.read_arrays(
+                Roi((1, 0, 0, 0), (2, 10, 10, 10)))
+        self.assertListEqual(list(nodes['id']), [2, 3, 4])
+        self.assertListEqual(list(edges['target_index'][:2]), [-1, -1])
+        self.delete_db(db_name, db_host)
+
     def test_write_and_get_score(self):
         db_name = 'test_linajea_database'
         db_host = 'localhost'
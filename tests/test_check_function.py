@@ -1,4 +1,5 @@
-from linajea.process_blockwise import check_function, write_done
+from linajea.process_blockwise import (
+    check_function, write_done, BlockCompletion)
 from daisy import Block, Roi
 import pymongo
 import unittest
@@ -23,3 +24,33 @@ class TestCheckFunction(unittest.TestCase):
         write_done(block, step_name, self.db_name, self.db_host)
         self.assertTrue(check_function(
             block, step_name, self.db_name, self.db_host))
+
+    def test_block_completion(self):
+        step_name = 'solve'
+        roi = Roi((0, 0, 0, 0), (10, 10, 10, 10))
+        blocks = [Block(roi, roi, roi, block_id=i) for i in range(5)]
+
+        completion = BlockCompletion(
+            step_name, self.db_name, self.db_host, max_pending=2)
+        completion.mark_done(blocks[0])
+        self.assertEqual(completion.progress()['pending'], 1)
+        completion.mark_done(blocks[1])
+        self.assertEqual(completion.progress()['pending'], 0)
+        self.assertEqual(completion.progress()['written'], 2)
+        completion.mark_done(blocks[2])
+
+        # written acknowledgements are prefetched by the first check
+        other = BlockCompletion(step_name, self.db_name, self.db_host)
+        self.assertEqual(
+            [other.check(block) for block in blocks],
+            [True, True, False, False, False])
+        completion.flush()
+        # checking a block again asks the db
+        self.assertTrue(other.check(blocks[2]))
+        self.assertFalse(other.check(blocks[3]))
+        self.assertEqual(other.progress()['checked'], 7)
+        self.assertEqual(other.progress()['skipped'], 2)
+
+        # processing blocks again does not fail
+        completion.mark_done(blocks[0])
+        completion.flush()
@@ -0,0 +1,177 @@
+from linajea.tracking.sparse_solver import get_pins
+import linajea
+import linajea.tracking
+import linajea.evaluation
+import logging
+import daisy
+import networkx as nx
+import pymongo
+import random
+import unittest
+
+logging.basicConfig(level=logging.INFO)
+
+
+class TestCompactTrackGraph(unittest.TestCase):
+
+    def create_graph(self, seed, num_cells=60, num_frames=6, vgg=False):
+        random.seed(seed)
+        graph = nx.DiGraph()
+        for i in range(num_cells):
+            cell = {
+                't': random.randint(0, num_frames - 1),
+                'z': random.uniform(0, 20),
+                'y': random.uniform(0, 20),
+                'x': random.uniform(0, 20),
+                'score': random.uniform(0, 1),
+            }
+            if vgg:
+                cell['vgg_score'] = [random.uniform(0, 1) for _ in range(3)]
+            graph.add_node(100 - i, **cell)
+        for u in graph.nodes:
+            for v in graph.nodes:
+                if graph.nodes[u]['t'] == graph.nodes[v]['t'] + 1 and \
+                        random.random() < 0.1:
+                    graph.add_edge(
+                        u, v, prediction_distance=random.uniform(0, 5))
+        roi = daisy.Roi((0, 0, 0, 0), (num_frames, 20, 20, 20))
+        return (
+            linajea.tracking.TrackGraph(graph, frame_key='t', roi=roi),
+            linajea.tracking.CompactTrackGraph.from_graph(
+                graph, frame_key='t', roi=roi))
+
+    def get_parameters(self):
+        ps = {
+                "track_cost": 2.0,
+                "weight_edge_score": 0.3,
+                "weight_node_score": -2.0,
+                "selection_constant": -1.0,
+                "weight_division": 0.5,
+                "weight_child": 0.2,
+                "weight_continuation": -0.1,
+                "max_cell_move": 3.0,
+                "block_size": [5, 100, 100, 100],
+                "context": [2, 100, 100, 100],
+            }
+        return linajea.tracking.TrackingParameters(**ps)
+
+    def test_same_as_track_graph(self):
+        track_graph, compact = self.create_graph(0)
+        self.assertEqual(track_graph.get_frames(), compact.get_frames())
+        self.assertEqual(
+            track_graph.number_of_edges(), compact.number_of_edges())
+        for t in range(-1, 8):
+            self.assertCountEqual(
+                track_graph.cells_by_frame(t), compact.cells_by_frame(t))
+        for node in track_graph.nodes:
+            self.assertCountEqual(
+                track_graph.prev_edges(node), compact.prev_edges(node))
+            self.assertCountEqual(
+                track_graph.next_edges(node), compact.next_edges(node))
+            self.assertEqual(
+                track_graph.nodes[node]['score'],
+                compact.nodes[node]['score'])
+        for edge in track_graph.edges:
+            self.assertEqual(
+                track_graph.edges[edge]['prediction_distance'],
+                compact.edges[edge]['prediction_distance'])
+
+        tracks = sorted(
+            sorted(track.nodes) for track in track_graph.get_tracks())
+        compact_tracks = compact.get_tracks()
+        self.assertListEqual(
+            tracks,
+            sorted(sorted(track.nodes.tolist()) for track in compact_tracks))
+        self.assertEqual(
+            sum(track.number_of_edges() for track in compact_tracks),
+            compact.number_of_edges())
+
+    def test_same_solution(self):
+        parameters = self.get_parameters()
+        for vgg_key in [None, 'vgg_score']:
+            for solver_type in [linajea.tracking.Solver,
+                                linajea.tracking.SparseSolver]:
+                track_graph, compact = self.create_graph(
+                    1, vgg=vgg_key is not None)
+                solver = solver_type(
+                    track_graph, parameters, 'selected', vgg_key=vgg_key)
+                solver.solve()
+                compact_solver = solver_type(
+                    compact, parameters, 'selected', vgg_key=vgg_key)
+                compact_solver.solve()
+                self.assertAlmostEqual(
+                    solver.solution_cost, compact_solver.solution_cost)
+                for edge in track_graph.edges:
+                    self.assertEqual(
+                        track_graph.edges[edge]['selected'],
+                        compact.edges[edge]['selected'])
+
+    def test_same_evaluation(self):
+        gt_track_graph, _ = self.create_graph(2)
+        rec_track_graph, _ = self.create_graph(2)
+        for _, data in rec_track_graph.nodes(data=True):
+            data['x'] += random.uniform(-1, 1)
+        parameters = self.get_parameters()
+        linajea.tracking.Solver(
+            gt_track_graph, parameters, 'selected').solve()
+        parameters.track_cost = 0.5
+        linajea.tracking.SparseSolver(
+            rec_track_graph, parameters, 'selected').solve()
+        for track_graph in [gt_track_graph, rec_track_graph]:
+            track_graph.remove_edges_from([
+                e for e in list(track_graph.edges)
+                if not track_graph.edges[e]['selected']])
+        gt_compact = linajea.tracking.CompactTrackGraph.from_graph(
+            gt_track_graph, roi=gt_track_graph.roi)
+        rec_compact = linajea.tracking.CompactTrackGraph.from_graph(
+            rec_track_graph, roi=rec_track_graph.roi)
+
+        report = linajea.evaluation.evaluate(
+            gt_track_graph, rec_track_graph, matching_threshold=5,
+            sparse=False)
+        compact_report = linajea.evaluation.evaluate(
+            gt_compact, rec_compact, matching_threshold=5, sparse=False)
+        self.assertGreater(report.matched_edges, 0)
+        for key, value in report.__dict__.items():
+            compact_value = compact_report.__dict__[key]
+            if isinstance(value, list):
+                self.assertCountEqual(value, compact_value)
+            else:
+                self.assertAlmostEqual(value, compact_value)
+
+    def test_from_arrays_pins(self):
+        db_name = 'test_linajea_compact_track_graph'
+        roi = daisy.Roi((0, 0, 0, 0), (6, 20, 20, 20))
+        track_graph, _ = self.create_graph(3)
+        db = linajea.CandidateDatabase(
+            db_name, 'localhost', mode='w', total_roi=roi)
+        graph = db[roi]
+        graph.add_nodes_from(track_graph.nodes(data=True))
+        graph.add_edges_from(track_graph.edges(data=True))
+        # only some of the edges were solved before
+        solved = list(track_graph.edges)[::3]
+        for i, edge in enumerate(solved):
+            graph.edges[edge]['selected_1'] = i % 2 == 0
+        graph.write_nodes()
+        graph.write_edges()
+
+        nodes, edges = db.read_arrays(
+            roi,
+            node_attrs=['score'],
+            edge_attrs=['prediction_distance', 'selected_1'])
+        compact = linajea.tracking.CompactTrackGraph.from_arrays(
+            nodes, edges, roi=roi)
+        pins = get_pins(compact, 'selected_1')
+        self.assertEqual(sum(pins >= 0), len(solved))
+        for i, edge in enumerate(compact.edges):
+            if edge in solved:
+                self.assertEqual(
+                    pins[i], int(compact.edges[edge]['selected_1']))
+            else:
+                self.assertEqual(pins[i], -1)
+                self.assertNotIn('selected_1', compact.edges[edge])
+
+        solver = linajea.tracking.Solver(
+            compact, self.get_parameters(), 'selected_1')
+        self.assertCountEqual(solver.pinned_edges, solved)
+        pymongo.MongoClient('localhost').drop_database(db_name)
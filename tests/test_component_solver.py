@@ -0,0 +1,150 @@
+import linajea.tracking
+import logging
+import daisy
+import multiprocessing
+import networkx as nx
+import random
+import unittest
+
+logging.basicConfig(level=logging.INFO)
+
+
+class TestComponentSolver(unittest.TestCase):
+
+    def create_graph(self, seed, num_cells=120, num_frames=8, vgg=False):
+        random.seed(seed)
+        graph = nx.DiGraph()
+        for i in range(num_cells):
+            cell = {
+                't': random.randint(0, num_frames - 1),
+                'z': random.uniform(0, 20),
+                'y': random.uniform(0, 20),
+                'x': random.uniform(0, 20),
+                'score': random.uniform(0, 1),
+            }
+            if vgg:
+                cell['vgg_score'] = [random.uniform(0, 1) for _ in range(3)]
+            graph.add_node(i, **cell)
+        for u in range(num_cells):
+            for v in range(num_cells):
+                if graph.nodes[u]['t'] == graph.nodes[v]['t'] + 1 and \
+                        random.random() < 0.04:
+                    graph.add_edge(
+                        u, v, prediction_distance=random.uniform(0, 5))
+        roi = daisy.Roi((0, 0, 0, 0), (num_frames, 20, 20, 20))
+        return linajea.tracking.TrackGraph(graph, frame_key='t', roi=roi)
+
+    def get_parameters(self):
+        ps = {
+                "track_cost": 2.0,
+                "weight_edge_score": 0.3,
+                "weight_node_score": -2.0,
+                "selection_constant": -1.0,
+                "weight_division": 0.5,
+                "division_constant": 0.5,
+                "weight_child": 0.2,
+                "weight_continuation": -0.1,
+                "max_cell_move": 3.0,
+                "block_size": [5, 100, 100, 100],
+                "context": [2, 100, 100, 100],
+            }
+        return linajea.tracking.TrackingParameters(**ps)
+
+    def test_same_cost_as_solver(self):
+        parameters = self.get_parameters()
+        for seed in range(4):
+            for vgg_key in [None, 'vgg_score']:
+                track_graph = self.create_graph(
+                    seed, vgg=vgg_key is not None)
+                solver = linajea.tracking.Solver(
+                    track_graph, parameters, 'selected', vgg_key=vgg_key)
+                component_solver = linajea.tracking.ComponentSolver(
+                    track_graph, parameters, 'component_selected',
+                    vgg_key=vgg_key)
+                self.assertGreater(len(component_solver.singletons), 0)
+                self.assertGreater(len(component_solver.chains), 0)
+                self.assertGreater(len(component_solver.components), 0)
+
+                solver.solve()
+                component_solver.solve()
+                self.assertAlmostEqual(
+                    solver.solution_cost, component_solver.solution_cost)
+
+    def test_pinned_chain(self):
+        parameters = self.get_parameters()
+        track_graph = self.create_graph(0)
+        solver = linajea.tracking.ComponentSolver(
+            track_graph, parameters, 'selected')
+        _, chain_edges = next(
+            chain for chain in solver.chains if len(chain[1]) > 0)
+        pinned = solver.edge_ids[chain_edges[0]]
+        for key in ['selected', 'reference']:
+            track_graph.edges[pinned][key] = True
+
+        solver.solve()
+        reference = linajea.tracking.Solver(
+            track_graph, parameters, 'reference')
+        reference.solve()
+        self.assertTrue(track_graph.edges[pinned]['selected'])
+        self.assertAlmostEqual(
+            solver.solution_cost, reference.solution_cost)
+
+    def test_parallel_components(self):
+        parameters = self.get_parameters()
+        track_graph = self.create_graph(1, num_cells=200)
+        for key, num_workers in [('sequential', 1), ('parallel', 3)]:
+            solver = linajea.tracking.ComponentSolver(
+                track_graph, parameters, key, num_workers=num_workers)
+            solver.solve()
+        for _, _, data in track_graph.edges(data=True):
+            self.assertEqual(data['sequential'], data['parallel'])
+
+    def test_parallel_parameter_sweep(self):
+        parameters = self.get_parameters()
+        track_graph = self.create_graph(1, num_cells=200)
+        sequential = linajea.tracking.ComponentSolver(
+            track_graph, parameters, 'sequential_0')
+        parallel = linajea.tracking.ComponentSolver(
+            track_graph, parameters, 'parallel_0', num_workers=3)
+        workers = None
+        for i, track_cost in enumerate([2.0, 0.5, 4.0]):
+            parameters = self.get_parameters()
+            parameters.track_cost = track_cost
+            for key, solver in [
+                    ('sequential_%d' % i, sequential),
+                    ('parallel_%d' % i, parallel)]:
+                solver.update_objective(parameters, key)
+                solver.solve()
+            self.assertAlmostEqual(
+                sequential.solution_cost, parallel.solution_cost)
+            for _, _, data in track_graph.edges(data=True):
+                self.assertEqual(
+                    data['sequential_%d' % i], data['parallel_%d' % i])
+            # the same workers (and their solvers) are used for each solve
+            pids = [process.pid for process, _ in parallel._workers]
+            if workers is not None:
+                self.assertListEqual(pids, workers)
+            workers = pids
+        parallel.close()
+        self.assertIsNone(parallel._workers)
+
+    def test_workers_stopped(self):
+        track_graph = self.create_graph(1, num_cells=200)
+        parameters = [self.get_parameters(), self.get_parameters()]
+        parameters[1].track_cost = 0.5
+        children = multiprocessing.active_children()
+        linajea.tracking.track(
+            track_graph, parameters, ['selected_0', 'selected_1'],
+            split_components=True, num_workers=3)
+        self.assertFalse(
+            set(multiprocessing.active_children()) - set(children))
+
+        # workers of a solver that is discarded without close exit as well
+        solver = linajea.tracking.ComponentSolver(
+            track_graph, parameters[0], 'selected', num_workers=3)
+        solver.solve()
+        processes = [process for process, _ in solver._workers]
+        del solver
+        for process in processes:
+            process.join(10)
+            self.assertEqual(process.exitcode, 0)
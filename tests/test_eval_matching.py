@@ -1,5 +1,9 @@
-from linajea.evaluation.match import match, get_edge_costs, match_edges
+from linajea.evaluation.match import (
+        match, match_linear_assignment, get_edge_costs, match_edges,
+        get_frame_edge_costs, _MatchingFrame)
+import numpy as np
 import unittest
+import random
 import networkx as nx
 from linajea.tracking import TrackGraph
 import logging
@@ -9,18 +13,26 @@ logging.basicConfig(level=logging.INFO)
 
 class TestEvalMatch(unittest.TestCase):
 
+    matching_backend = 'ilp'
+
+    def match(self, costs, no_match_cost):
+        return {
+            'ilp': match,
+            'linear_assignment': match_linear_assignment,
+        }[self.matching_backend](costs, no_match_cost)
+
     def test_match_simple(self):
         costs = {(1, 1): 10}
         no_match_cost = 20
 
-        matches, cost = match(costs, no_match_cost)
+        matches, cost = self.match(costs, no_match_cost)
         expected_matches = [(1, 1)]
         self.assertCountEqual(matches, expected_matches)
         self.assertEqual(cost, 10)
 
         no_match_cost = 3
 
-        matches, cost = match(costs, no_match_cost)
+        matches, cost = self.match(costs, no_match_cost)
         expected_matches = []
         self.assertCountEqual(matches, expected_matches)
         self.assertEqual(cost, 6)
@@ -31,7 +43,7 @@ class TestEvalMatch(unittest.TestCase):
                 }
         no_match_cost = 20
 
-        matches, cost = match(costs, no_match_cost)
+        matches, cost = self.match(costs, no_match_cost)
         expected_matches = [(1, 1)]
         self.assertCountEqual(matches, expected_matches)
         self.assertEqual(cost, 30)
@@ -46,14 +58,14 @@ class TestEvalMatch(unittest.TestCase):
                 }
         no_match_cost = 20
 
-        matches, cost = match(costs, no_match_cost)
+        matches, cost = self.match(costs, no_match_cost)
         expected_matches = [(1, 1), (2, 2)]
         self.assertCountEqual(matches, expected_matches)
         self.assertEqual(cost, 60)
 
         no_match_cost = 15
 
-        matches, cost = match(costs, no_match_cost)
+        matches, cost = self.match(costs, no_match_cost)
         expected_matches = [(1, 1), (2, 2)]
         self.assertCountEqual(matches, expected_matches)
         self.assertEqual(cost, 50)
@@ -81,6 +93,73 @@ class TestEvalMatch(unittest.TestCase):
                 }
         self.assertEqual(edge_costs, expected_edge_costs)
 
+    def create_track_graph(self, num_cells, num_frames, edge_prob):
+        graph = nx.DiGraph()
+        for i in range(num_cells):
+            graph.add_node(
+                i,
+                t=random.randint(0, num_frames - 1),
+                z=random.uniform(0, 10),
+                y=random.uniform(0, 10),
+                x=random.uniform(0, 10))
+        for u in graph.nodes:
+            candidates = [
+                v for v in graph.nodes
+                if graph.nodes[v]['t'] == graph.nodes[u]['t'] - 1]
+            if candidates and random.random() < edge_prob:
+                graph.add_edge(u, random.choice(candidates))
+        return TrackGraph(graph, frame_key='t')
+
+    def test_frame_edge_costs(self):
+        random.seed(3)
+        matching_threshold = 3
+        track_graph_x = self.create_track_graph(150, 5, 0.9)
+        track_graph_y = self.create_track_graph(200, 5, 0.9)
+        edges_x = [(int(u), int(v)) for u, v in track_graph_x.edges()]
+        edges_y = [(int(u), int(v)) for u, v in track_graph_y.edges()]
+        edges_y_by_source = {u: (v, i) for i, (u, v) in enumerate(edges_y)}
+
+        def positions(track_graph, n):
+            return np.array([track_graph.nodes[n][d] for d in 'zyx'])
+
+        for t in range(1, 5):
+            frame = _MatchingFrame(
+                track_graph_x, track_graph_y, t, matching_threshold)
+            previous_frame = _MatchingFrame(
+                track_graph_x, track_graph_y, t - 1, matching_threshold)
+            frame_edge_ids_x = [
+                i for i, (u, v) in enumerate(edges_x)
+                if track_graph_x.nodes[u]['t'] == t]
+            edge_costs = get_frame_edge_costs(
+                edges_x, frame_edge_ids_x, edges_y_by_source,
+                frame, previous_frame)
+
+            node_pairs_xy = {}
+            for f in [t - 1, t]:
+                for node_x in track_graph_x.cells_by_frame(f):
+                    node_pairs_xy[node_x] = []
+                    for node_y in track_graph_y.cells_by_frame(f):
+                        distance = np.linalg.norm(
+                            positions(track_graph_x, node_x) -
+                            positions(track_graph_y, node_y))
+                        if distance <= matching_threshold:
+                            node_pairs_xy[node_x].append((node_y, distance))
+            expected_edge_costs = get_edge_costs(
+                edges_x, edges_y_by_source, node_pairs_xy)
+
+            self.assertGreater(len(expected_edge_costs), 0)
+            self.assertCountEqual(
+                edge_costs.keys(), expected_edge_costs.keys())
+            for pair, cost in expected_edge_costs.items():
+                self.assertAlmostEqual(edge_costs[pair], cost)
+
+        timings = {}
+        match_edges(
+            track_graph_x, track_graph_y, matching_threshold,
+            matching_backend=self.matching_backend, timings=timings)
+        self.assertCountEqual(
+            timings.keys(), ['kd_tree', 'pairing', 'assignment'])
+
     def test_match_tracks_simple(self):
         cells_x = [
                 (0, {'t': 0, 'z': 1, 'y': 1, 'x': 1,  'score': 2.0}),
@@ -111,9 +190,29 @@ class TestEvalMatch(unittest.TestCase):
         graph_y.add_edges_from(edges_y)
         track_graph_y = TrackGraph(graph_y)
         ex, ey, matches, fp_edges = match_edges(
-                track_graph_x, track_graph_y, 2)
+                track_graph_x, track_graph_y, 2,
+                matching_backend=self.matching_backend)
         edge_matches = [(ex[x_ind], ey[y_ind]) for x_ind, y_ind in matches]
         expected_edge_matches = [
                 ((1, 0), (1, 0)),
                 ]
         self.assertEqual(edge_matches, expected_edge_matches)
+
+
+class TestEvalMatchLinearAssignment(TestEvalMatch):
+
+    matching_backend = 'linear_assignment'
+
+    def test_same_as_ilp(self):
+        random.seed(42)
+        for _ in range(20):
+            costs = {
+                (random.randint(0, 30), random.randint(0, 30)):
+                    random.uniform(0, 10)
+                for _ in range(80)
+            }
+            no_match_cost = random.uniform(1, 6)
+            ilp_matches, ilp_cost = match(costs, no_match_cost)
+            matches, cost = match_linear_assignment(costs, no_match_cost)
+            self.assertAlmostEqual(cost, ilp_cost)
+            self.assertCountEqual(matches, ilp_matches)
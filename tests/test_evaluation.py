@@ -1,6 +1,11 @@
 import linajea.tracking
 import linajea.evaluation as e
+from linajea.evaluation.evaluate_setup import _get_roi, _get_selected_graph
+from linajea.evaluation.evaluator import Evaluator
+import json
 import logging
+import os
+import tempfile
 import unittest
 import linajea
 import daisy
@@ -398,3 +403,137 @@ class EvaluationTestCase(unittest.TestCase):
         self.assertEqual(scores.fp_divisions, 1)
         self.assertEqual(scores.fn_edges, 0)
         self.delete_db()
+
+    def test_track_labels(self):
+        cells, edges, roi = self.getDivisionTrack()
+        cells.append((8, {'t': 3, 'z': 0, 'y': 3, 'x': 0}))
+        cells.append((9, {'t': 4, 'z': 0, 'y': 3, 'x': 0}))
+        cells.append((10, {'t': 0, 'z': 3, 'y': 3, 'x': 0}))
+        edges.append((9, 8))
+        track_graph = self.create_graph(cells, edges, roi)
+        num_tracks, edge_labels = Evaluator.get_track_labels(track_graph)
+        self.assertEqual(num_tracks, 3)
+        self.assertCountEqual(edge_labels.keys(), edges)
+        self.assertEqual(
+            len(set(edge_labels[edge] for edge in edges[:-1])), 1)
+        self.assertNotEqual(edge_labels[(9, 8)], edge_labels[(2, 1)])
+        self.delete_db()
+
+    def write_graph(self, db_name, cells, edges, roi, selected_key=None):
+        db = linajea.CandidateDatabase(
+                db_name, 'localhost', mode='w', total_roi=roi)
+        graph = db[roi]
+        graph.add_nodes_from(cells)
+        if selected_key:
+            graph.add_edges_from(
+                (u, v, {selected_key: True}) for u, v in edges)
+        else:
+            graph.add_edges_from(edges)
+        graph.write_nodes()
+        graph.write_edges()
+
+    def test_evaluate_in_windows(self):
+        gt_cells, gt_edges, roi = self.getDivisionTrack()
+        rec_cells, rec_edges, _ = self.getDivisionTrack()
+        for cell in rec_cells:
+            cell[1]['y'] += 1
+        # introduce a split error and an fn division
+        rec_edges.remove((3, 2))
+        self.write_graph('test_eval', gt_cells, gt_edges, roi)
+        self.write_graph(
+                'test_eval_rec', rec_cells, rec_edges, roi,
+                selected_key='selected_1')
+        gt_db = linajea.CandidateDatabase('test_eval', 'localhost')
+        rec_db = linajea.CandidateDatabase(
+                'test_eval_rec', 'localhost', parameters_id=1)
+
+        scores = e.evaluate(
+                linajea.tracking.TrackGraph(gt_db[roi], frame_key='t'),
+                linajea.tracking.TrackGraph(
+                    rec_db.get_selected_graph(roi), frame_key='t'),
+                matching_threshold=2,
+                sparse=True)
+        for window_size in [2, 3, 10]:
+            window_scores = e.evaluate_in_windows(
+                    gt_db, rec_db, roi, window_size, matching_threshold=2,
+                    sparse=True)
+            for key, value in scores.__dict__.items():
+                window_value = window_scores.__dict__[key]
+                if isinstance(value, list):
+                    self.assertCountEqual(value, window_value)
+                else:
+                    self.assertAlmostEqual(value, window_value)
+        self.delete_db()
+        pymongo.MongoClient('localhost').drop_database('test_eval_rec')
+
+    def test_evaluate_with_gt_cache(self):
+        gt_cells, gt_edges, roi = self.getDivisionTrack()
+        rec_cells, rec_edges, _ = self.getDivisionTrack()
+        for cell in rec_cells:
+            cell[1]['y'] += 1
+        self.write_graph('test_eval', gt_cells, gt_edges, roi)
+        # parameter set 1 has a split error and an fn division, 2 an fn edge
+        rec_db = linajea.CandidateDatabase(
+                'test_eval_rec', 'localhost', mode='w', total_roi=roi)
+        graph = rec_db[roi]
+        graph.add_nodes_from(rec_cells)
+        graph.add_edges_from(
+            (u, v, {'selected_1': (u, v) != (3, 2),
+                    'selected_2': (u, v) != (6, 5)})
+            for u, v in rec_edges)
+        graph.write_nodes()
+        graph.write_edges()
+
+        gt_db = linajea.CandidateDatabase('test_eval', 'localhost')
+        gt_track_graph = linajea.tracking.TrackGraph(
+                gt_db[roi], frame_key='t')
+        gt_cache = e.GroundTruthCache(gt_track_graph)
+        nodes, edges = rec_db.read_arrays(
+                roi, edge_attrs=['selected_1', 'selected_2'])
+        for parameters_id in [1, 2, 1]:
+            rec_db.set_parameters_id(parameters_id)
+            rec_graph = rec_db.get_selected_graph(roi)
+            arrays_graph = _get_selected_graph(
+                    nodes, edges, rec_db.selected_key)
+            self.assertCountEqual(rec_graph.nodes, arrays_graph.nodes)
+            self.assertCountEqual(rec_graph.edges, arrays_graph.edges)
+
+            scores = e.evaluate(
+                    linajea.tracking.TrackGraph(gt_db[roi], frame_key='t'),
+                    linajea.tracking.TrackGraph(rec_graph, frame_key='t'),
+                    matching_threshold=2,
+                    sparse=True)
+            cached_scores = e.evaluate(
+                    gt_track_graph,
+                    linajea.tracking.TrackGraph(arrays_graph, frame_key='t'),
+                    matching_threshold=2,
+                    sparse=True,
+                    gt_cache=gt_cache)
+            for key, value in scores.__dict__.items():
+                cached_value = cached_scores.__dict__[key]
+                if isinstance(value, list):
+                    self.assertCountEqual(value, cached_value)
+                else:
+                    self.assertAlmostEqual(value, cached_value)
+        self.assertEqual(gt_track_graph.number_of_nodes(), len(gt_cells))
+        self.delete_db()
+        pymongo.MongoClient('localhost').drop_database('test_eval_rec')
+
+    def test_get_roi(self):
+        with tempfile.TemporaryDirectory() as data_dir:
+            os.makedirs(os.path.join(data_dir, 'sample'))
+            with open(
+                    os.path.join(data_dir, 'sample', 'attributes.json'),
+                    'w') as f:
+                json.dump({
+                    'resolution': [1, 5, 1, 1],
+                    'shape': [10, 20, 100, 100],
+                    'offset': [0, 0, 0, 0]}, f)
+            self.assertEqual(
+                    _get_roi('sample', data_dir, None, None),
+                    daisy.Roi((0, 0, 0, 0), (10, 100, 100, 100)))
+            self.assertEqual(
+                    _get_roi(
+                        'sample', data_dir, [2, 5],
+                        daisy.Roi((0, 0, 10, 10), (8, 50, 20, 20))),
+                    daisy.Roi((2, 0, 10, 10), (3, 50, 20, 20)))
@@ -0,0 +1,67 @@
+from linajea import CandidateDatabase
+from linajea.process_blockwise.extract_edges_blockwise import (
+        extract_edges_in_block, extract_edges_in_block_columnar)
+from daisy import Block, Roi
+import logging
+import pymongo
+import random
+import unittest
+
+logging.basicConfig(level=logging.INFO)
+
+
+class TestExtractEdges(unittest.TestCase):
+
+    def delete_db(self, db_name, db_host):
+        client = pymongo.MongoClient(db_host)
+        client.drop_database(db_name)
+
+    def write_cells(self, db_name, db_host, roi):
+        random.seed(42)
+        db = CandidateDatabase(db_name, db_host, mode='w', total_roi=roi)
+        graph = db[roi]
+        cells = []
+        for i in range(200):
+            cells.append((i + 1, {
+                't': random.randint(0, 4),
+                'z': random.uniform(0, 50),
+                'y': random.uniform(0, 50),
+                'x': random.uniform(0, 50),
+                'score': 1.0,
+                'parent_vector': [random.uniform(-3, 3) for _ in range(3)]
+                }))
+        graph.add_nodes_from(cells)
+        graph.write_nodes()
+
+    def read_edges(self, db_name, db_host):
+        client = pymongo.MongoClient(db_host)
+        return {
+            (e['source'], e['target']): (
+                e['distance'], e['prediction_distance'])
+            for e in client[db_name]['edges'].find()
+        }
+
+    def test_columnar_matches_graph(self):
+        db_host = 'localhost'
+        roi = Roi((0, 0, 0, 0), (5, 50, 50, 50))
+        write_roi = Roi((1, 10, 10, 10), (3, 30, 30, 30))
+        read_roi = write_roi.grow((1, 10, 10, 10), (0, 10, 10, 10))
+        block = Block(roi, read_roi, write_roi)
+
+        for use_pv_distance in [False, True]:
+            results = []
+            for extract in [extract_edges_in_block,
+                            extract_edges_in_block_columnar]:
+                db_name = 'linajea_test_extract_edges'
+                self.write_cells(db_name, db_host, roi)
+                extract(db_name, db_host, 10, block,
+                        use_pv_distance=use_pv_distance)
+                results.append(self.read_edges(db_name, db_host))
+                self.delete_db(db_name, db_host)
+
+            graph_edges, columnar_edges = results
+            self.assertGreater(len(graph_edges), 0)
+            self.assertCountEqual(graph_edges.keys(), columnar_edges.keys())
+            for edge, distances in graph_edges.items():
+                for d1, d2 in zip(distances, columnar_edges[edge]):
+                    self.assertAlmostEqual(d1, d2, places=5)
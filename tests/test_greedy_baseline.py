@@ -4,6 +4,7 @@ import linajea
 import unittest
 import daisy
 import pymongo
+import networkx as nx
 
 logging.basicConfig(level=logging.INFO)
 
@@ -171,3 +172,47 @@ class TestGreedy(unittest.TestCase):
                 ]
         self.assertCountEqual(selected_edges, expected_result)
         self.delete_db(db_name, db_host)
+
+    def get_chain_graph(self):
+        #   x
+        #  1|   0---1---2
+        #  0|   3---4---5
+        #    ------------------------------------ t
+        #       0   1   2
+        graph = nx.DiGraph()
+        for i in range(6):
+            graph.add_node(i, t=i % 3, x=int(i < 3), score=2.0)
+        graph.add_edge(1, 0, distance=0.0)
+        graph.add_edge(2, 1, distance=0.0)
+        graph.add_edge(4, 3, distance=0.0)
+        graph.add_edge(5, 4, distance=0.0)
+        graph.add_edge(4, 0, distance=1.0)
+        return graph
+
+    def test_greedy_first_frame(self):
+        graph = self.get_chain_graph()
+        linajea.tracking.greedy_track(
+                graph,
+                selected_key='selected',
+                cell_indicator_threshold=1.0,
+                metric='distance')
+        selected_edges = [
+            (u, v) for u, v, data in graph.edges(data=True)
+            if data['selected']]
+        self.assertCountEqual(
+            selected_edges, [(1, 0), (2, 1), (4, 3), (5, 4)])
+
+    def test_greedy_keep_selected(self):
+        graph = self.get_chain_graph()
+        graph.edges[(4, 0)]['selected'] = True
+        linajea.tracking.greedy_track(
+                graph,
+                selected_key='selected',
+                cell_indicator_threshold=1.0,
+                metric='distance',
+                keep_selected=True)
+        selected_edges = [
+            (u, v) for u, v, data in graph.edges(data=True)
+            if data['selected']]
+        self.assertCountEqual(
+            selected_edges, [(1, 0), (2, 1), (4, 0), (5, 4)])
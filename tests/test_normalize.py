@@ -0,0 +1,83 @@
+from linajea.dataset_statistics import (
+        compute_dataset_statistics, get_dataset_statistics)
+from linajea.gunpowder.normalize import normalize
+import logging
+import numpy as np
+import os
+import shutil
+import tempfile
+import unittest
+import zarr
+
+logging.basicConfig(level=logging.INFO)
+
+
+class NormalizeTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_normalize(self):
+        np.random.seed(42)
+        data = np.random.randint(0, 1000, size=(2, 5, 10, 10)).astype(
+            np.uint16)
+        expected = np.clip(data.astype(np.float32), 100, 900)
+        expected = ((expected - 100) / 800).astype(np.float32)
+
+        normalized = normalize(data, 100, 800, mn=100, mx=900)
+        self.assertEqual(normalized.dtype, np.float32)
+        self.assertTrue(np.array_equal(expected, normalized))
+        self.assertEqual(data.dtype, np.uint16)
+
+        # float32 data is normalized in place
+        data = data.astype(np.float32)
+        expected = ((data - 500.5) / 100.25).astype(np.float32)
+        normalized = normalize(data, 500.5, 100.25)
+        self.assertIs(normalized, data)
+        self.assertTrue(np.allclose(expected, normalized, atol=1e-5))
+
+    def test_dataset_statistics(self):
+        filename = os.path.join(self.tmp_dir, 'test.zarr')
+        np.random.seed(42)
+        data = np.random.poisson(100, size=(3, 7, 20, 30)).astype(np.uint16)
+        container = zarr.open(filename, mode='w')
+        container.create_dataset(
+            'volumes/raw', data=data, shape=data.shape, dtype=data.dtype,
+            chunks=(1, 4, 8, 16))
+
+        statistics = compute_dataset_statistics(
+            filename, 'volumes/raw', percentiles=(1, 99.9))
+        self.assertEqual(statistics['min'], data.min())
+        self.assertEqual(statistics['max'], data.max())
+        self.assertAlmostEqual(statistics['mean'], data.mean())
+        self.assertAlmostEqual(statistics['std'], data.std())
+        median = np.median(data)
+        self.assertAlmostEqual(statistics['median'], median)
+        self.assertAlmostEqual(
+            statistics['mad'], np.median(np.abs(data - median)))
+        for q in [1, 99.9]:
+            self.assertAlmostEqual(
+                statistics['percentiles']['%g' % q], np.percentile(data, q))
+        self.assertDictEqual(
+            statistics, get_dataset_statistics(filename, 'volumes/raw'))
+
+        # float data, median and percentiles up to the bin width
+        data = data.astype(np.float32) + np.random.uniform(
+            size=data.shape).astype(np.float32)
+        container.create_dataset(
+            'volumes/float', data=data, shape=data.shape, dtype=data.dtype,
+            chunks=(1, 4, 8, 16))
+        statistics = compute_dataset_statistics(
+            filename, 'volumes/float', num_bins=1000, store=False)
+        bin_width = (data.max() - data.min()) / 1000
+        self.assertAlmostEqual(statistics['mean'], data.mean(), places=3)
+        self.assertAlmostEqual(statistics['std'], data.std(), places=3)
+        self.assertLessEqual(
+            abs(statistics['median'] - np.median(data)), bin_width)
+        self.assertLessEqual(
+            abs(statistics['percentiles']['99'] - np.percentile(data, 99)),
+            bin_width)
+        self.assertIsNone(get_dataset_statistics(filename, 'volumes/float'))
@@ -0,0 +1,86 @@
+import linajea.tracking
+from linajea.tracking.sparse_solver import (
+        track_graph_to_arrays, get_constraints, get_pins)
+import logging
+import daisy
+import networkx as nx
+import random
+import unittest
+
+logging.basicConfig(level=logging.INFO)
+
+
+class TestSparseSolver(unittest.TestCase):
+
+    def create_graph(self, seed, num_cells=60, num_frames=6, vgg=False):
+        random.seed(seed)
+        graph = nx.DiGraph()
+        for i in range(num_cells):
+            cell = {
+                't': random.randint(0, num_frames - 1),
+                'z': random.uniform(0, 20),
+                'y': random.uniform(0, 20),
+                'x': random.uniform(0, 20),
+                'score': random.uniform(0, 1),
+            }
+            if vgg:
+                cell['vgg_score'] = [random.uniform(0, 1) for _ in range(3)]
+            graph.add_node(i, **cell)
+        for u in range(num_cells):
+            for v in range(num_cells):
+                if graph.nodes[u]['t'] == graph.nodes[v]['t'] + 1 and \
+                        random.random() < 0.3:
+                    graph.add_edge(
+                        u, v, prediction_distance=random.uniform(0, 5))
+        roi = daisy.Roi((0, 0, 0, 0), (num_frames, 20, 20, 20))
+        return linajea.tracking.TrackGraph(graph, frame_key='t', roi=roi)
+
+    def get_parameters(self):
+        ps = {
+                "track_cost": 2.0,
+                "weight_edge_score": 0.3,
+                "weight_node_score": -2.0,
+                "selection_constant": -1.0,
+                "weight_division": 0.5,
+                "weight_child": 0.2,
+                "weight_continuation": -0.1,
+                "max_cell_move": 3.0,
+                "block_size": [5, 100, 100, 100],
+                "context": [2, 100, 100, 100],
+            }
+        return linajea.tracking.TrackingParameters(**ps)
+
+    def test_same_solution_as_solver(self):
+        parameters = self.get_parameters()
+        for seed in range(4):
+            for vgg_key in [None, 'vgg_score']:
+                track_graph = self.create_graph(
+                    seed, vgg=vgg_key is not None)
+                solver = linajea.tracking.Solver(
+                    track_graph, parameters, 'selected', vgg_key=vgg_key)
+                sparse_solver = linajea.tracking.SparseSolver(
+                    track_graph, parameters, 'sparse_selected',
+                    vgg_key=vgg_key)
+                self.assertEqual(solver.num_vars, sparse_solver.num_vars)
+                self.assertEqual(
+                    len(solver.main_constraints),
+                    len(sparse_solver.main_constraints))
+
+                solver.solve()
+                sparse_solver.solve()
+                for u, v, data in track_graph.edges(data=True):
+                    self.assertEqual(
+                        data['selected'], data['sparse_selected'])
+
+    def test_pinned_edges(self):
+        track_graph = self.create_graph(0)
+        u = next(n for n in track_graph.nodes
+                 if len(track_graph.prev_edges(n)) > 1)
+        for edge in track_graph.prev_edges(u):
+            track_graph.edges[edge]['selected'] = True
+        node_ids, nodes, edges = track_graph_to_arrays(track_graph)
+        pins = get_pins(track_graph, 'selected')
+        self.assertEqual(
+            sum(pins == 1), len(track_graph.prev_edges(u)))
+        with self.assertRaises(RuntimeError):
+            get_constraints(nodes, edges, pins, node_ids)
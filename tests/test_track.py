@@ -0,0 +1,102 @@
+import linajea.tracking
+from linajea.tracking.track import get_similarity_order
+import logging
+import daisy
+import networkx as nx
+import random
+import unittest
+
+logging.basicConfig(level=logging.INFO)
+
+
+class TestTrack(unittest.TestCase):
+
+    def create_graph(self, seed, num_cells=60, num_frames=6):
+        random.seed(seed)
+        graph = nx.DiGraph()
+        for i in range(num_cells):
+            graph.add_node(
+                i,
+                t=random.randint(0, num_frames - 1),
+                z=random.uniform(0, 20),
+                y=random.uniform(0, 20),
+                x=random.uniform(0, 20),
+                score=random.uniform(0, 1))
+        for u in range(num_cells):
+            for v in range(num_cells):
+                if graph.nodes[u]['t'] == graph.nodes[v]['t'] + 1 and \
+                        random.random() < 0.3:
+                    graph.add_edge(
+                        u, v, prediction_distance=random.uniform(0, 5))
+        graph.roi = daisy.Roi((0, 0, 0, 0), (num_frames, 20, 20, 20))
+        return graph
+
+    def get_parameters(self, track_cost, weight_edge_score):
+        ps = {
+                "track_cost": track_cost,
+                "weight_edge_score": weight_edge_score,
+                "weight_node_score": -2.0,
+                "selection_constant": -1.0,
+                "max_cell_move": 3.0,
+                "block_size": [5, 100, 100, 100],
+                "context": [2, 100, 100, 100],
+            }
+        return linajea.tracking.TrackingParameters(**ps)
+
+    def test_similarity_order(self):
+        parameters = [
+            self.get_parameters(1.0, 0.1),
+            self.get_parameters(5.0, 0.1),
+            self.get_parameters(1.5, 0.1),
+            self.get_parameters(4.0, 0.1),
+            self.get_parameters(1.0, 0.2),
+        ]
+        self.assertListEqual(
+            get_similarity_order(parameters), [0, 2, 3, 1, 4])
+
+    def test_ordered_solves(self):
+        parameters = [
+            self.get_parameters(track_cost, weight_edge_score)
+            for track_cost in [1.0, 4.0, 2.0]
+            for weight_edge_score in [0.1, 0.5]
+        ]
+        keys = ['selected_%d' % i for i in range(len(parameters))]
+        graph = self.create_graph(0)
+        stats = linajea.tracking.track(
+            graph, parameters, keys, use_sparse_solver=True,
+            order_by_similarity=True)
+        self.assertListEqual([s['selected_key'] for s in stats], keys)
+        self.assertEqual(
+            len([s for s in stats
+                 if s['previous_solution_cost'] is not None]),
+            len(parameters) - 1)
+        for s in stats:
+            if s['previous_solution_excess'] is not None:
+                self.assertGreaterEqual(s['previous_solution_excess'], -1e-6)
+
+        # same solutions as solving one at a time
+        for parameter, key in zip(parameters, keys):
+            reference = self.create_graph(0)
+            linajea.tracking.track(reference, parameter, 'reference')
+            for u, v, data in reference.edges(data=True):
+                self.assertEqual(
+                    data['reference'], graph.edges[(u, v)][key])
+
+    def test_parallel_solves(self):
+        parameters = [
+            self.get_parameters(track_cost, weight_edge_score)
+            for track_cost in [1.0, 4.0]
+            for weight_edge_score in [0.1, 0.5]
+        ]
+        keys = ['selected_%d' % i for i in range(len(parameters))]
+        sequential = self.create_graph(1)
+        linajea.tracking.track(sequential, parameters, keys)
+        for use_sparse_solver in [False, True]:
+            graph = self.create_graph(1)
+            stats = linajea.tracking.track(
+                graph, parameters, keys, use_sparse_solver=use_sparse_solver,
+                num_workers=3)
+            self.assertListEqual([s['selected_key'] for s in stats], keys)
+            for u, v, data in sequential.edges(data=True):
+                for key in keys:
+                    self.assertEqual(data[key], graph.edges[(u, v)][key])
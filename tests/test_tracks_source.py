@@ -3,8 +3,11 @@ logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 logging.getLogger('linajea').setLevel(logging.DEBUG)
 from linajea.gunpowder import TracksSource, AddParentVectors
+import glob
+import linajea
 import os
 import gunpowder as gp
+from gunpowder.morphology import enlarge_binary_map
 import unittest
 import numpy as np
 
@@ -37,8 +40,9 @@ class TracksSourceTestCase(unittest.TestCase):
             f.write(p5)
 
     def tearDown(self):
-        os.remove(TEST_FILE)
-        os.remove(TEST_FILE_WITH_HEADER)
+        # test files and their cached points
+        for filename in glob.glob('testdata*'):
+            os.remove(filename)
 
     def test_parent_location(self):
         points = gp.PointsKey("POINTS")
@@ -63,6 +67,73 @@ class TracksSourceTestCase(unittest.TestCase):
         self.assertListEqual([2.0, 2.0, 2.0, 2.0],
                              list(points[4].location))
 
+    def test_cached_points_in_roi(self):
+        filename = 'testdata_random.txt'
+        np.random.seed(23)
+        locations = np.round(
+            np.random.uniform(0, 10, size=(500, 4)), 2).astype(np.float32)
+        locations[:, 0] = np.floor(locations[:, 0])
+        with open(filename, 'w') as f:
+            for i, location in enumerate(locations):
+                f.write("%f %f %f %f %d -1 0\n" % (tuple(location) + (i + 1,)))
+
+        points = gp.PointsKey("POINTS")
+        ts = TracksSource(filename, points)
+        ts.setup()
+        self.assertEqual(len(glob.glob(filename + '.*.npy')), 4)
+        self.assertNotIsInstance(ts.locations, np.memmap)
+
+        # a second source reads the cached points
+        cached_ts = TracksSource(filename, points)
+        cached_ts.setup()
+        self.assertIsInstance(cached_ts.locations, np.memmap)
+
+        for _ in range(10):
+            begin = np.random.randint(0, 8, size=4)
+            shape = np.random.randint(2, 6, size=4)
+            request = gp.BatchRequest()
+            request[points] = gp.PointsSpec(roi=gp.Roi(begin, shape))
+            expected_ids = [
+                i + 1 for i, location in enumerate(locations)
+                if all(location >= begin) and all(location < begin + shape)]
+            if len(expected_ids) == 0:
+                continue
+            for source in [ts, cached_ts]:
+                batch = source.provide(request)
+                self.assertListEqual(
+                    expected_ids, list(batch[points].data.keys()))
+                for point_id, point in batch[points].data.items():
+                    self.assertListEqual(
+                        list(locations[point_id - 1]), list(point.location))
+
+    def test_read_tracks_file(self):
+        filename = 'testdata_typed.txt'
+        with open(filename, 'w') as f:
+            f.write('t,z,y,x,cell_id,parent_id,track_id,'
+                    'radius,name,div_state\n')
+            f.write('0,1.5,2,3,1,-1,0,2.5,first,0\n')
+            f.write('1,1.5,2,3,2,1,0,3.0,second,1\n')
+            f.write('2,1.5,2,3,3,2,0,1.0,third,2\n')
+
+        tracks = linajea.read_tracks_file(filename)
+        self.assertEqual(tracks['location'].dtype, np.float32)
+        self.assertListEqual(list(tracks['location'][0]), [0, 1.5, 2, 3])
+        self.assertEqual(tracks['cell_id'].dtype, np.int64)
+        self.assertListEqual(list(tracks['parent_id']), [-1, 1, 2])
+        self.assertListEqual(list(tracks['radius']), [2.5, 3.0, 1.0])
+        self.assertListEqual(list(tracks['div_state']), [0, 1, 2])
+        self.assertNotIn('name', tracks)
+
+        chunks = list(linajea.iter_tracks_file(
+            filename,
+            scale=[2, 1, 1, 1],
+            limit_to_roi=gp.Roi((1, 0, 0, 0), (4, 10, 10, 10)),
+            chunk_size=1))
+        self.assertEqual(len(chunks), 3)
+        self.assertListEqual(
+            [list(chunk['cell_id']) for chunk in chunks], [[], [2], [3]])
+        self.assertListEqual(list(chunks[2]['location'][0]), [4, 1.5, 2, 3])
+
     def test_csv_header(self):
         points = gp.PointsKey("POINTS")
         tswh = TracksSource(
@@ -172,3 +243,69 @@ class TracksSourceTestCase(unittest.TestCase):
                              parent_vectors[1].tolist())
         self.assertListEqual(expected_parent_vectors_x.tolist(),
                              parent_vectors[2].tolist())
+
+    def test_add_parent_vectors_dense(self):
+        # many overlapping points, compared against rasterizing each point
+        # with a distance transform over the whole array
+        filename = 'testdata_dense.txt'
+        np.random.seed(42)
+        locations = []
+        parents = []
+        with open(filename, 'w') as f:
+            for i in range(120):
+                t = i % 4
+                location = [t] + list(
+                    np.round(np.random.uniform(0, 19.99, size=3), 3))
+                parent = -1
+                if t > 0:
+                    parent = np.random.choice(np.arange(t - 1, i, 4)) + 1
+                f.write("%d %f %f %f %d %d 0\n" % (
+                    t, location[1], location[2], location[3], i + 1, parent))
+                locations.append(np.array(location, dtype=np.float32))
+                parents.append(parent)
+
+        points = gp.PointsKey("POINTS")
+        pv_array = gp.ArrayKey("PARENT_VECTORS")
+        mask = gp.ArrayKey("MASK")
+        radius = np.array([0.1, 3.0, 2.0, 2.5], dtype=np.float32)
+        roi = gp.Roi((0, 0, 0, 0), (4, 20, 20, 20))
+        ts = TracksSource(
+                filename,
+                points,
+                points_spec=gp.PointsSpec(roi=roi))
+        apv = AddParentVectors(
+                points,
+                pv_array,
+                mask,
+                radius)
+        request = gp.BatchRequest()
+        request_roi = gp.Roi((1, 0, 0, 0), (2, 20, 20, 20))
+        request[pv_array] = gp.ArraySpec(roi=request_roi)
+        request[mask] = gp.ArraySpec(roi=request_roi)
+
+        pipeline = ts + apv
+        with gp.build(pipeline):
+            batch = pipeline.request_batch(request)
+
+        shape = (2, 20, 20, 20)
+        expected_mask = np.zeros(shape, dtype=np.bool)
+        expected_parent_vectors = np.zeros((3,) + shape, dtype=np.float32)
+        coords = np.array(
+            np.meshgrid(*[np.arange(s) for s in shape], indexing='ij'),
+            dtype=np.float32)
+        for location, parent in zip(locations, parents):
+            t = int(location[0])
+            if t not in [1, 2]:
+                continue
+            point_mask = np.zeros(shape, dtype=np.bool)
+            point_mask[(t - 1,) + tuple(location[1:].astype(int))] = 1
+            enlarge_binary_map(point_mask, radius, (1, 1, 1, 1), in_place=True)
+            expected_mask |= point_mask
+            for c in range(3):
+                expected_parent_vectors[c][point_mask] = (
+                    locations[parent - 1][c + 1] - coords[c + 1][point_mask])
+
+        self.assertTrue(np.array_equal(
+            expected_mask.astype(np.float32), batch[mask].data))
+        self.assertTrue(np.array_equal(
+            expected_parent_vectors, batch[pv_array].data))
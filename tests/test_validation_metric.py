@@ -160,6 +160,45 @@ class TestValidationMetric(unittest.TestCase):
                 length * norm_distance(10),
                 places=self.tolerance_places)
 
+    def test_indexed_same_as_naive(self):
+        for seed in range(5):
+            gt_lineages = self.create_lineages(seed, 20)
+            rec_lineages = self.create_lineages(seed + 100, 25)
+            self.assertAlmostEqual(
+                    validation_score(
+                        gt_lineages.copy(), rec_lineages.copy(),
+                        indexed=False),
+                    validation_score(
+                        gt_lineages.copy(), rec_lineages.copy(),
+                        indexed=True),
+                    places=6)
+
+    def test_indexed_same_as_naive_inflect_point(self):
+        for inflect_point in [5, 20, 200]:
+            gt_lineages = self.create_lineages(0, 20)
+            rec_lineages = self.create_lineages(100, 25)
+            self.assertAlmostEqual(
+                    validation_score(
+                        gt_lineages.copy(), rec_lineages.copy(),
+                        indexed=False, inflect_point=inflect_point),
+                    validation_score(
+                        gt_lineages.copy(), rec_lineages.copy(),
+                        indexed=True, inflect_point=inflect_point),
+                    places=6)
+
+    def test_inflect_point(self):
+        length = 8
+        seed = 1
+        gt_track = self.create_track(length, seed=seed)
+        rec_track = self.create_track(length, seed=seed)
+        rec_track.remove_node(0)
+        for node_id in range(1, length):
+            rec_track.nodes[node_id]['x'] += 10
+        self.assertAlmostEqual(
+                track_distance(gt_track, rec_track, inflect_point=20),
+                1 + (length - 1) * norm_distance(10, inflect_point=20),
+                places=self.tolerance_places)
+
     # track creation helper
     def create_track(self, length, seed=None, min_id=0):
         zyx_range = [0, 10]
@@ -178,3 +217,34 @@ class TestValidationMetric(unittest.TestCase):
             if t > t_range[0]:
                 track.add_edge(node_id, node_id-1)
         return track
+
+    def create_lineages(self, seed, num_tracks, num_frames=20):
+        random.seed(seed)
+        lineages = nx.DiGraph()
+        node_id = 0
+        for _ in range(num_tracks):
+            start = random.randint(0, num_frames - 2)
+            end = random.randint(start + 1, num_frames)
+            position = [random.uniform(0, 300) for _ in range(3)]
+            gap = random.randint(start, end + 10*num_frames)
+            prev = None
+            for t in range(start, end):
+                # leave a gap in some tracks
+                if prev is not None and t == gap:
+                    continue
+                position = [p + random.uniform(-5, 5) for p in position]
+                lineages.add_node(
+                    node_id, t=t,
+                    z=position[0], y=position[1], x=position[2])
+                if prev is not None:
+                    lineages.add_edge(node_id, prev)
+                prev = node_id
+                node_id += 1
+                # divide
+                if random.random() < 0.05 and t + 1 < end:
+                    lineages.add_node(
+                        node_id, t=t + 1,
+                        z=position[0] + 10, y=position[1], x=position[2])
+                    lineages.add_edge(node_id, prev)
+                    node_id += 1
+        return lineages
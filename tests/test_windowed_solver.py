@@ -0,0 +1,122 @@
+import linajea.tracking
+import logging
+import daisy
+import networkx as nx
+import random
+import unittest
+
+logging.basicConfig(level=logging.INFO)
+
+
+class TestWindowedSolver(unittest.TestCase):
+
+    def create_graph(self, seed, num_cells=150, num_frames=15):
+        random.seed(seed)
+        graph = nx.DiGraph()
+        for i in range(num_cells):
+            graph.add_node(
+                i,
+                t=random.randint(0, num_frames - 1),
+                z=random.uniform(0, 20),
+                y=random.uniform(0, 20),
+                x=random.uniform(0, 20),
+                score=random.uniform(0, 1))
+        for u in range(num_cells):
+            for v in range(num_cells):
+                if graph.nodes[u]['t'] == graph.nodes[v]['t'] + 1 and \
+                        random.random() < 0.2:
+                    graph.add_edge(
+                        u, v, prediction_distance=random.uniform(0, 5))
+        roi = daisy.Roi((0, 0, 0, 0), (num_frames, 20, 20, 20))
+        return linajea.tracking.TrackGraph(graph, frame_key='t', roi=roi)
+
+    def get_parameters(self):
+        ps = {
+                "track_cost": 2.0,
+                "weight_edge_score": 0.3,
+                "weight_node_score": -2.0,
+                "selection_constant": -1.0,
+                "max_cell_move": 3.0,
+                "block_size": [5, 100, 100, 100],
+                "context": [2, 100, 100, 100],
+            }
+        return linajea.tracking.TrackingParameters(**ps)
+
+    def assert_valid_solution(self, track_graph, key):
+        for node, data in track_graph.nodes(data=True):
+            prev_edges = [
+                e for e in track_graph.prev_edges(node)
+                if track_graph.edges[e][key]]
+            next_edges = [
+                e for e in track_graph.next_edges(node)
+                if track_graph.edges[e][key]]
+            self.assertLessEqual(len(prev_edges), 1)
+            self.assertLessEqual(len(next_edges), 2)
+            if prev_edges or next_edges:
+                self.assertTrue(data[key])
+
+    def test_windows(self):
+        track_graph = self.create_graph(0)
+        solver = linajea.tracking.WindowedSolver(
+            track_graph, self.get_parameters(), 'selected', window_size=6,
+            window_overlap=2)
+        self.assertListEqual(
+            solver.windows, [(0, 6), (4, 10), (8, 14), (12, 15)])
+
+    def test_windowed_solution(self):
+        parameters = self.get_parameters()
+        for solver_type in [linajea.tracking.Solver,
+                            linajea.tracking.SparseSolver]:
+            track_graph = self.create_graph(0)
+            solver = linajea.tracking.WindowedSolver(
+                track_graph, parameters, 'selected', window_size=5,
+                window_overlap=2, solver_type=solver_type,
+                compare_to_monolithic=True)
+            solver.solve()
+            self.assert_valid_solution(track_graph, 'selected')
+            self.assertGreaterEqual(
+                solver.solution_cost, solver.monolithic_cost - 1e-6)
+            self.assertGreaterEqual(solver.objective_loss, -1e-6)
+            for _, _, data in track_graph.edges(data=True):
+                self.assertNotIn('selected_monolithic', data)
+
+    def test_track_objective_loss(self):
+        parameters = [self.get_parameters(), self.get_parameters()]
+        parameters[1].track_cost = 0.5
+        track_graph = self.create_graph(0)
+        stats = linajea.tracking.track(
+            track_graph, parameters, ['selected_0', 'selected_1'],
+            window_size=5, compare_to_monolithic=True)
+        for s in stats:
+            self.assertGreaterEqual(s['objective_loss'], -1e-6)
+            self.assertGreaterEqual(
+                s['cost'], s['monolithic_cost'] - 1e-6)
+
+        stats = linajea.tracking.track(
+            track_graph, parameters[0], 'selected', window_size=5)
+        self.assertNotIn('objective_loss', stats[0])
+        with self.assertRaises(ValueError):
+            linajea.tracking.track(
+                track_graph, parameters[0], 'selected',
+                compare_to_monolithic=True)
+
+    def test_single_window(self):
+        parameters = self.get_parameters()
+        track_graph = self.create_graph(1)
+        linajea.tracking.Solver(track_graph, parameters, 'selected').solve()
+        solver = linajea.tracking.WindowedSolver(
+            track_graph, parameters, 'windowed', window_size=20)
+        solver.solve()
+        for _, _, data in track_graph.edges(data=True):
+            self.assertEqual(data['selected'], data['windowed'])
+
+    def test_parallel_windows(self):
+        parameters = self.get_parameters()
+        track_graph = self.create_graph(2)
+        for key, num_workers in [('sequential', 1), ('parallel', 3)]:
+            solver = linajea.tracking.WindowedSolver(
+                track_graph, parameters, key, window_size=4,
+                window_overlap=2, num_workers=num_workers)
+            solver.solve()
+        for _, _, data in track_graph.edges(data=True):
+            self.assertEqual(data['sequential'], data['parallel'])
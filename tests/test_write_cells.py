@@ -1,7 +1,11 @@
 from linajea.gunpowder import WriteCells
+from linajea.gunpowder.write_cells import BulkWriter, cantor_numbers
+from funlib import math
+import gunpowder as gp
 import logging
 import unittest
 import numpy as np
+import pymongo
 
 
 try:
@@ -15,6 +19,36 @@ logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.DEBUG)
 
 
+class PredictionSource(gp.BatchProvider):
+    '''Provides maxima, cell indicator, and parent vectors with a single
+    cell in each frame.'''
+
+    def __init__(self, maxima, cell_indicator, parent_vectors, shape):
+        self.maxima = maxima
+        self.cell_indicator = cell_indicator
+        self.parent_vectors = parent_vectors
+        self.shape = shape
+
+    def setup(self):
+        roi = gp.Roi((0, 0, 0, 0), self.shape)
+        for key in [self.maxima, self.cell_indicator, self.parent_vectors]:
+            self.provides(key, gp.ArraySpec(roi=roi, voxel_size=(1, 1, 1, 1)))
+
+    def provide(self, request):
+        batch = gp.Batch()
+        for key, spec in request.array_specs.items():
+            shape = spec.roi.get_shape()
+            if key == self.parent_vectors:
+                data = np.ones((3,) + shape, dtype=np.float32)
+            else:
+                data = np.zeros(shape, dtype=np.float32)
+                data[:, 1, 1, 1] = 1
+            spec = self.spec[key].copy()
+            spec.roi = request[key].roi
+            batch[key] = gp.Array(data, spec)
+        return batch
+
+
 class WriteCellsTestCase(unittest.TestCase):
 
     def get_parent_vectors(self):
@@ -32,3 +66,78 @@ class WriteCellsTestCase(unittest.TestCase):
                          (13., 40., 67.))
         self.assertEqual(WriteCells.get_avg_pv(parent_vectors, index, 5),
                          (13., 40., 67.))
+
+    def test_get_avg_pvs(self):
+        np.random.seed(0)
+        parent_vectors = np.random.uniform(
+            -5, 5, size=(3, 2, 4, 5, 6)).astype(np.float32)
+        # all indices, including the ones at the boundary
+        indices = np.argwhere(np.ones((2, 4, 5, 6)))
+        for edge_length in [1, 3, 7]:
+            avg_pvs = WriteCells.get_avg_pvs(
+                parent_vectors, indices, edge_length)
+            self.assertEqual(avg_pvs.shape, (len(indices), 3))
+            for index, avg_pv in zip(indices, avg_pvs):
+                np.testing.assert_allclose(
+                    avg_pv,
+                    WriteCells.get_avg_pv(
+                        parent_vectors, tuple(index), edge_length),
+                    rtol=1e-5, atol=1e-5)
+
+    def test_cantor_numbers(self):
+        np.random.seed(0)
+        coordinates = np.random.randint(0, 5000, size=(1000, 4))
+        self.assertListEqual(
+            cantor_numbers(coordinates).tolist(),
+            [int(math.cantor_number(c)) for c in coordinates.tolist()])
+
+    def test_bulk_writer(self):
+        client = pymongo.MongoClient('localhost')
+        client.drop_database('test_write_cells')
+        nodes = client['test_write_cells']['nodes']
+        nodes.create_index([('id', pymongo.ASCENDING)], unique=True)
+
+        writer = BulkWriter(nodes, max_queue_size=2, bulk_size=5)
+        for begin in range(0, 20, 3):
+            # overlapping batches of cells, as from overlapping blocks
+            writer.put(
+                [{'id': i, 'score': 1.0} for i in range(begin, begin + 4)])
+        writer.close()
+        self.assertFalse(writer.is_alive())
+        self.assertEqual(writer.num_written, 22)
+        self.assertEqual(writer.num_duplicates, 6)
+        self.assertCountEqual(
+            [node['id'] for node in nodes.find()], range(22))
+        client.drop_database('test_write_cells')
+
+    def test_build_twice(self):
+        client = pymongo.MongoClient('localhost')
+        client.drop_database('test_write_cells')
+
+        maxima = gp.ArrayKey('MAXIMA')
+        cell_indicator = gp.ArrayKey('CELL_INDICATOR')
+        parent_vectors = gp.ArrayKey('PARENT_VECTORS')
+        pipeline = (
+            PredictionSource(
+                maxima, cell_indicator, parent_vectors, (4, 3, 3, 3)) +
+            WriteCells(
+                maxima,
+                cell_indicator,
+                parent_vectors,
+                score_threshold=0.5,
+                db_host='localhost',
+                db_name='test_write_cells'))
+
+        for frames in [(0, 2), (2, 4)]:
+            request = gp.BatchRequest()
+            roi = gp.Roi((frames[0], 0, 0, 0), (2, 3, 3, 3))
+            for key in [maxima, cell_indicator, parent_vectors]:
+                request[key] = gp.ArraySpec(roi=roi)
+            # a new writer has to be started for each build
+            with gp.build(pipeline):
+                pipeline.request_batch(request)
+
+        nodes = client['test_write_cells']['nodes']
+        self.assertCountEqual(
+            [node['t'] for node in nodes.find()], range(4))
+        client.drop_database('test_write_cells')